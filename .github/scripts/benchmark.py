@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""Benchmark the sync scripts against a synthetic content tree and a local backend.
+
+Generates `project_*` directories (with project.json and stage files with Enlighter Metainfo
+headers) and `templates/` in a temporary directory, then runs sync_content.main(),
+sync_templates.main(), `sync.py all` (also with a warm snapshot cache) and
+delete_drafts.delete_draft_projects() against an in-memory SQLite backend that adds the
+given latency to every request.
+
+For every scenario it reports wall time, round-trips and bytes sent/received, and compares
+them with the stored baseline: round-trips and bytes must not grow beyond the tolerance,
+wall time beyond the (looser) time tolerance.
+
+Example:
+    python .github/scripts/benchmark.py --projects 200 --stages 10 --latency-ms 20
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from enlighter_sync import snapshot_cache
+from enlighter_sync.backends import InstrumentedBackend, SQLiteBackend, set_backend
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "baseline.json")
+
+# Parameters that define a comparable benchmark run
+PARAMETERS = ("projects", "stages", "html_kb", "changed_pct", "templates", "latency_ms", "seed")
+
+
+def generate_stage_html(title, next_button_title, html_kb, rng):
+    metadata = json.dumps({"title": title, "next_button_title": next_button_title}, indent=2)
+    paragraphs = []
+    size = 0
+    while size < html_kb * 1024:
+        words = " ".join(rng.choice(("vibe", "coding", "agent", "cursor", "server", "prompt", "model", "stage")) for _ in range(40))
+        paragraph = f"<p>{words}.</p>"
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 1
+    return f"<!-- Enlighter Metainfo\n{metadata}\n-->\n<h2>{title}</h2>\n" + "\n".join(paragraphs) + "\n"
+
+
+def generate_corpus(root, args):
+    """Create the synthetic project tree and return the list of stage file paths."""
+    rng = random.Random(args.seed)
+    stage_files = []
+    for project_number in range(1, args.projects + 1):
+        project_id = 100 + project_number
+        project_dir = os.path.join(root, f"project_{project_id}_benchmark_project_{project_number}")
+        os.makedirs(project_dir)
+        with open(os.path.join(project_dir, "project.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "id": project_id,
+                "title": f"Benchmark project {project_number}",
+                "description": f"Synthetic project {project_number} used by the sync benchmark.",
+                "short_description": "Synthetic benchmark project",
+                "categories": "Benchmark",
+                "cover_url": f"https://example.com/covers/{project_id}.png",
+                "readme": f"# Benchmark project {project_number}\n\n" + "Readme text. " * 50,
+                "ides": "cursor",
+            }, f, indent=2)
+        for order_num in range(1, args.stages + 1):
+            stage_id = project_id * 1000 + order_num
+            title = f"Stage {order_num} of project {project_number}"
+            path = os.path.join(project_dir, f"{order_num}_{stage_id}_stage_{order_num}.html")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(generate_stage_html(title, "Next" if order_num < args.stages else None, args.html_kb, rng))
+            stage_files.append(path)
+
+    templates_dir = os.path.join(root, "templates")
+    os.makedirs(templates_dir)
+    for number in range(1, args.templates + 1):
+        with open(os.path.join(templates_dir, f"template_{number}.html"), "w", encoding="utf-8") as f:
+            f.write(generate_stage_html(f"Template {number}", None, 1, rng))
+    return stage_files
+
+
+def change_stage_files(stage_files, args):
+    """Append a paragraph to changed_pct percent of the stage files."""
+    rng = random.Random(args.seed + 1)
+    count = round(len(stage_files) * args.changed_pct / 100)
+    for path in rng.sample(stage_files, count):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("<p>Changed by the benchmark.</p>\n")
+    return count
+
+
+def change_template_files(root, args):
+    """Append a paragraph to changed_pct percent of the templates."""
+    rng = random.Random(args.seed + 2)
+    paths = sorted(os.listdir(os.path.join(root, "templates")))
+    count = max(1, round(len(paths) * args.changed_pct / 100))
+    for name in rng.sample(paths, count):
+        with open(os.path.join(root, "templates", name), "a", encoding="utf-8") as f:
+            f.write("<p>Changed by the benchmark.</p>\n")
+    return count
+
+
+def seed_draft_projects(backend, args, pr_number):
+    """Insert draft copies of every project and its stages for the given PR."""
+    projects = backend.table("projects").select("id, title").gt("id", 0).execute().data
+    stages = backend.table("stages").select("id, title, project_id, order_num").gt("id", 0).execute().data
+    draft_ids = {project['id']: -int(f"{project['id']}{pr_number:05d}") for project in projects}
+    backend.table("projects").insert([
+        {"id": draft_ids[project['id']], "title": project['title'], "is_draft": True} for project in projects
+    ]).execute()
+    backend.table("stages").insert([
+        {
+            "id": -int(f"{stage['id']}{pr_number:05d}"),
+            "title": stage['title'],
+            "project_id": draft_ids[stage['project_id']],
+            "order_num": stage['order_num'],
+        }
+        for stage in stages
+    ]).execute()
+
+
+def run_scenario(name, instrumented, function, results, verbose):
+    instrumented.reset()
+    output = io.StringIO()
+    started = time.perf_counter()
+    exit_code = 0
+    with contextlib.redirect_stdout(sys.stdout if verbose else output):
+        try:
+            function()
+        except SystemExit as e:
+            exit_code = e.code or 0
+    wall_time = time.perf_counter() - started
+    if exit_code:
+        print(output.getvalue())
+        raise RuntimeError(f"Scenario {name} exited with code {exit_code}")
+    results[name] = {
+        "wall_time_s": round(wall_time, 3),
+        "round_trips": instrumented.round_trips(),
+        "bytes_sent": instrumented.bytes_sent,
+        "bytes_received": instrumented.bytes_received,
+        "requests": dict(sorted(instrumented.requests.items())),
+    }
+
+
+def run_benchmark(args):
+    # The scripts read their environment at import time
+    for variable in ("GITHUB_EVENT_NAME", "PR_NUMBER", "SYNC_WATERMARK_FILE"):
+        os.environ.pop(variable, None)
+    import delete_drafts
+    import sync as sync_command
+    import sync_content
+    import sync_templates
+
+    instrumented = InstrumentedBackend(SQLiteBackend(":memory:"), latency=args.latency_ms / 1000)
+    set_backend(instrumented)
+
+    root = tempfile.mkdtemp(prefix="enlighter-bench-")
+    previous_dir = os.getcwd()
+    results = {}
+    try:
+        stage_files = generate_corpus(root, args)
+        os.chdir(root)
+
+        def sync():
+            sync_content.error_occurred = False
+            sync_content.main(["sync"])
+
+        run_scenario("content_initial", instrumented, sync, results, args.verbose)
+        run_scenario("content_noop", instrumented, sync, results, args.verbose)
+        change_stage_files(stage_files, args)
+        run_scenario("content_changed", instrumented, sync, results, args.verbose)
+        run_scenario("templates_initial", instrumented, lambda: sync_templates.main([]), results, args.verbose)
+        run_scenario("templates_noop", instrumented, lambda: sync_templates.main([]), results, args.verbose)
+        change_template_files(root, args)
+        run_scenario("templates_changed", instrumented, lambda: sync_templates.main([]), results, args.verbose)
+
+        def sync_all():
+            sync_content.error_occurred = False
+            sync_command.main(["all"])
+
+        run_scenario("all_noop", instrumented, sync_all, results, args.verbose)
+
+        # A fresh cache per run, as each CI run is a new process; the first run fills the file.
+        # Runs are minutes apart in CI, so the overlap window would hold no rows there.
+        snapshot_cache.REFRESH_OVERLAP = datetime.timedelta(0)
+        cache_path = os.path.join(root, ".enlighter_snapshot.jsonl.gz")
+        snapshot_cache.set_snapshot_cache(snapshot_cache.SnapshotCache(cache_path, source="benchmark"))
+        run_scenario("all_cache_warmup", instrumented, sync_all, {}, args.verbose)
+        snapshot_cache.set_snapshot_cache(snapshot_cache.SnapshotCache(cache_path, source="benchmark"))
+        run_scenario("all_noop_cached", instrumented, sync_all, results, args.verbose)
+        snapshot_cache.set_snapshot_cache(None)
+
+        pr_number = 4242
+        seed_draft_projects(instrumented.backend, args, pr_number)
+        delete_drafts.PR_NUMBER = pr_number
+        run_scenario("drafts_delete", instrumented, delete_drafts.delete_draft_projects, results, args.verbose)
+    finally:
+        os.chdir(previous_dir)
+        shutil.rmtree(root, ignore_errors=True)
+        set_backend(None)
+        snapshot_cache.set_snapshot_cache(None)
+    return results
+
+
+def compare_with_baseline(report, baseline, tolerance, time_tolerance):
+    """Return the list of regressions of the report compared with the baseline."""
+    regressions = []
+    for name, result in report["scenarios"].items():
+        expected = baseline["scenarios"].get(name)
+        if expected is None:
+            continue
+        for metric, allowed in (("round_trips", tolerance), ("bytes_sent", tolerance),
+                                ("bytes_received", tolerance), ("wall_time_s", time_tolerance)):
+            limit = expected[metric] * (1 + allowed)
+            if result[metric] > limit and result[metric] - expected[metric] > (0.05 if metric == "wall_time_s" else 0):
+                regressions.append(f"{name}: {metric} {result[metric]} > baseline {expected[metric]} (+{allowed:.0%})")
+    return regressions
+
+
+def print_report(report):
+    print(f"{'Scenario':<20} {'Wall time (s)':>14} {'Round-trips':>12} {'Bytes sent':>12} {'Bytes received':>15}")
+    for name, result in report["scenarios"].items():
+        print(f"{name:<20} {result['wall_time_s']:>14.3f} {result['round_trips']:>12} "
+              f"{result['bytes_sent']:>12} {result['bytes_received']:>15}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the sync scripts against a synthetic corpus.")
+    parser.add_argument("--projects", type=int, default=35, help="Number of projects (default: 35)")
+    parser.add_argument("--stages", type=int, default=6, help="Stages per project (default: 6)")
+    parser.add_argument("--html-kb", type=int, default=8, help="Approximate size of each stage in KiB (default: 8)")
+    parser.add_argument("--changed-pct", type=float, default=10, help="Percentage of stages changed between runs (default: 10)")
+    parser.add_argument("--templates", type=int, default=10, help="Number of templates (default: 10)")
+    parser.add_argument("--latency-ms", type=float, default=5, help="Latency added to every request (default: 5)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed of the synthetic corpus (default: 1)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline file to compare with")
+    parser.add_argument("--update-baseline", action="store_true", help="Store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed growth of round-trips and bytes (default: 0.1)")
+    parser.add_argument("--time-tolerance", type=float, default=0.5, help="Allowed growth of wall time (default: 0.5)")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the sync scripts")
+    args = parser.parse_args(argv)
+
+    report = {
+        "parameters": {parameter: getattr(args, parameter) for parameter in PARAMETERS},
+        "scenarios": run_benchmark(args),
+    }
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"\nBaseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline found at {args.baseline}, skipping comparison")
+        return
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["parameters"] != report["parameters"]:
+        print("\nBaseline was recorded with different parameters, skipping comparison")
+        return
+
+    regressions = compare_with_baseline(report, baseline, args.tolerance, args.time_tolerance)
+    if regressions:
+        print("\nERROR: Regressions compared with the baseline:")
+        for regression in regressions:
+            print(f"- {regression}")
+        exit(1)
+    print("\nNo regressions compared with the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""Check the external URLs referenced by the content.
+
+Extracts every external URL from the stage HTML files (src and href attributes, outside of
+comments) and from the cover_url of project.json, then checks them concurrently with HEAD
+requests (falling back to a one-byte ranged GET for servers that don't allow HEAD). Network
+errors are retried like overloaded responses. Broken URLs (404/410, or still unreachable) fail
+the check; images larger than SYNC_ASSET_MAX_IMAGE_KB are flagged.
+
+Results are kept in a persistent cache, at the path in SYNC_ASSET_CACHE (default:
+.enlighter_assets.json; set it to an empty string to disable the cache). URLs that were fine
+when checked less than SYNC_ASSET_RECHECK_HOURS ago are not requested again; older ones are
+revalidated with If-None-Match/If-Modified-Since, so unchanged assets answer 304 without a body.
+"""
+import argparse
+import datetime
+import glob
+import html.parser
+import json
+import os
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from enlighter_sync.concurrency import AdaptiveLimiter, is_overload_status, run_concurrently
+from enlighter_sync.metrics import metrics
+
+# Bump when the layout of the cache entries changes
+CACHE_VERSION = 1
+
+ASSET_CACHE = os.environ.get("SYNC_ASSET_CACHE", ".enlighter_assets.json")
+ASSET_RECHECK_HOURS = float(os.environ.get("SYNC_ASSET_RECHECK_HOURS", "24"))
+ASSET_MAX_IMAGE_KB = int(os.environ.get("SYNC_ASSET_MAX_IMAGE_KB", "1024"))
+ASSET_TIMEOUT = float(os.environ.get("SYNC_ASSET_TIMEOUT", "15"))
+
+# URLs are checked concurrently, with at most SYNC_ASSET_CONCURRENCY requests in flight
+ASSET_CONCURRENCY = int(os.environ.get("SYNC_ASSET_CONCURRENCY", "8"))
+limiter = AdaptiveLimiter(ASSET_CONCURRENCY)
+
+USER_AGENT = "enlighter-content-asset-checker"
+
+# Statuses that mean the URL is gone; other errors (e.g. 403 from sites that block bots) are only warnings
+BROKEN_STATUSES = (404, 410)
+# Servers that don't support HEAD answer with one of these
+HEAD_UNSUPPORTED_STATUSES = (403, 405, 501)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp", ".svg", ".avif")
+
+
+class AssetCheckError(Exception):
+    """A check that got an overloaded response, so run_concurrently retries it."""
+
+    def __init__(self, url, status_code):
+        super().__init__(f"{url} answered {status_code}")
+        self.status_code = status_code
+
+
+class UrlExtractor(html.parser.HTMLParser):
+    """Collect the external URLs of src and href attributes; comments are skipped by the parser."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.urls = []
+
+    def handle_starttag(self, tag, attrs):
+        for name, value in attrs:
+            if name in ("src", "href") and value and value.strip().startswith(("http://", "https://")):
+                self.urls.append((value.strip(), tag == "img" or name == "src"))
+
+
+def normalize_url(url):
+    """Drop the fragment, which is never sent to the server."""
+    return urllib.parse.urldefrag(url)[0]
+
+
+def extract_urls(project_dirs):
+    """Map every external URL to its references: the files using it, and whether it is embedded (an image or other resource)."""
+    references = {}
+
+    def add(url, path, embedded):
+        reference = references.setdefault(normalize_url(url), {"files": set(), "embedded": False})
+        reference["files"].add(path)
+        reference["embedded"] = reference["embedded"] or embedded
+
+    for project_dir in project_dirs:
+        project_json_path = os.path.join(project_dir, "project.json")
+        if os.path.exists(project_json_path):
+            try:
+                with open(project_json_path, 'r', encoding='utf-8') as f:
+                    cover_url = json.load(f).get('cover_url')
+            except Exception as e:
+                print(f"Skipping {project_json_path}: {e}")
+                cover_url = None
+            if cover_url and cover_url.startswith(("http://", "https://")):
+                add(cover_url, project_json_path, True)
+
+        for html_file in sorted(glob.glob(f"{project_dir}/*.html")):
+            extractor = UrlExtractor()
+            with open(html_file, 'r', encoding='utf-8') as f:
+                extractor.feed(f.read())
+            extractor.close()
+            for url, embedded in extractor.urls:
+                add(url, html_file, embedded)
+    return references
+
+
+def load_cache(path):
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            stored = json.load(f)
+    except Exception as e:
+        print(f"WARNING: Could not read the asset cache {path} ({e}), checking every URL")
+        return {}
+    if stored.get("version") != CACHE_VERSION:
+        return {}
+    return stored.get("urls", {})
+
+
+def save_cache(path, entries):
+    if not path:
+        return
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump({"version": CACHE_VERSION, "urls": dict(sorted(entries.items()))}, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def is_fresh(entry, now):
+    """Whether a cached result can be reused without a request: the URL was fine when last checked, recently."""
+    if not entry or entry.get("error") or not entry.get("status") or entry["status"] >= 400:
+        return False
+    checked_at = datetime.datetime.fromisoformat(entry["checked_at"])
+    return now - checked_at < datetime.timedelta(hours=ASSET_RECHECK_HOURS)
+
+
+class SameMethodRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Follow redirects with the original method, so a HEAD request doesn't turn into a full download."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        redirected = super().redirect_request(req, fp, code, msg, headers, newurl)
+        if redirected is not None:
+            redirected.method = req.get_method()
+        return redirected
+
+
+opener = urllib.request.build_opener(SameMethodRedirectHandler)
+
+
+def request_url(url, method, headers):
+    """Send a request and return its status and headers; error statuses don't raise."""
+    request = urllib.request.Request(url, method=method, headers={"User-Agent": USER_AGENT, **headers})
+    try:
+        with opener.open(request, timeout=ASSET_TIMEOUT) as response:
+            return response.status, response.headers
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers
+
+
+def response_size(status, headers):
+    """Total size of the resource: from Content-Range for a ranged response, otherwise Content-Length."""
+    content_range = headers.get("Content-Range", "")
+    if status == 206 and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+    content_length = headers.get("Content-Length")
+    return int(content_length) if content_length and content_length.isdigit() else None
+
+
+def check_url(url, cached, now):
+    """Check one URL, revalidating the cached result if there is one, and return the new cache entry."""
+    conditional = {}
+    if cached and not cached.get("error") and cached.get("status", 500) < 400:
+        if cached.get("etag"):
+            conditional["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            conditional["If-Modified-Since"] = cached["last_modified"]
+
+    status, headers = request_url(url, "HEAD", conditional)
+    if status in HEAD_UNSUPPORTED_STATUSES:
+        status, headers = request_url(url, "GET", {**conditional, "Range": "bytes=0-0"})
+    if is_overload_status(status):
+        raise AssetCheckError(url, status)
+    if status == 304:
+        return {**cached, "checked_at": now.isoformat(), "revalidated": True}
+
+    return {
+        "status": status,
+        "etag": headers.get("ETag"),
+        "last_modified": headers.get("Last-Modified"),
+        "size": response_size(status, headers),
+        "content_type": headers.get("Content-Type"),
+        "checked_at": now.isoformat(),
+    }
+
+
+def is_image(url, entry):
+    content_type = (entry.get("content_type") or "").split(";")[0].strip()
+    if content_type:
+        return content_type.startswith("image/")
+    return urllib.parse.urlparse(url).path.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def check_assets(project_dirs, cache_path=ASSET_CACHE, max_image_kb=ASSET_MAX_IMAGE_KB, embedded_only=False):
+    """Check the URLs of the given projects and return the report: counters and the broken, oversized and suspicious URLs."""
+    metrics.switch_phase("discovery")
+    references = extract_urls(project_dirs)
+    if embedded_only:
+        references = {url: reference for url, reference in references.items() if reference["embedded"]}
+    print(f"Found {len(references)} external URL(s) in {len(project_dirs)} project(s)")
+
+    cache = load_cache(cache_path)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    to_check = sorted(url for url in references if not is_fresh(cache.get(url), now))
+    print(f"Checking {len(to_check)} URL(s), {len(references) - len(to_check)} unchanged since their last check")
+
+    metrics.switch_phase("check")
+    results = run_concurrently(
+        [lambda url=url: check_url(url, cache.get(url), now) for url in to_check],
+        limiter,
+    )
+    metrics.switch_phase(None)
+
+    revalidated = 0
+    for url, (entry, error) in zip(to_check, results):
+        if error is not None:
+            entry = {"status": getattr(error, "status_code", None), "error": str(error), "checked_at": now.isoformat()}
+        elif entry.pop("revalidated", False):
+            revalidated += 1
+        cache[url] = entry
+
+    broken, oversized, warnings = [], [], []
+    for url, reference in sorted(references.items()):
+        entry = cache[url]
+        item = {"url": url, "status": entry.get("status"), "files": sorted(reference["files"])}
+        if entry.get("error") and entry.get("status") is None or entry.get("status") in BROKEN_STATUSES:
+            broken.append({**item, "error": entry.get("error")})
+        elif entry.get("error") or entry["status"] >= 400:
+            warnings.append({**item, "error": entry.get("error")})
+        elif is_image(url, entry) and entry.get("size") and entry["size"] > max_image_kb * 1024:
+            oversized.append({**item, "size": entry["size"]})
+
+    # Only URLs still referenced are kept, so the cache doesn't grow with removed content
+    try:
+        save_cache(cache_path, {url: cache[url] for url in references})
+    except Exception as e:
+        print(f"WARNING: Could not save the asset cache: {e}")
+
+    return {
+        "counters": {
+            "urls": len(references),
+            "checked": len(to_check),
+            "cached": len(references) - len(to_check),
+            "revalidated": revalidated,
+            "broken": len(broken),
+            "oversized": len(oversized),
+            "warnings": len(warnings),
+        },
+        "broken": broken,
+        "oversized": oversized,
+        "warnings": warnings,
+    }
+
+
+def print_report(report, max_image_kb):
+    for item in report["broken"]:
+        print(f"BROKEN: {item['url']} ({item['error'] or item['status']}) in {', '.join(item['files'])}")
+    for item in report["oversized"]:
+        print(f"OVERSIZED: {item['url']} ({item['size'] / 1024:.0f} KB image, limit {max_image_kb} KB) in {', '.join(item['files'])}")
+    for item in report["warnings"]:
+        print(f"WARNING: {item['url']} ({item['error'] or item['status']}) in {', '.join(item['files'])}")
+
+    counters = report["counters"]
+    print("\nSummary:")
+    print(f"- External URLs: {counters['urls']}")
+    print(f"- Checked: {counters['checked']} ({counters['revalidated']} unchanged, revalidated)")
+    print(f"- Reused from the cache: {counters['cached']}")
+    print(f"- Broken: {counters['broken']}")
+    print(f"- Oversized images: {counters['oversized']}")
+    print(f"- Warnings: {counters['warnings']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the external URLs of the stage files and project covers.")
+    parser.add_argument("projects", nargs="*", help="Project directories to check (default: all project_* directories)")
+    parser.add_argument("--max-image-kb", type=int, default=ASSET_MAX_IMAGE_KB, help=f"Flag images larger than this (default: {ASSET_MAX_IMAGE_KB})")
+    parser.add_argument("--embedded-only", action="store_true", help="Only check embedded resources (src attributes and covers), not links")
+    parser.add_argument("--fail-on-oversized", action="store_true", help="Also fail when an image is larger than --max-image-kb")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+    metrics.start("check_assets")
+
+    report = check_assets(sorted(args.projects or glob.glob("project_*")), max_image_kb=args.max_image_kb, embedded_only=args.embedded_only)
+    print_report(report, args.max_image_kb)
+    metrics.set_counters(report["counters"])
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if report["broken"] or (args.fail_on_oversized and report["oversized"]):
+        print("\nERROR: Broken or oversized assets found. Failing CI.")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
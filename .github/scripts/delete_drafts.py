@@ -1,12 +1,14 @@
 #!/usr/bin/env python3
 import os
 import re
-from supabase import create_client
+import json
+import argparse
+import datetime
 
-# Initialize Supabase client
-url = os.environ.get("SUPABASE_URL")
-key = os.environ.get("SUPABASE_KEY")
-supabase = create_client(url, key)
+from enlighter_sync.backends import get_backend
+from enlighter_sync.metrics import metrics
+from enlighter_sync.snapshot_cache import get_snapshot_cache, parse_timestamp
+from enlighter_sync.writer import BatchWriter
 
 # Check if we're in a pull request context
 IS_PULL_REQUEST = os.environ.get("GITHUB_EVENT_NAME") == "pull_request"
@@ -31,113 +33,196 @@ if IS_PULL_REQUEST:
 # Draft project and stage IDs use the format: -<id_project><PR_NUMBER:5 digits with leading zeros>
 # For example, if a project has ID 42 and PR_NUMBER is 123, its draft ID would be -42000123
 
-def delete_stage_from_supabase(stage_id):
-    """Delete a stage from Supabase by ID."""
-    response = (
-        supabase.table("stages")
-        .delete()
-        .eq("id", stage_id)
-        .execute()
-    )
-    return response
-
-def delete_project_from_supabase(project_id):
-    """Delete a project from Supabase by ID."""
-    response = (
-        supabase.table("projects")
-        .delete()
-        .eq("id", project_id)
-        .execute()
-    )
-    return response
+# Draft IDs are matched with `in` filters of at most this many IDs, to keep request URLs short
+DELETE_FILTER_CHUNK = int(os.environ.get("SYNC_FILTER_CHUNK", "200"))
+
+# The sweep reads all draft projects in pages, as PostgREST caps a single response (1000 rows by default)
+SWEEP_PAGE_SIZE = int(os.environ.get("SYNC_PAGE_SIZE", "1000"))
+
+def get_draft_id(original_id, pr_number):
+    """Get the draft ID of a project in a pull request."""
+    return -int(f"{original_id}{pr_number:05d}")
+
+def get_pull_request_draft_projects(pr_number):
+    """
+    Get the draft projects of a pull request among all draft projects in Supabase, by decoding their IDs.
+    Unlike IDs derived from the checkout, this also finds the drafts of projects that the pull request
+    deleted or re-numbered. Each project gets its original ID as 'original_id'.
+    """
+    drafts = []
+    for project in get_all_draft_projects():
+        decoded = decode_draft_id(project['id'])
+        if decoded is not None and decoded[1] == pr_number:
+            drafts.append({**project, 'original_id': decoded[0]})
+    return drafts
 
 def delete_draft_projects():
     """Delete draft projects created in the current pull request and their associated stages from Supabase."""
     print("\nDeleting draft projects and stages created in this pull request...")
 
-    # Get all draft projects (negative IDs)
-    response = (
-        supabase.table("projects")
-        .select("id, title")
-        .lt("id", 0)  # Draft projects have negative IDs
-        .execute()
-    )
+    metrics.switch_phase("remote_read")
+    draft_projects = get_pull_request_draft_projects(PR_NUMBER)
 
-    if not response.data:
+    if not draft_projects:
+        metrics.switch_phase(None)
         print("No draft projects found to delete.")
         return
 
-    draft_projects = response.data
-    print(f"Found {len(draft_projects)} total draft projects.")
-
-    deleted_projects_count = 0
-    deleted_stages_count = 0
-
+    print(f"Found {len(draft_projects)} draft projects created in the current PR (PR #{PR_NUMBER}).")
     for project in draft_projects:
-        project_id = project['id']
-        project_title = project['title']
-
-        # Calculate the original project ID from the draft ID
-        # Try the new format first: -<id_project><PR_NUMBER:5 digits with leading zeros>
-        # For example, if draft_id=-42000123, the original ID would be 42
-        project_id_str = str(-project_id)
-        if len(project_id_str) >= 6:  # At least 1 digit for project ID + 5 digits for PR number
-            # Extract the PR number from the draft ID (last 5 digits)
-            draft_pr_number = int(project_id_str[-5:])
-            # Extract the original project ID (all digits except the last 5)
-            original_id = int(project_id_str[:-5])
-
-            # If the PR number from the draft ID matches the current PR number,
-            # then this draft was created in the current PR
-            if draft_pr_number == PR_NUMBER:
-                print(f"Draft project {project_id} was created in the current PR (PR #{PR_NUMBER})")
-            else:
-                print(f"Draft project {project_id} was created in PR #{draft_pr_number}, not the current PR (#{PR_NUMBER})")
-        else:
-            # Skip projects with invalid format
-            print(f"Skipping draft project {project_id} as it doesn't use the expected format")
-            continue
-
-        # Skip this draft project if it was created in a different PR
-        # We only want to delete drafts from the current PR
-        if len(project_id_str) >= 6 and draft_pr_number != PR_NUMBER:
-            print(f"Skipping draft project {project_id} ({project_title}) as it was created in PR #{draft_pr_number}, not the current PR (#{PR_NUMBER})")
-            continue
+        print(f"Deleting draft project {project['id']} ({project['title']}) with original ID {project['original_id']} and its stages")
+
+    delete_projects_with_stages([project['id'] for project in draft_projects])
+
+def delete_projects_with_stages(project_ids):
+    """
+    Delete draft projects and their stages in chunks, print the deletion summary,
+    and exit with an error if any chunk failed.
+    """
+    # Stages are deleted before their project; chunks of projects are deleted concurrently
+    writer = BatchWriter(chunk_size=DELETE_FILTER_CHUNK)
+    for project_id in project_ids:
+        writer.delete_project(project_id)
+    failures = writer.flush()
+
+    metrics.set_counters({
+        "deleted_projects": writer.deleted_projects,
+        "deleted_stages": writer.deleted_stages,
+    })
+    print_deletion_summary(writer.deleted_projects, writer.deleted_stages)
+
+    if failures:
+        exit(1)
 
-        print(f"Processing draft project {project_id} ({project_title}) with original ID {original_id}")
+def print_deletion_summary(deleted_projects_count, deleted_stages_count):
+    print(f"\nDeletion summary:")
+    print(f"- Deleted draft projects: {deleted_projects_count}")
+    print(f"- Deleted draft stages: {deleted_stages_count}")
+    print(f"- Total deleted entities: {deleted_projects_count + deleted_stages_count}")
 
-        # Get all stages for this project
-        stages_response = (
-            supabase.table("stages")
+def decode_draft_id(draft_id):
+    """Decode a draft ID into (original ID, PR number), or None if it doesn't use the expected format."""
+    draft_id_str = str(-draft_id)
+    # At least 1 digit for the original ID + 5 digits for the PR number
+    if len(draft_id_str) < 6:
+        return None
+    return int(draft_id_str[:-5]), int(draft_id_str[-5:])
+
+def read_open_pull_requests(value=None, path=None):
+    """
+    Read the open pull requests from a comma-separated argument and/or a file, as a mapping of
+    their numbers to their last activity (an ISO timestamp, or None if unknown). The file may list
+    numbers separated by whitespace or commas, or hold the JSON output of
+    `gh pr list --json number,updatedAt`, which is the only source of the last activity.
+    """
+    def parse_numbers(text):
+        return {int(number): None for number in re.split(r"[\s,]+", text) if number}
+
+    pull_requests = parse_numbers(value or "")
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        if content.lstrip().startswith("["):
+            for item in json.loads(content):
+                if isinstance(item, dict):
+                    pull_requests[int(item['number'])] = item.get('updatedAt') or pull_requests.get(int(item['number']))
+                else:
+                    pull_requests.setdefault(int(item), None)
+        else:
+            for number in parse_numbers(content):
+                pull_requests.setdefault(number, None)
+    return pull_requests
+
+def get_all_draft_projects():
+    """Get all draft projects (negative IDs), page by page."""
+    cache = get_snapshot_cache()
+    if cache is not None:
+        drafts = [project for project in cache.select("projects", "id, title") if project['id'] < 0]
+        return sorted(drafts, key=lambda project: project['id'])
+    projects = []
+    while True:
+        response = (
+            get_backend().table("projects")
             .select("id, title")
-            .eq("project_id", project_id)
+            .lt("id", 0)  # Draft projects have negative IDs
+            .order("id")
+            .range(len(projects), len(projects) + SWEEP_PAGE_SIZE - 1)
             .execute()
         )
+        projects.extend(response.data)
+        if len(response.data) < SWEEP_PAGE_SIZE:
+            return projects
+
+def sweep_draft_projects(open_pull_requests, max_age_days=None, apply=False):
+    """
+    Delete the drafts of all pull requests that are closed, or that had no activity for more than
+    max_age_days. Lists the drafts to delete first, and only deletes them if apply is set.
+    """
+    print(f"\nSweeping draft projects of closed pull requests (open: {', '.join(f'#{number}' for number in sorted(open_pull_requests)) or 'none'})"
+          + (f" and of pull requests inactive for more than {max_age_days} days" if max_age_days is not None else ""))
+
+    metrics.switch_phase("remote_read")
+    draft_projects = get_all_draft_projects()
+    metrics.switch_phase(None)
+
+    to_delete = select_drafts_to_sweep(draft_projects, open_pull_requests, max_age_days, apply)
+    if not to_delete:
+        return
+    if not apply:
+        print("Dry run: nothing was deleted. Run with --apply to delete these draft projects and their stages.")
+        return
 
-        if stages_response.data:
-            stages = stages_response.data
-            print(f"Found {len(stages)} stages for draft project {project_id} ({project_title})")
+    delete_projects_with_stages(to_delete)
 
-            # Delete all stages for this project
-            for stage in stages:
-                stage_id = stage['id']
-                stage_title = stage['title']
-                print(f"Deleting draft stage {stage_id} ({stage_title})")
-                delete_stage_from_supabase(stage_id)
-                deleted_stages_count += 1
+def select_drafts_to_sweep(draft_projects, open_pull_requests, max_age_days=None, apply=False):
+    """
+    Select the draft projects of closed pull requests and of stale pull requests, and return their IDs.
 
-        # Delete the project
-        print(f"Deleting draft project {project_id} ({project_title})")
-        delete_project_from_supabase(project_id)
-        deleted_projects_count += 1
+    `open_pull_requests` maps the numbers of the open pull requests to their last activity. The age
+    is that of the pull request, not of the draft project row, which a sync only rewrites when
+    project.json changes. Drafts of open pull requests whose last activity is unknown are kept.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
 
-    print(f"\nDeletion summary:")
-    print(f"- Deleted draft projects: {deleted_projects_count}")
-    print(f"- Deleted draft stages: {deleted_stages_count}")
-    print(f"- Total deleted entities: {deleted_projects_count + deleted_stages_count}")
+    to_delete = []
+    for project in draft_projects:
+        decoded = decode_draft_id(project['id'])
+        if decoded is None:
+            print(f"Skipping draft project {project['id']} as it doesn't use the expected format")
+            continue
+        original_id, draft_pr_number = decoded
 
-def main():
-    delete_draft_projects()
+        if draft_pr_number not in open_pull_requests:
+            reason = f"PR #{draft_pr_number} is closed"
+        elif (max_age_days is not None and open_pull_requests[draft_pr_number]
+                and now - parse_timestamp(open_pull_requests[draft_pr_number]) > datetime.timedelta(days=max_age_days)):
+            reason = f"PR #{draft_pr_number} is open, but was last updated on {open_pull_requests[draft_pr_number]}"
+        else:
+            continue
+        to_delete.append(project['id'])
+        print(f"{'Deleting' if apply else 'Would delete'} draft project {project['id']} ({project['title']}) with original ID {original_id}: {reason}")
+
+    print(f"\nFound {len(draft_projects)} draft projects, {len(to_delete)} to delete.")
+    return to_delete
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Delete draft projects and their stages from Supabase.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("pr", help="Delete the drafts created in the current pull request, from PR_NUMBER (default)")
+    sweep_parser = subparsers.add_parser("sweep", help="Delete the drafts of closed and stale pull requests")
+    sweep_parser.add_argument("--open-prs", help="Comma-separated numbers of the open pull requests")
+    sweep_parser.add_argument("--open-prs-file", help="File with the numbers of the open pull requests, or the JSON output of `gh pr list --json number,updatedAt`")
+    sweep_parser.add_argument("--max-age-days", type=int, help="Also delete drafts of open pull requests without activity for this many days (needs updatedAt in --open-prs-file)")
+    sweep_parser.add_argument("--apply", action="store_true", help="Delete the listed drafts; without it, the sweep only lists them")
+    args = parser.parse_args(argv)
+    metrics.start("delete_drafts")
+
+    if args.command == "sweep":
+        if args.open_prs is None and args.open_prs_file is None:
+            parser.error("sweep needs the open pull requests: pass --open-prs and/or --open-prs-file")
+        sweep_draft_projects(read_open_pull_requests(args.open_prs, args.open_prs_file), args.max_age_days, args.apply)
+    else:
+        delete_draft_projects()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1 @@
+"""Helpers shared by the content sync scripts in .github/scripts."""
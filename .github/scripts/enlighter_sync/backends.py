@@ -0,0 +1,638 @@
+"""Storage backends for the sync scripts.
+
+The scripts access their tables through the supabase-py query builder API:
+`get_backend().table("stages").select("id, title").eq("project_id", 42).execute()`.
+A backend provides that API:
+
+- SupabaseBackend sends requests with a postgrest client, which is only imported and created on first use.
+- SQLiteBackend implements the subset of the API used by the scripts on top of sqlite3,
+  so the scripts can run end-to-end offline, in tests and in benchmarks.
+- InstrumentedBackend wraps another backend to count requests and bytes and to inject latency.
+  Backends created from the environment are instrumented and report to enlighter_sync.metrics.
+
+The backend is chosen by the SYNC_BACKEND environment variable: `supabase` (default),
+`sqlite` (in memory) or `sqlite:<path>`. Use set_backend() to inject one directly.
+
+With SYNC_GZIP_REQUESTS=1, request bodies to Supabase of at least SYNC_GZIP_MIN_BYTES bytes
+are sent gzip-compressed. PostgREST itself doesn't decode compressed request bodies, so only
+enable it when the gateway in front of PostgREST does.
+"""
+import datetime
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from enlighter_sync.metrics import metrics
+
+# Tables used by the sync scripts and their columns, for the SQLite backend.
+# Boolean columns are stored as integers and converted back when rows are read.
+SCHEMA = {
+    "projects": {
+        "id": "INTEGER PRIMARY KEY",
+        "title": "TEXT NOT NULL",
+        "description": "TEXT",
+        "short_description": "TEXT",
+        "categories": "TEXT",
+        "cover_url": "TEXT",
+        "readme": "TEXT",
+        "ides": "TEXT",
+        "enabled": "BOOLEAN DEFAULT 0",
+        "visible": "BOOLEAN DEFAULT 0",
+        "available_in_web": "BOOLEAN DEFAULT 0",
+        "is_draft": "BOOLEAN DEFAULT 0",
+        "source_project_id": "INTEGER",
+        "content_hash": "TEXT",
+        "created_at": "TEXT DEFAULT CURRENT_TIMESTAMP",
+        "updated_at": "TEXT DEFAULT CURRENT_TIMESTAMP",
+    },
+    "stages": {
+        "id": "INTEGER PRIMARY KEY",
+        "title": "TEXT NOT NULL",
+        "description": "TEXT",
+        "github_file_url": "TEXT",
+        "next_button_title": "TEXT",
+        "enabled": "BOOLEAN DEFAULT 1",
+        "project_id": "INTEGER",
+        "order_num": "INTEGER",
+        "source_stage_id": "INTEGER",
+        "content_hash": "TEXT",
+        "created_at": "TEXT DEFAULT CURRENT_TIMESTAMP",
+        "updated_at": "TEXT DEFAULT CURRENT_TIMESTAMP",
+    },
+    "content_templates": {
+        "id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+        "name": "TEXT NOT NULL UNIQUE",
+        "template": "TEXT",
+        "content_hash": "TEXT",
+        "created_at": "TEXT DEFAULT CURRENT_TIMESTAMP",
+        "updated_at": "TEXT DEFAULT CURRENT_TIMESTAMP",
+    },
+    "project_bundles": {
+        "project_id": "INTEGER PRIMARY KEY",
+        "hash": "TEXT NOT NULL",
+        "version": "INTEGER NOT NULL",
+        "stage_count": "INTEGER NOT NULL",
+        "size": "INTEGER NOT NULL",
+        "gzip_size": "INTEGER NOT NULL",
+        "brotli_size": "INTEGER",
+        "gzip": "TEXT NOT NULL",
+        "brotli": "TEXT",
+        "updated_at": "TEXT DEFAULT CURRENT_TIMESTAMP",
+    },
+    "sync_state": {
+        "key": "TEXT PRIMARY KEY",
+        "value": "TEXT NOT NULL",
+        "updated_at": "TEXT DEFAULT CURRENT_TIMESTAMP",
+    },
+    "sync_journal": {
+        "id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+        "run": "TEXT NOT NULL",
+        "commit_sha": "TEXT NOT NULL",
+        "action": "TEXT NOT NULL",
+        "target_id": "INTEGER",
+        "digest": "TEXT NOT NULL",
+        "created_at": "TEXT DEFAULT CURRENT_TIMESTAMP",
+    },
+}
+
+GZIP_REQUESTS = os.environ.get("SYNC_GZIP_REQUESTS", "") in ("1", "true")
+GZIP_MIN_BYTES = int(os.environ.get("SYNC_GZIP_MIN_BYTES", "1024"))
+
+# Connections kept open to Supabase, and how long an idle connection is kept, in seconds
+POOL_SIZE = int(os.environ.get("SYNC_POOL_SIZE", "10"))
+KEEPALIVE_EXPIRY = 30.0
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Get the backend of this process, creating it from the environment on first use."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend_from_env()
+        return _backend
+
+
+def set_backend(backend):
+    """Inject the backend used by the sync scripts (e.g. an SQLiteBackend in tests)."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def create_backend_from_env():
+    name = os.environ.get("SYNC_BACKEND", "supabase")
+    if name == "supabase":
+        backend = SupabaseBackend(
+            os.environ.get("SUPABASE_URL"),
+            os.environ.get("SUPABASE_KEY"),
+            gzip_min_bytes=GZIP_MIN_BYTES if GZIP_REQUESTS else None,
+            metrics=metrics,
+        )
+        return InstrumentedBackend(backend, metrics=metrics)
+    if name == "sqlite" or name.startswith("sqlite:"):
+        return InstrumentedBackend(SQLiteBackend(name.partition(":")[2] or ":memory:"), metrics=metrics)
+    raise ValueError(f"Unknown SYNC_BACKEND '{name}', expected 'supabase', 'sqlite' or 'sqlite:<path>'")
+
+
+class BackendError(Exception):
+    """A failed request; `code` mirrors the error code reported by PostgREST."""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+
+class BackendResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class SupabaseBackend:
+    """Backend that forwards every request to Supabase's REST API (PostgREST).
+
+    The client is created on first use, so runs that never talk to Supabase (--help, a PR
+    without content changes) don't pay for the import and the connection setup. Only the
+    postgrest client is imported: table queries are all the scripts need, and it is much
+    lighter than the full supabase client (auth, storage, realtime, functions).
+    All requests share one pooled keep-alive transport, see SyncTransport.
+    """
+
+    def __init__(self, url, key, gzip_min_bytes=None, pool_size=POOL_SIZE, metrics=None):
+        self.url = url
+        self.key = key
+        self.gzip_min_bytes = gzip_min_bytes
+        self.pool_size = pool_size
+        self.metrics = metrics
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                started = time.perf_counter()
+                # Imported here, so scripts that never talk to Supabase don't pay for the import
+                import httpx
+                from postgrest import SyncPostgrestClient
+                from postgrest.constants import DEFAULT_POSTGREST_CLIENT_HEADERS, DEFAULT_POSTGREST_CLIENT_TIMEOUT
+
+                base_url = f"{self.url.rstrip('/')}/rest/v1"
+                headers = {**DEFAULT_POSTGREST_CLIENT_HEADERS, "apikey": self.key, "Authorization": f"Bearer {self.key}"}
+                http_client = httpx.Client(
+                    transport=SyncTransport(self.pool_size, self.gzip_min_bytes, self.metrics),
+                    base_url=base_url,
+                    headers=headers,
+                    timeout=DEFAULT_POSTGREST_CLIENT_TIMEOUT,
+                    follow_redirects=True,
+                )
+                self._client = SyncPostgrestClient(base_url, headers=headers, http_client=http_client)
+                if self.metrics is not None:
+                    self.metrics.record_client_init(time.perf_counter() - started)
+            return self._client
+
+    def table(self, name):
+        return self.client.from_(name)
+
+
+class SyncTransport:
+    """httpx transport shared by all requests of the process.
+
+    Wraps a pooled keep-alive HTTPTransport, which speaks HTTP/2 when the h2 package is installed
+    (`pip install h2`), so concurrent requests reuse a few connections. New connections and the
+    HTTP versions of responses are reported to `metrics`, if given. If gzip_min_bytes is set,
+    request bodies of at least that many bytes are gzip-compressed.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, gzip_min_bytes=None, metrics=None):
+        import httpx
+
+        try:
+            import h2  # noqa: F401
+            self.http2 = True
+        except ImportError:
+            self.http2 = False
+        self.transport = httpx.HTTPTransport(
+            http2=self.http2,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size, keepalive_expiry=KEEPALIVE_EXPIRY),
+        )
+        self.gzip_min_bytes = gzip_min_bytes
+        self.metrics = metrics
+        self._connecting = threading.local()
+
+    def handle_request(self, request):
+        import httpx
+
+        if self.gzip_min_bytes is not None:
+            body = request.read()
+            if len(body) >= self.gzip_min_bytes and "content-encoding" not in request.headers:
+                headers = httpx.Headers([(name, value) for name, value in request.headers.multi_items() if name.lower() != "content-length"])
+                headers["Content-Encoding"] = "gzip"
+                request = httpx.Request(
+                    request.method, request.url, headers=headers, content=gzip.compress(body, mtime=0), extensions=request.extensions,
+                )
+        if self.metrics is not None:
+            request.extensions = {**request.extensions, "trace": self._tracer(request.extensions.get("trace"))}
+        response = self.transport.handle_request(request)
+        if self.metrics is not None:
+            http_version = response.extensions.get("http_version", b"")
+            self.metrics.record_http_version(http_version.decode("ascii", "replace") if isinstance(http_version, bytes) else str(http_version))
+        return response
+
+    def _tracer(self, previous):
+        # httpcore reports the steps of a request to the trace callback, including new connections
+        def trace(event_name, info):
+            if event_name == "connection.connect_tcp.started":
+                self._connecting.started = time.perf_counter()
+            elif event_name in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+                elapsed = time.perf_counter() - getattr(self._connecting, "started", time.perf_counter())
+                self._connecting.started = time.perf_counter()
+                self.metrics.record_connection(elapsed, opened=event_name == "connection.connect_tcp.complete")
+            if previous is not None:
+                previous(event_name, info)
+        return trace
+
+    def close(self):
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class SQLiteBackend:
+    """Local stand-in for Supabase, storing the tables of SCHEMA in an SQLite database."""
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock:
+            for table, columns in SCHEMA.items():
+                definition = ", ".join(f"{column} {column_type}" for column, column_type in columns.items())
+                self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} ({definition})")
+
+    def table(self, name):
+        if name not in SCHEMA:
+            raise BackendError(f'relation "public.{name}" does not exist', "42P01")
+        return SQLiteQuery(self, name)
+
+    def close(self):
+        self.connection.close()
+
+
+def _primary_key(table):
+    return next(column for column, column_type in SCHEMA[table].items() if "PRIMARY KEY" in column_type)
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+class SQLiteQuery:
+    """Query builder with the same call chain as supabase-py, executed against SQLite."""
+
+    def __init__(self, backend, table):
+        self.backend = backend
+        self.table = table
+        self.columns = SCHEMA[table]
+        self.method = None
+        self.selected = None
+        self.payload = None
+        self.on_conflict = None
+        self.count = None
+        self.returning = "representation"
+        self.filters = []
+        self.ordering = []
+        self.offset = None
+        self.row_limit = None
+
+    # Request methods
+
+    def select(self, columns="*", count=None):
+        self.method = "select"
+        self.selected = self._parse_columns(columns)
+        self.count = count
+        return self
+
+    def insert(self, json, count=None, returning="representation", **kwargs):
+        return self._write("insert", json, count, returning)
+
+    def upsert(self, json, count=None, returning="representation", on_conflict="", **kwargs):
+        self.on_conflict = on_conflict or _primary_key(self.table)
+        return self._write("upsert", json, count, returning)
+
+    def update(self, json, count=None, returning="representation", **kwargs):
+        return self._write("update", json, count, returning)
+
+    def delete(self, count=None, returning="representation", **kwargs):
+        return self._write("delete", None, count, returning)
+
+    def _write(self, method, payload, count, returning):
+        self.method = method
+        self.payload = payload
+        self.count = count
+        self.returning = getattr(returning, "value", returning)
+        return self
+
+    # Filters and modifiers
+
+    def eq(self, column, value):
+        return self._filter(column, "=", value)
+
+    def neq(self, column, value):
+        return self._filter(column, "!=", value)
+
+    def lt(self, column, value):
+        return self._filter(column, "<", value)
+
+    def lte(self, column, value):
+        return self._filter(column, "<=", value)
+
+    def gt(self, column, value):
+        return self._filter(column, ">", value)
+
+    def gte(self, column, value):
+        return self._filter(column, ">=", value)
+
+    def in_(self, column, values):
+        self._check_column(column)
+        values = list(values)
+        if not values:
+            self.filters.append(("0", []))
+        else:
+            self.filters.append((f"{column} IN ({', '.join('?' * len(values))})", values))
+        return self
+
+    def is_(self, column, value):
+        self._check_column(column)
+        if value is None or value == "null":
+            self.filters.append((f"{column} IS NULL", []))
+        else:
+            self.filters.append((f"{column} IS ?", [value]))
+        return self
+
+    def order(self, column, desc=False, **kwargs):
+        self._check_column(column)
+        self.ordering.append(f"{column} {'DESC' if desc else 'ASC'}")
+        return self
+
+    def range(self, start, end):
+        self.offset = start
+        self.row_limit = end - start + 1
+        return self
+
+    def limit(self, size):
+        self.row_limit = size
+        return self
+
+    def _filter(self, column, operator, value):
+        self._check_column(column)
+        self.filters.append((f"{column} {operator} ?", [value]))
+        return self
+
+    # Execution
+
+    def execute(self):
+        with self.backend.lock:
+            try:
+                return getattr(self, f"_execute_{self.method}")()
+            except sqlite3.IntegrityError as e:
+                raise BackendError(str(e), "23505" if "UNIQUE" in str(e) else "23502") from e
+            except sqlite3.Error as e:
+                raise BackendError(str(e)) from e
+
+    def _execute_select(self):
+        sql = f"SELECT {', '.join(self.selected)} FROM {self.table}{self._where()}"
+        if self.ordering:
+            sql += " ORDER BY " + ", ".join(self.ordering)
+        if self.row_limit is not None:
+            sql += f" LIMIT {int(self.row_limit)} OFFSET {int(self.offset or 0)}"
+        rows = [self._from_sqlite(row) for row in self._query(sql, self._where_params())]
+        count = self._count() if self.count else None
+        return BackendResponse(rows, count)
+
+    def _execute_insert(self):
+        rows = self._payload_rows()
+        ids = []
+        for row in rows:
+            row = self._touch(row)
+            columns = list(row)
+            cursor = self._query(
+                f"INSERT INTO {self.table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                [self._to_sqlite(column, row[column]) for column in columns],
+            )
+            ids.append(cursor.lastrowid)
+        return self._written(self._rows_by_rowid(ids), len(rows))
+
+    def _execute_upsert(self):
+        rows = self._payload_rows()
+        self._check_column(self.on_conflict)
+        keys = []
+        for row in rows:
+            row = self._touch(row)
+            columns = list(row)
+            assignments = ", ".join(f"{column} = excluded.{column}" for column in columns if column != self.on_conflict)
+            self._query(
+                f"INSERT INTO {self.table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                f"ON CONFLICT({self.on_conflict}) DO " + (f"UPDATE SET {assignments}" if assignments else "NOTHING"),
+                [self._to_sqlite(column, row[column]) for column in columns],
+            )
+            keys.append(row[self.on_conflict])
+        written = []
+        if self.returning != "minimal":
+            for key in keys:
+                written.extend(self._select_all(f" WHERE {self.on_conflict} = ?", [key]))
+        return self._written(written, len(rows))
+
+    def _execute_update(self):
+        values = self._touch(dict(self.payload))
+        for column in values:
+            self._check_column(column)
+        rowids = [row[0] for row in self._query(f"SELECT rowid FROM {self.table}{self._where()}", self._where_params())]
+        if rowids:
+            assignments = ", ".join(f"{column} = ?" for column in values)
+            self._query(
+                f"UPDATE {self.table} SET {assignments} WHERE rowid IN ({', '.join('?' * len(rowids))})",
+                [self._to_sqlite(column, value) for column, value in values.items()] + rowids,
+            )
+        return self._written(self._rows_by_rowid(rowids), len(rowids))
+
+    def _execute_delete(self):
+        deleted = self._select_all(self._where(), self._where_params()) if self.returning != "minimal" else []
+        cursor = self._query(f"DELETE FROM {self.table}{self._where()}", self._where_params())
+        return self._written(deleted, cursor.rowcount)
+
+    # Helpers
+
+    def _query(self, sql, params=()):
+        return self.backend.connection.execute(sql, params)
+
+    def _where(self):
+        return " WHERE " + " AND ".join(clause for clause, _ in self.filters) if self.filters else ""
+
+    def _where_params(self):
+        return [param for _, params in self.filters for param in params]
+
+    def _count(self):
+        return self._query(f"SELECT COUNT(*) FROM {self.table}{self._where()}", self._where_params()).fetchone()[0]
+
+    def _select_all(self, where, params):
+        return [self._from_sqlite(row) for row in self._query(f"SELECT * FROM {self.table}{where}", params)]
+
+    def _rows_by_rowid(self, rowids):
+        if self.returning == "minimal" or not rowids:
+            return []
+        return self._select_all(f" WHERE rowid IN ({', '.join('?' * len(rowids))})", rowids)
+
+    def _written(self, rows, affected):
+        data = [] if self.returning == "minimal" else rows
+        return BackendResponse(data, affected if self.count else None)
+
+    def _payload_rows(self):
+        rows = self.payload if isinstance(self.payload, list) else [self.payload]
+        for row in rows:
+            for column in row:
+                self._check_column(column)
+        return rows
+
+    def _touch(self, row):
+        # Mirrors the default and the triggers of migrations/007_updated_at_triggers.sql that maintain updated_at
+        if "updated_at" in self.columns and "updated_at" not in row:
+            row = {**row, "updated_at": _now()}
+        return row
+
+    def _parse_columns(self, columns):
+        if columns.strip() == "*":
+            return list(self.columns)
+        selected = [column.strip() for column in columns.split(",") if column.strip()]
+        for column in selected:
+            self._check_column(column)
+        return selected
+
+    def _check_column(self, column):
+        if column not in self.columns:
+            raise BackendError(f"column {self.table}.{column} does not exist", "42703")
+
+    def _to_sqlite(self, column, value):
+        if isinstance(value, bool):
+            return int(value)
+        return value
+
+    def _from_sqlite(self, row):
+        return {
+            column: (bool(row[column]) if self.columns[column].startswith("BOOLEAN") and row[column] is not None else row[column])
+            for column in row.keys()
+        }
+
+
+class InstrumentedBackend:
+    """Wrap a backend to count requests and payload bytes, optionally adding latency to each request.
+
+    Payload sizes are measured as the JSON size of the request body and the response data,
+    which is what PostgREST sends over the wire; request bodies the wrapped backend compresses
+    are measured compressed. Every request is also reported to `metrics`, if given.
+    """
+
+    def __init__(self, backend, latency=0.0, metrics=None):
+        self.backend = backend
+        self.latency = latency
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.reset()
+
+    def table(self, name):
+        return InstrumentedQuery(self, self.backend.table(name), name)
+
+    def reset(self):
+        with self.lock:
+            self.requests = {}
+            self.bytes_sent = 0
+            self.bytes_received = 0
+
+    def round_trips(self):
+        return sum(self.requests.values())
+
+    def record(self, table, method, bytes_sent, bytes_received, latency=0.0, error=False):
+        operation = f"{method} {table}"
+        with self.lock:
+            self.requests[operation] = self.requests.get(operation, 0) + 1
+            self.bytes_sent += bytes_sent
+            self.bytes_received += bytes_received
+        if self.metrics is not None:
+            self.metrics.record_request(operation, latency, bytes_sent, bytes_received, error)
+
+
+class InstrumentedQuery:
+    """Proxy of a query builder that reports every executed request to its InstrumentedBackend."""
+
+    REQUEST_METHODS = ("select", "insert", "upsert", "update", "delete")
+
+    def __init__(self, instrumented, query, table):
+        self.instrumented = instrumented
+        self.query = query
+        self.table = table
+        self.method = None
+        self.payload = None
+
+    def __getattr__(self, name):
+        attribute = getattr(self.query, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            if name in self.REQUEST_METHODS:
+                self.method = name
+                if name in ("insert", "upsert", "update"):
+                    self.payload = args[0] if args else kwargs.get("json")
+            result = attribute(*args, **kwargs)
+            if result is self.query or result is None:
+                return self
+            self.query = result
+            return self
+
+        return call
+
+    def execute(self):
+        started = time.perf_counter()
+        bytes_sent = _request_size(self.payload, getattr(self.instrumented.backend, "gzip_min_bytes", None)) if self.payload is not None else 0
+        if self.instrumented.latency:
+            time.sleep(self.instrumented.latency)
+        try:
+            response = self.query.execute()
+        except Exception:
+            self.instrumented.record(self.table, self.method, bytes_sent, 0, time.perf_counter() - started, error=True)
+            raise
+        self.instrumented.record(
+            self.table,
+            self.method,
+            bytes_sent,
+            _json_size(response.data) if response.data else 0,
+            time.perf_counter() - started,
+        )
+        return response
+
+
+def _json_bytes(value):
+    return json.dumps(value, ensure_ascii=False, default=str).encode("utf-8")
+
+
+def _json_size(value):
+    return len(_json_bytes(value))
+
+
+def _request_size(payload, gzip_min_bytes=None):
+    body = _json_bytes(payload)
+    if gzip_min_bytes is not None and len(body) >= gzip_min_bytes:
+        return len(gzip.compress(body, mtime=0))
+    return len(body)
@@ -0,0 +1,92 @@
+"""Precompressed per-project content bundles.
+
+Besides the stages table, every project gets one bundle in project_bundles: its enabled stages in
+order, with their metadata and minified HTML, as a single JSON document compressed with gzip and
+brotli. Opening a project is then one download instead of a query per stage.
+
+A bundle is addressed by its hash, which is computed from the stage IDs, order numbers, titles and
+content hashes only, so it is known without reading any HTML. A bundle is only rebuilt and uploaded
+when its hash differs from the remote one, i.e. when some stage of the project changed.
+
+Compressed bodies are stored base64-encoded, since PostgREST exchanges JSON. Brotli needs the
+brotli package (`pip install brotli`); without it, bundles are only gzip-compressed, and they
+are rebuilt by the first sync that has it.
+"""
+import base64
+import gzip
+import json
+import os
+
+from enlighter_sync.fingerprints import sha256_hex
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Version of the bundle format; part of the hash, so bumping it rebuilds every bundle
+BUNDLE_VERSION = 1
+
+# Bundles are compressed once per change and downloaded on every project load, so the
+# slowest, densest brotli setting is the default (about 15% smaller than quality 9)
+BROTLI_QUALITY = int(os.environ.get("SYNC_BROTLI_QUALITY", "11"))
+
+# Columns of project_bundles read to decide which bundles are outdated
+BUNDLE_SNAPSHOT_COLUMNS = "project_id, hash, brotli_size"
+
+
+def bundle_manifest(project_id, stages):
+    """Describe the stages of a bundle; `stages` are dicts with the keys of a bundled stage but `html`."""
+    return {
+        "version": BUNDLE_VERSION,
+        "project_id": project_id,
+        "stages": [
+            {
+                "id": stage['id'],
+                "order_num": stage['order_num'],
+                "title": stage['title'],
+                "next_button_title": stage['next_button_title'],
+                "content_hash": stage['content_hash'],
+            }
+            for stage in sorted(stages, key=lambda stage: (stage['order_num'], stage['id']))
+        ],
+    }
+
+
+def bundle_hash(manifest):
+    return sha256_hex(json.dumps(manifest, sort_keys=True, ensure_ascii=False))
+
+
+def bundle_is_outdated(manifest, remote_bundle):
+    """Check whether the remote bundle row (None if there is none) must be rebuilt for this manifest.
+
+    Bundles written without brotli are rebuilt once it is available.
+    """
+    if remote_bundle is None or remote_bundle['hash'] != bundle_hash(manifest):
+        return True
+    return brotli is not None and remote_bundle.get('brotli_size') is None
+
+
+def build_bundle_row(manifest, html_by_stage_id):
+    """Build the project_bundles row of a manifest, with the stages' HTML bodies compressed."""
+    digest = bundle_hash(manifest)
+    document = {
+        **manifest,
+        "hash": digest,
+        "stages": [{**stage, "html": html_by_stage_id[stage['id']]} for stage in manifest['stages']],
+    }
+    body = json.dumps(document, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    # mtime=0 keeps the gzip output deterministic
+    compressed_gzip = gzip.compress(body, compresslevel=9, mtime=0)
+    compressed_brotli = brotli.compress(body, quality=BROTLI_QUALITY) if brotli is not None else None
+    return {
+        "project_id": manifest['project_id'],
+        "hash": digest,
+        "version": BUNDLE_VERSION,
+        "stage_count": len(manifest['stages']),
+        "size": len(body),
+        "gzip_size": len(compressed_gzip),
+        "brotli_size": len(compressed_brotli) if compressed_brotli is not None else None,
+        "gzip": base64.b64encode(compressed_gzip).decode("ascii"),
+        "brotli": base64.b64encode(compressed_brotli).decode("ascii") if compressed_brotli is not None else None,
+    }
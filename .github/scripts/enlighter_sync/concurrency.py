@@ -0,0 +1,175 @@
+"""Bounded, adaptive concurrency for Supabase requests.
+
+Independent requests (pages of bulk reads, chunks of bulk writes) run on a thread pool.
+The number of requests in flight is capped by an AdaptiveLimiter, which halves the cap when
+the server throttles or fails (HTTP 429/5xx) or latency rises well above its baseline,
+and grows it by one after a window of healthy responses.
+
+Tasks that fail with a transient error (HTTP 429/5xx, or a network error without a response)
+are retried up to SYNC_RETRIES times, with exponential backoff and jitter.
+
+The unit of parallelism is a request (a page of a read, a chunk of a bulk write), not a project.
+Writes are batched across projects (see writer.py), so a project's rows are spread over the chunks
+of each table, and projects must be written before the stages that reference them. Running one
+worker per project would mean one request per project and table instead of a few bulk requests.
+Failures stay isolated per row instead: a failed chunk is replayed row by row, and only the rows
+that fail again are reported, with the other projects' rows of the chunk written normally.
+Counters and output lines are computed by the diff before any write, so they don't depend on the
+order in which requests complete.
+"""
+import os
+import random
+import socket
+import threading
+import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+# Latency above this multiple of the baseline counts as a sign of overload
+LATENCY_BACKOFF_FACTOR = 2.0
+# Weight of the newest sample in the smoothed latency
+LATENCY_SMOOTHING = 0.2
+
+# Retries of a task after a transient error; the delay before retry n is about RETRY_BASE_DELAY * 2**n seconds
+RETRIES = int(os.environ.get("SYNC_RETRIES", "3"))
+RETRY_BASE_DELAY = float(os.environ.get("SYNC_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = 30.0
+
+
+def get_status_code(error):
+    """Get the HTTP status code of a failed request, or None if it can't be determined.
+
+    httpx errors carry the response; postgrest APIError reports non-JSON error responses
+    (e.g. a 502 from the gateway) with the HTTP status code as its code.
+    """
+    response = getattr(error, 'response', None)
+    status_code = getattr(response, 'status_code', None) or getattr(error, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(error, 'code', None)
+    try:
+        status_code = int(status_code)
+    except (TypeError, ValueError):
+        return None
+    return status_code if 100 <= status_code < 600 else None
+
+
+def is_overload_status(status_code):
+    return status_code is not None and (status_code == 429 or status_code >= 500)
+
+
+def is_transient_error(error):
+    """Whether a failed request may succeed when retried: the server was overloaded or unreachable."""
+    status_code = get_status_code(error)
+    if status_code is not None:
+        return is_overload_status(status_code)
+    # Errors with a non-HTTP code (e.g. a Postgres constraint violation) are permanent
+    if getattr(error, 'code', None) is not None:
+        return False
+    # httpx reports network failures (connect errors, timeouts, dropped connections) as TransportError,
+    # urllib as URLError (an OSError, e.g. a DNS failure) or socket.timeout; an HTTPError has its status
+    if isinstance(error, urllib.error.URLError) and not isinstance(error, urllib.error.HTTPError):
+        return True
+    return isinstance(error, (ConnectionError, TimeoutError, socket.timeout)) or any(
+        cls.__name__ == "TransportError" for cls in type(error).__mro__
+    )
+
+
+def retry_delay(attempt):
+    """Exponential backoff with jitter, so concurrent retries don't hit the server at the same time."""
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+class AdaptiveLimiter:
+    """Cap the number of requests in flight and adapt the cap to server health (AIMD)."""
+
+    def __init__(self, max_limit, min_limit=1):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = max(self.min_limit, self.max_limit // 2)
+        self._active = 0
+        self._healthy_in_window = 0
+        self._smoothed_latency = None
+        self._baseline_latency = None
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self._active >= self.limit:
+                self._condition.wait()
+            self._active += 1
+
+    def release(self, latency, status_code=None):
+        with self._condition:
+            self._active -= 1
+            self._adjust(latency, status_code)
+            self._condition.notify_all()
+
+    def _adjust(self, latency, status_code):
+        if is_overload_status(status_code):
+            self._decrease()
+            return
+
+        if self._smoothed_latency is None:
+            self._smoothed_latency = latency
+        else:
+            self._smoothed_latency += LATENCY_SMOOTHING * (latency - self._smoothed_latency)
+        if self._baseline_latency is None or self._smoothed_latency < self._baseline_latency:
+            self._baseline_latency = self._smoothed_latency
+
+        if self._smoothed_latency > LATENCY_BACKOFF_FACTOR * self._baseline_latency:
+            self._decrease()
+            # Start over from the current latency, so one slow period doesn't keep shrinking the cap
+            self._baseline_latency = self._smoothed_latency
+            return
+
+        self._healthy_in_window += 1
+        if self._healthy_in_window >= self.limit:
+            self.limit = min(self.max_limit, self.limit + 1)
+            self._healthy_in_window = 0
+
+    def _decrease(self):
+        self.limit = max(self.min_limit, self.limit // 2)
+        self._healthy_in_window = 0
+
+    def call(self, task):
+        """Run a task while holding a slot, and feed its latency and status back into the limiter."""
+        self.acquire()
+        started = time.monotonic()
+        status_code = None
+        try:
+            return task()
+        except Exception as e:
+            status_code = get_status_code(e)
+            raise
+        finally:
+            self.release(time.monotonic() - started, status_code)
+
+
+def run_concurrently(tasks, limiter, retries=None):
+    """Run independent tasks under the limiter and return their results in task order.
+
+    Every result is a (value, error) tuple, so one failing task doesn't hide the others.
+    Transient errors are retried up to `retries` times (default: SYNC_RETRIES); tasks must be idempotent.
+    With a cap of one, tasks run sequentially in the calling thread.
+    """
+    retries = RETRIES if retries is None else retries
+
+    def run(task):
+        attempt = 0
+        while True:
+            try:
+                return limiter.call(task), None
+            except Exception as e:
+                if attempt >= retries or not is_transient_error(e):
+                    return None, e
+                delay = retry_delay(attempt)
+                attempt += 1
+                print(f"WARNING: Request failed ({e}), retrying in {delay:.1f}s (attempt {attempt + 1} of {retries + 1})")
+                time.sleep(delay)
+
+    tasks = list(tasks)
+    if limiter.max_limit == 1 or len(tasks) <= 1:
+        return [run(task) for task in tasks]
+
+    with ThreadPoolExecutor(max_workers=min(limiter.max_limit, len(tasks))) as executor:
+        return list(executor.map(run, tasks))
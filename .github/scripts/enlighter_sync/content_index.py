@@ -0,0 +1,213 @@
+"""Persistent index of the local content files.
+
+Every run used to read each stage file in full, search its body for the Enlighter Metainfo
+header and hash it. The index caches, per file path, what the scripts need to know about a file
+(the parsed filename, the metadata, the content hash, or the parsed JSON of project.json),
+so later runs reuse those records and only re-read files that changed.
+
+A record is keyed by the file's mtime and size, and by its git blob SHA: a fresh checkout
+gives every file a new mtime, but files whose blob SHA in the git index is unchanged (and that
+are not modified in the work tree) are still reused. As in git, a record whose mtime is not older
+than the time the index was saved is not trusted on mtime and size alone ("racily clean").
+
+The index is a JSON file, at the path in SYNC_CONTENT_INDEX (default: .enlighter_index.json);
+set it to an empty string to keep the index in memory only. validate-content.js reads the same
+file, so its layout (records as arrays, in the field order below) is part of its format.
+"""
+import collections
+import hashlib
+import json
+import os
+import re
+import subprocess
+import time
+
+from enlighter_sync.fingerprints import html_fingerprint
+from enlighter_sync.minify import minify_html
+
+# Bump when the layout of the records or the way they are parsed changes
+INDEX_VERSION = 2
+
+DEFAULT_INDEX_PATH = ".enlighter_index.json"
+
+# Pattern of stage filenames: <order_num>_<id>_<title>.html
+STAGE_FILENAME_PATTERN = re.compile(r'(\d+)_(\d+)_(.+)\.html$')
+METADATA_PATTERN = re.compile(r'<!-- Enlighter Metainfo\s*(\{.*?\})\s*-->', re.DOTALL)
+
+# An HTML file (stage or template). order_num, stage_id and title come from the filename
+# and are None if it doesn't match the stage pattern. Stages are uploaded minified, so their
+# content_hash is the fingerprint of the minified body, whose size is minified_size.
+HtmlRecord = collections.namedtuple(
+    "HtmlRecord",
+    ("mtime_ns", "size", "blob_sha", "order_num", "stage_id", "title", "metadata", "content_hash", "minified_size"),
+)
+# A JSON file; data is None and error is set if it couldn't be parsed
+JsonRecord = collections.namedtuple("JsonRecord", ("mtime_ns", "size", "blob_sha", "data", "error"))
+
+RECORD_TYPES = {"html": HtmlRecord, "json": JsonRecord}
+
+
+def git_blob_sha(data):
+    """The SHA git gives to a blob with these bytes."""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def extract_metadata_from_html(file_content):
+    """Extract metadata from HTML file content."""
+    match = METADATA_PATTERN.search(file_content)
+
+    if match:
+        try:
+            metadata_json = match.group(1)
+            metadata = json.loads(metadata_json)
+            return metadata
+        except Exception as e:
+            print(f"Error parsing metadata: {e}")
+
+    return None
+
+
+def parse_stage_filename(filename):
+    """Parse a stage filename into (order number, stage ID, title), or None if it doesn't match."""
+    match = STAGE_FILENAME_PATTERN.match(os.path.basename(filename))
+    if not match:
+        return None
+    order_num, stage_id, title = match.groups()
+    return int(order_num), int(stage_id), title.replace('_', ' ')
+
+
+def get_clean_git_blobs():
+    """Map the paths tracked by git that are unmodified in the work tree to their blob SHA.
+
+    Paths are relative to the current directory. Returns an empty map outside a git work tree.
+    """
+    def git(*args):
+        return subprocess.run(["git", *args], capture_output=True, text=True)
+
+    staged = git("ls-files", "-s", "-z")
+    if staged.returncode != 0:
+        return {}
+    blobs = {}
+    for entry in staged.stdout.split("\0"):
+        # Format: <mode> <blob SHA> <stage>\t<path>
+        if "\t" in entry:
+            info, path = entry.split("\t", 1)
+            blobs[path] = info.split()[1]
+
+    modified = git("ls-files", "-m", "-z")
+    if modified.returncode != 0:
+        return {}
+    for path in modified.stdout.split("\0"):
+        blobs.pop(path, None)
+    return blobs
+
+
+class ContentIndex:
+    def __init__(self, path=None):
+        self.path = os.environ.get("SYNC_CONTENT_INDEX", DEFAULT_INDEX_PATH) if path is None else path
+        self.records = {kind: {} for kind in RECORD_TYPES}
+        self.saved_ns = 0
+        self.hits = 0
+        self.misses = 0
+        self._git_blobs = None
+        # Paths whose record was already checked or rebuilt in this run
+        self._current = set()
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except Exception as e:
+            print(f"WARNING: Could not read the content index {self.path} ({e}), rebuilding it")
+            return
+        if stored.get("version") != INDEX_VERSION:
+            return
+        self.saved_ns = stored.get("saved_ns", 0)
+        for kind, record_type in RECORD_TYPES.items():
+            self.records[kind] = {path: record_type(*fields) for path, fields in stored.get(kind, {}).items()}
+
+    def save(self):
+        """Write the index, dropping records of files that no longer exist."""
+        if not self.path:
+            return
+        records = {
+            kind: {path: list(record) for path, record in sorted(kind_records.items()) if os.path.exists(path)}
+            for kind, kind_records in self.records.items()
+        }
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "saved_ns": time.time_ns(), **records}, f, separators=(",", ":"))
+        os.replace(self.path + ".tmp", self.path)
+
+    def git_blobs(self):
+        if self._git_blobs is None:
+            self._git_blobs = get_clean_git_blobs()
+        return self._git_blobs
+
+    def _lookup(self, kind, path):
+        """Return the record of a file if it is still valid, with its current mtime and size."""
+        record = self.records[kind].get(path)
+        if record is None:
+            return None
+        stat = os.stat(path)
+        if (record.mtime_ns, record.size) == (stat.st_mtime_ns, stat.st_size) and record.mtime_ns < self.saved_ns:
+            return record
+        if record.blob_sha is not None and self.git_blobs().get(path) == record.blob_sha:
+            record = record._replace(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+            self.records[kind][path] = record
+            return record
+        return None
+
+    def _read(self, path):
+        stat = os.stat(path)
+        with open(path, "rb") as f:
+            data = f.read()
+        return stat, data
+
+    def html(self, path):
+        """Return the HtmlRecord of an HTML file, re-reading the file only if it changed."""
+        if path in self._current:
+            return self.records["html"][path]
+        record = self._lookup("html", path)
+        if record is not None:
+            self.hits += 1
+            self._current.add(path)
+            return record
+        self.misses += 1
+        stat, data = self._read(path)
+        text = data.decode("utf-8")
+        filename_info = parse_stage_filename(path)
+        if filename_info is None:
+            content_hash, minified_size = html_fingerprint(text), None
+            filename_info = (None, None, None)
+        else:
+            minified = minify_html(text)
+            content_hash, minified_size = html_fingerprint(minified), len(minified.encode("utf-8"))
+        record = HtmlRecord(
+            stat.st_mtime_ns, stat.st_size, git_blob_sha(data), *filename_info,
+            extract_metadata_from_html(text), content_hash, minified_size,
+        )
+        self.records["html"][path] = record
+        self._current.add(path)
+        return record
+
+    def json(self, path):
+        """Return the JsonRecord of a JSON file, re-reading the file only if it changed."""
+        if path in self._current:
+            return self.records["json"][path]
+        record = self._lookup("json", path)
+        if record is not None:
+            self.hits += 1
+            self._current.add(path)
+            return record
+        self.misses += 1
+        stat, data = self._read(path)
+        try:
+            record = JsonRecord(stat.st_mtime_ns, stat.st_size, git_blob_sha(data), json.loads(data.decode("utf-8")), None)
+        except Exception as e:
+            record = JsonRecord(stat.st_mtime_ns, stat.st_size, git_blob_sha(data), None, str(e))
+        self.records["json"][path] = record
+        self._current.add(path)
+        return record
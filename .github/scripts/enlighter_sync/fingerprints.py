@@ -0,0 +1,36 @@
+"""Content fingerprints.
+
+Each synced row stores a SHA-256 fingerprint of its content in a `content_hash` column,
+so change detection only needs to fetch hashes instead of full HTML bodies.
+"""
+import hashlib
+import json
+
+# Fields of project.json that are synced to the projects table
+PROJECT_FINGERPRINT_FIELDS = ('title', 'description', 'short_description', 'categories', 'cover_url', 'readme', 'ides')
+
+
+def normalize_html(content):
+    """Normalize HTML before hashing, so that line ending differences don't count as changes."""
+    return content.replace('\r\n', '\n').replace('\r', '\n')
+
+
+def sha256_hex(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def html_fingerprint(content):
+    """Fingerprint of a stage or template HTML body.
+
+    Stage metadata (title, next_button_title) lives in the Enlighter Metainfo header
+    of the body, so it is covered by the fingerprint as well.
+    """
+    return sha256_hex(normalize_html(content))
+
+
+def project_fingerprint(project_info):
+    """Fingerprint of the project.json fields synced to the projects table."""
+    fields = {field: project_info.get(field, '') for field in PROJECT_FINGERPRINT_FIELDS}
+    fields['description'] = normalize_html(fields['description'] or '')
+    fields['readme'] = normalize_html(fields['readme'] or '')
+    return sha256_hex(json.dumps(fields, sort_keys=True, ensure_ascii=False))
@@ -0,0 +1,128 @@
+"""Checkpoint journal of the write operations applied by a sync run.
+
+Each flushed batch of operations is recorded in an append-only journal, keyed by the run
+(GITHUB_RUN_ID, which a re-run of a workflow keeps) and the synced commit. When a run is
+restarted for the same commit, e.g. after it died halfway through its writes, operations
+already recorded are skipped instead of being written again.
+
+Entries are keyed on what an operation leaves in the database: its table, the primary key of the
+row and the row's content hash (or the columns it patches), not on the remote row the diff
+compared it with. A restart that diffs again, against rows the first attempt partly wrote, so
+recognizes the remaining operations as well as replaying a saved plan does.
+
+The journal is stored in the sync_journal table, or in the JSON Lines file at the path in
+SYNC_JOURNAL_FILE when that is set. The entries of a run are cleared once it finished without errors.
+"""
+import hashlib
+import json
+import os
+
+from enlighter_sync.backends import get_backend
+from enlighter_sync.fingerprints import html_fingerprint
+
+SYNC_RUN_ID = os.environ.get("GITHUB_RUN_ID", "local")
+SYNC_JOURNAL_FILE = os.environ.get("SYNC_JOURNAL_FILE", "")
+
+
+# Columns whose content is represented by a content hash in the key of an operation
+HASHED_COLUMNS = ("description", "readme", "template")
+
+
+def operation_key(operation):
+    """Get the (table, primary key, content) that a write operation leaves in the database."""
+    action = operation['action']
+    if action in ("create_template", "update_template"):
+        return "content_templates", operation['name'], html_fingerprint(operation['template'])
+    if action == "upsert_bundle":
+        return "project_bundles", operation['id'], operation['bundle']['hash']
+    if action == "delete_project":
+        return "projects", operation['id'], "deleted"
+    if action == "disable_stage":
+        return "stages", operation['id'], {"enabled": False}
+    if action == "create_project":
+        return "projects", operation['id'], operation['project_info']['content_hash']
+    if action == "create_stage":
+        stage = operation['stage']
+        return "stages", operation['id'], {
+            **{column: value for column, value in stage.items() if column not in HASHED_COLUMNS},
+            "content_hash": html_fingerprint(stage['description']),
+        }
+    table = "projects" if action == "update_project" else "stages"
+    return table, operation['id'], {column: value for column, value in operation['update_data'].items() if column not in HASHED_COLUMNS}
+
+
+def operation_digest(operation):
+    """Digest of the key of a write operation, so an operation is only skipped if its write was applied."""
+    return hashlib.sha256(json.dumps(operation_key(operation), sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class SyncJournal:
+    def __init__(self, commit, run=SYNC_RUN_ID, path=SYNC_JOURNAL_FILE):
+        self.commit = commit
+        self.run = run
+        self.path = path
+        self._applied = None
+
+    def applied(self):
+        """Digests of the operations already applied by this run for this commit."""
+        if self._applied is None:
+            self._applied = {entry['digest'] for entry in self._read_entries()}
+        return self._applied
+
+    def _read_entries(self):
+        if self.path:
+            if not os.path.exists(self.path):
+                return []
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+            return [entry for entry in entries if entry['run'] == self.run and entry['commit_sha'] == self.commit]
+
+        return (
+            get_backend().table("sync_journal")
+            .select("digest")
+            .eq("run", self.run)
+            .eq("commit_sha", self.commit)
+            .execute()
+        ).data
+
+    def record(self, operations):
+        """Append the operations to the journal as applied."""
+        entries = [
+            {
+                "run": self.run,
+                "commit_sha": self.commit,
+                "action": operation['action'],
+                "target_id": operation['id'],
+                "digest": operation_digest(operation),
+            }
+            for operation in operations
+        ]
+        if not entries:
+            return
+        if self.path:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(entry) + "\n" for entry in entries)
+        else:
+            get_backend().table("sync_journal").insert(entries, returning="minimal").execute()
+        self.applied().update(entry['digest'] for entry in entries)
+
+    def clear(self):
+        """Remove the entries of this run for this commit, once it finished without errors."""
+        if not self._applied:
+            return
+        if self.path:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+            kept = [json.dumps(entry) + "\n" for entry in entries if (entry['run'], entry['commit_sha']) != (self.run, self.commit)]
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                f.writelines(kept)
+            os.replace(self.path + ".tmp", self.path)
+        else:
+            (
+                get_backend().table("sync_journal")
+                .delete(returning="minimal")
+                .eq("run", self.run)
+                .eq("commit_sha", self.commit)
+                .execute()
+            )
+        self._applied = set()
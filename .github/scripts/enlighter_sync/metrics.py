@@ -0,0 +1,246 @@
+"""Structured metrics of a sync run.
+
+Records per-phase timings, per-operation request counts, latency histograms and payload bytes,
+the cold-start costs (time to import the script, to create the Supabase client and to open
+connections, and the number of connections opened), plus the summary counters of the script. At exit, the report is written as JSON to the path in
+SYNC_METRICS_JSON and as a Prometheus textfile (for the node_exporter textfile collector) to the
+path in SYNC_METRICS_PROM, when those variables are set. A `{script}` placeholder in a path is
+replaced with the name of the script.
+
+A run is always in at most one phase: switch_phase() ends the current phase and starts the next,
+and phase() runs a block in a phase and then returns to the previous one. Phase timings are
+therefore exclusive and add up to the total time of the run.
+"""
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+
+# When this module was first imported, which the scripts do at the top of their imports
+IMPORTED_AT = time.perf_counter()
+
+# Upper bounds of the request latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self):
+        """Return (upper bound, cumulative count) pairs, ending with +Inf."""
+        pairs = []
+        running = 0
+        for bound, count in zip(list(self.buckets) + [float("inf")], self.counts):
+            running += count
+            pairs.append((bound, running))
+        return pairs
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum_s": round(self.total, 6),
+            "buckets": {("+Inf" if bound == float("inf") else str(bound)): count for bound, count in self.cumulative()},
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._exit_handler_registered = False
+        self.reset()
+
+    def reset(self, script=None):
+        with self.lock:
+            self.script = script
+            self.started = time.perf_counter()
+            self.phases = {}
+            self.current_phase = None
+            self._phase_started = self.started
+            self.requests = {}
+            self.request_errors = {}
+            self.latency = {}
+            self.bytes_sent = 0
+            self.bytes_received = 0
+            self.counters = {}
+            self.startup_s = None
+            self.client_init_s = None
+            self.connections_opened = 0
+            self.connect_s = 0.0
+            self.http_versions = {}
+
+    def start(self, script):
+        """Start recording a run of the given script and write the reports when the process exits."""
+        self.reset(script)
+        self.startup_s = time.perf_counter() - IMPORTED_AT
+        if not self._exit_handler_registered:
+            atexit.register(self.write_reports)
+            self._exit_handler_registered = True
+
+    def switch_phase(self, name):
+        """End the current phase and start the named one (None to end it); returns the previous phase.
+
+        Time spent in phases with the same name accumulates.
+        """
+        now = time.perf_counter()
+        with self.lock:
+            previous = self.current_phase
+            if previous is not None:
+                self.phases[previous] = self.phases.get(previous, 0.0) + now - self._phase_started
+            self.current_phase = name
+            self._phase_started = now
+        return previous
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Run a block in the named phase, then return to the previous phase."""
+        previous = self.switch_phase(name)
+        try:
+            yield
+        finally:
+            self.switch_phase(previous)
+
+    def record_request(self, operation, latency, bytes_sent=0, bytes_received=0, error=False):
+        with self.lock:
+            self.requests[operation] = self.requests.get(operation, 0) + 1
+            if error:
+                self.request_errors[operation] = self.request_errors.get(operation, 0) + 1
+            self.latency.setdefault(operation, Histogram()).observe(latency)
+            self.bytes_sent += bytes_sent
+            self.bytes_received += bytes_received
+
+    def record_client_init(self, seconds):
+        with self.lock:
+            self.client_init_s = seconds
+
+    def record_connection(self, seconds, opened=True):
+        """Record the time spent setting up a connection (TCP connect or TLS handshake)."""
+        with self.lock:
+            self.connect_s += seconds
+            if opened:
+                self.connections_opened += 1
+
+    def record_http_version(self, http_version):
+        with self.lock:
+            self.http_versions[http_version] = self.http_versions.get(http_version, 0) + 1
+
+    def set_counters(self, counters):
+        with self.lock:
+            self.counters.update(counters)
+
+    def to_dict(self):
+        # Account for the time spent so far in the current phase
+        self.switch_phase(self.current_phase)
+        with self.lock:
+            return {
+                "script": self.script,
+                "total_s": round(time.perf_counter() - self.started, 6),
+                "phases_s": {name: round(seconds, 6) for name, seconds in self.phases.items()},
+                "requests": dict(sorted(self.requests.items())),
+                "request_errors": dict(sorted(self.request_errors.items())),
+                "latency": {operation: histogram.to_dict() for operation, histogram in sorted(self.latency.items())},
+                "bytes_sent": self.bytes_sent,
+                "bytes_received": self.bytes_received,
+                "startup_s": None if self.startup_s is None else round(self.startup_s, 6),
+                "client": {
+                    "init_s": None if self.client_init_s is None else round(self.client_init_s, 6),
+                    "connections_opened": self.connections_opened,
+                    "connect_s": round(self.connect_s, 6),
+                    "http_versions": dict(sorted(self.http_versions.items())),
+                },
+                "counters": dict(self.counters),
+            }
+
+    def to_prometheus(self):
+        report = self.to_dict()
+        script = report["script"]
+        lines = [
+            "# HELP enlighter_sync_run_seconds Total duration of the sync run.",
+            "# TYPE enlighter_sync_run_seconds gauge",
+            f'enlighter_sync_run_seconds{{script="{script}"}} {report["total_s"]}',
+            "# HELP enlighter_sync_phase_seconds Exclusive duration of each phase of the sync run.",
+            "# TYPE enlighter_sync_phase_seconds gauge",
+        ]
+        lines += [f'enlighter_sync_phase_seconds{{script="{script}",phase="{name}"}} {seconds}'
+                  for name, seconds in report["phases_s"].items()]
+        lines += [
+            "# HELP enlighter_sync_requests_total Requests sent to the backend by operation.",
+            "# TYPE enlighter_sync_requests_total counter",
+        ]
+        lines += [f'enlighter_sync_requests_total{{script="{script}",operation="{operation}"}} {count}'
+                  for operation, count in report["requests"].items()]
+        lines += [
+            "# HELP enlighter_sync_request_errors_total Failed requests by operation.",
+            "# TYPE enlighter_sync_request_errors_total counter",
+        ]
+        lines += [f'enlighter_sync_request_errors_total{{script="{script}",operation="{operation}"}} {count}'
+                  for operation, count in report["request_errors"].items()]
+        lines += [
+            "# HELP enlighter_sync_request_duration_seconds Request latency by operation.",
+            "# TYPE enlighter_sync_request_duration_seconds histogram",
+        ]
+        for operation, histogram in report["latency"].items():
+            labels = f'script="{script}",operation="{operation}"'
+            lines += [f'enlighter_sync_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}'
+                      for bound, count in histogram["buckets"].items()]
+            lines.append(f'enlighter_sync_request_duration_seconds_sum{{{labels}}} {histogram["sum_s"]}')
+            lines.append(f'enlighter_sync_request_duration_seconds_count{{{labels}}} {histogram["count"]}')
+        lines += [
+            "# HELP enlighter_sync_bytes_total Payload bytes exchanged with the backend.",
+            "# TYPE enlighter_sync_bytes_total counter",
+            f'enlighter_sync_bytes_total{{script="{script}",direction="sent"}} {report["bytes_sent"]}',
+            f'enlighter_sync_bytes_total{{script="{script}",direction="received"}} {report["bytes_received"]}',
+            "# HELP enlighter_sync_startup_seconds Time from importing the sync modules to the start of the run.",
+            "# TYPE enlighter_sync_startup_seconds gauge",
+            f'enlighter_sync_startup_seconds{{script="{script}"}} {report["startup_s"] or 0}',
+            "# HELP enlighter_sync_client_init_seconds Time to import and create the Supabase client (0 if unused).",
+            "# TYPE enlighter_sync_client_init_seconds gauge",
+            f'enlighter_sync_client_init_seconds{{script="{script}"}} {report["client"]["init_s"] or 0}',
+            "# HELP enlighter_sync_connections_opened_total Connections opened to the backend.",
+            "# TYPE enlighter_sync_connections_opened_total counter",
+            f'enlighter_sync_connections_opened_total{{script="{script}"}} {report["client"]["connections_opened"]}',
+            "# HELP enlighter_sync_connect_seconds_total Time spent in TCP connects and TLS handshakes.",
+            "# TYPE enlighter_sync_connect_seconds_total counter",
+            f'enlighter_sync_connect_seconds_total{{script="{script}"}} {report["client"]["connect_s"]}',
+            "# HELP enlighter_sync_http_responses_total Responses by HTTP version.",
+            "# TYPE enlighter_sync_http_responses_total counter",
+        ]
+        lines += [f'enlighter_sync_http_responses_total{{script="{script}",http_version="{version}"}} {count}'
+                  for version, count in report["client"]["http_versions"].items()]
+        lines += [
+            "# HELP enlighter_sync_count Summary counters of the sync run.",
+            "# TYPE enlighter_sync_count gauge",
+        ]
+        lines += [f'enlighter_sync_count{{script="{script}",name="{name}"}} {value}'
+                  for name, value in report["counters"].items()]
+        return "\n".join(lines) + "\n"
+
+    def write_reports(self):
+        """Write the JSON report and the Prometheus textfile, if their paths are configured."""
+        if self.script is None:
+            return
+        json_path = os.environ.get("SYNC_METRICS_JSON", "").replace("{script}", self.script)
+        if json_path:
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(self.to_dict(), f, indent=2)
+        prometheus_path = os.environ.get("SYNC_METRICS_PROM", "").replace("{script}", self.script)
+        if prometheus_path:
+            # Write atomically, so the textfile collector never reads a partial file
+            with open(prometheus_path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus())
+            os.replace(prometheus_path + ".tmp", prometheus_path)
+
+
+# Metrics of the current process, shared by the sync scripts and the backend
+metrics = Metrics()
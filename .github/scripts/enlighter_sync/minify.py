@@ -0,0 +1,61 @@
+"""Deterministic minification of stage HTML before it is uploaded.
+
+Stage files are written for humans: indented, and with commented-out blocks, all of which used
+to be stored in stages.description and shipped to every learner. minify_html() drops comments
+(except the Enlighter Metainfo header) and collapses whitespace in text outside of <pre>, <code>,
+<textarea>, <script> and <style>: a run of whitespace becomes a newline if it contains one,
+otherwise a space. Tags themselves are kept byte for byte.
+
+The output only depends on the input, and minify_html(minify_html(html)) == minify_html(html),
+so the content hash of a minified body is stable: edits that only change indentation or
+comments don't cause an upload.
+"""
+import re
+
+# Elements whose content is whitespace-sensitive, kept verbatim
+RAW_ELEMENTS = ("pre", "code", "textarea", "script", "style")
+
+# Comments, whitespace-sensitive elements with their content, and any other tag; text is what lies
+# between. The leading literal "<" lets the regex engine skip straight to the next tag.
+TOKEN_PATTERN = re.compile(
+    r"<(?:(?P<comment>!--.*?-->)"
+    r"|(?P<raw>(?P<raw_tag>" + "|".join(RAW_ELEMENTS) + r")\b[^>]*>.*?</(?P=raw_tag)\s*>)"
+    r"|(?P<tag>[^>]*>))",
+    re.DOTALL | re.IGNORECASE,
+)
+
+# Whitespace as defined by HTML: unlike \s, it doesn't include non-breaking spaces.
+# Runs with a newline become a newline; other runs that aren't a single space become one.
+NEWLINE_RUN_PATTERN = re.compile(r"[ \t\f]*\n[ \t\n\f]*")
+SPACE_RUN_PATTERN = re.compile(r"[ \t\f]{2,}|[\t\f]")
+HTML_WHITESPACE = " \t\n\f"
+
+METADATA_COMMENT_PREFIX = "<!-- Enlighter Metainfo"
+
+
+def collapse_whitespace(text):
+    # Prose is mostly single spaces, which the patterns would try to match one by one
+    if "\n" not in text and "\t" not in text and "\f" not in text and "  " not in text:
+        return text
+    return SPACE_RUN_PATTERN.sub(" ", NEWLINE_RUN_PATTERN.sub("\n", text))
+
+
+def minify_html(content):
+    """Minify a stage HTML body; see the module docstring for what is removed."""
+    content = content.replace('\r\n', '\n').replace('\r', '\n')
+    parts = []
+    # Text around removed comments is joined before it is collapsed, so the result is stable
+    text = []
+    position = 0
+    for match in TOKEN_PATTERN.finditer(content):
+        text.append(content[position:match.start()])
+        position = match.end()
+        token = match.group()
+        if match.group("comment") is not None and not token.startswith(METADATA_COMMENT_PREFIX):
+            continue
+        parts.append(collapse_whitespace("".join(text)))
+        parts.append(token)
+        text = []
+    text.append(content[position:])
+    parts.append(collapse_whitespace("".join(text)))
+    return "".join(parts).strip(HTML_WHITESPACE) + "\n"
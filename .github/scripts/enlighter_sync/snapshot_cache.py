@@ -0,0 +1,195 @@
+"""Local cache of the remote rows the sync scripts diff against, refreshed incrementally.
+
+Every run used to read projects, stages, content_templates and project_bundles from scratch.
+With SYNC_SNAPSHOT_CACHE set to a file path, the columns of CACHED_TABLES are mirrored in that
+file, and each run only refreshes them:
+
+1. Rows whose updated_at is not older than the table's high-water mark (the newest updated_at
+   seen, minus SYNC_SNAPSHOT_OVERLAP_SECONDS for transactions that commit out of order) are fetched and merged.
+2. The remote row count is compared with the cached one; only if they differ, the primary keys
+   are read to drop the rows that were deleted.
+
+A table is reloaded in full when its cached columns changed, when it is older than
+SYNC_SNAPSHOT_MAX_AGE_HOURS (a safety net for changes that don't touch updated_at), or when the
+cache was written for another backend. A steady-state refresh costs two small requests per table.
+
+This relies on every write bumping updated_at, which the triggers of
+migrations/007_updated_at_triggers.sql guarantee; apply it before setting SYNC_SNAPSHOT_CACHE.
+
+The file is gzip-compressed JSON Lines: a header line with the version, the backend and the state
+of each table, then one line per row, {"table": ..., "row": {...}}, so it can also be analyzed offline.
+Rows that the current run writes are picked up by the next refresh, through their new updated_at.
+"""
+import datetime
+import gzip
+import json
+import os
+import re
+import threading
+import time
+
+from enlighter_sync.backends import get_backend
+
+# Bump when the file layout changes
+CACHE_VERSION = 1
+
+# Mirrored tables: their primary key and the columns kept; large HTML columns of stages and bundles are not
+CACHED_TABLES = {
+    "projects": ("id", "id, title, description, short_description, categories, cover_url, readme, ides, "
+                       "is_draft, content_hash, updated_at"),
+    "stages": ("id", "id, title, github_file_url, next_button_title, enabled, project_id, order_num, content_hash, updated_at"),
+    "content_templates": ("id", "id, name, content_hash, updated_at"),
+    "project_bundles": ("project_id", "project_id, hash, brotli_size, updated_at"),
+}
+
+SNAPSHOT_CACHE_PATH = os.environ.get("SYNC_SNAPSHOT_CACHE", "")
+MAX_AGE_HOURS = float(os.environ.get("SYNC_SNAPSHOT_MAX_AGE_HOURS", "24"))
+PAGE_SIZE = int(os.environ.get("SYNC_PAGE_SIZE", "1000"))
+# Writes of concurrent runs can commit after a refresh with an older updated_at
+REFRESH_OVERLAP = datetime.timedelta(seconds=float(os.environ.get("SYNC_SNAPSHOT_OVERLAP_SECONDS", "60")))
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_snapshot_cache():
+    """Get the snapshot cache of this process, or None if SYNC_SNAPSHOT_CACHE is not set."""
+    global _cache
+    with _cache_lock:
+        if _cache is None and SNAPSHOT_CACHE_PATH:
+            _cache = SnapshotCache(SNAPSHOT_CACHE_PATH)
+        return _cache
+
+
+def set_snapshot_cache(cache):
+    """Inject the snapshot cache used by the sync scripts, or None to disable it."""
+    global _cache
+    with _cache_lock:
+        _cache = cache
+
+
+def parse_timestamp(value):
+    """Parse a timestamp from Supabase or SQLite into an aware datetime (naive timestamps are UTC)."""
+    value = value.strip().replace(" ", "T", 1).replace("Z", "+00:00")
+    # Python 3.10 only parses fractions of exactly 3 or 6 digits, Postgres drops trailing zeros
+    value = re.sub(r"\.(\d+)", lambda match: "." + match.group(1)[:6].ljust(6, "0"), value)
+    timestamp = datetime.datetime.fromisoformat(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+    return timestamp
+
+
+def backend_source():
+    """Identify the backend the cached rows come from."""
+    name = os.environ.get("SYNC_BACKEND", "supabase")
+    return f"supabase:{os.environ.get('SUPABASE_URL', '')}" if name == "supabase" else name
+
+
+class SnapshotCache:
+    def __init__(self, path, source=None):
+        self.path = path
+        self.source = backend_source() if source is None else source
+        self.tables = {}
+        self.rows = {table: {} for table in CACHED_TABLES}
+        self.lock = threading.Lock()
+        # Tables already refreshed by this process
+        self._refreshed = set()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                header = json.loads(f.readline())
+                if header.get("version") != CACHE_VERSION or header.get("source") != self.source:
+                    return
+                rows = {table: {} for table in CACHED_TABLES}
+                for line in f:
+                    entry = json.loads(line)
+                    if entry['table'] in rows:
+                        key = CACHED_TABLES[entry['table']][0]
+                        rows[entry['table']][entry['row'][key]] = entry['row']
+        except Exception as e:
+            print(f"WARNING: Could not read the snapshot cache {self.path} ({e}), reloading it")
+            return
+        self.tables = header.get("tables", {})
+        self.rows = rows
+
+    def save(self):
+        with open(self.path + ".tmp", "wb") as raw, gzip.open(raw, "wt", encoding="utf-8", compresslevel=6) as f:
+            f.write(json.dumps({"version": CACHE_VERSION, "source": self.source, "tables": self.tables}) + "\n")
+            for table, rows in self.rows.items():
+                for key in sorted(rows):
+                    f.write(json.dumps({"table": table, "row": rows[key]}, ensure_ascii=False, separators=(",", ":")) + "\n")
+        os.replace(self.path + ".tmp", self.path)
+
+    def select(self, table, columns):
+        """Get the cached rows of a table with the given columns (as in a select), refreshing it first."""
+        with self.lock:
+            if table not in self._refreshed:
+                self._refresh(table)
+                self._refreshed.add(table)
+                try:
+                    self.save()
+                except Exception as e:
+                    print(f"WARNING: Could not save the snapshot cache: {e}")
+            selected = [column.strip() for column in columns.split(",")]
+            return [{column: row.get(column) for column in selected} for row in self.rows[table].values()]
+
+    def _refresh(self, table):
+        key, columns = CACHED_TABLES[table]
+        state = self.tables.get(table)
+        now = time.time()
+        if (state is None or state.get("columns") != columns or not state.get("high_water_mark")
+                or now - state.get("loaded_at", 0) > MAX_AGE_HOURS * 3600):
+            self._reload(table, key, columns, now)
+            return
+
+        rows = self.rows[table]
+        since = parse_timestamp(state["high_water_mark"]) - REFRESH_OVERLAP
+        changed = self._fetch(table, key, columns, since=since.isoformat())
+        for row in changed:
+            rows[row[key]] = row
+
+        remote_count = (
+            get_backend().table(table)
+            .select(key, count="exact")
+            .limit(1)
+            .execute()
+        ).count
+        deleted = 0
+        if remote_count != len(rows):
+            remote_keys = {row[key] for row in self._fetch(table, key, key)}
+            for stale_key in set(rows) - remote_keys:
+                del rows[stale_key]
+                deleted += 1
+            if len(rows) != remote_count:
+                # Rows were inserted with an updated_at older than the high-water mark
+                self._reload(table, key, columns, now)
+                return
+        state["high_water_mark"] = self._high_water_mark([{"updated_at": state["high_water_mark"]}, *changed])
+        print(f"Snapshot cache: {len(changed)} changed and {deleted} deleted row(s) of {table}, {len(rows)} cached")
+
+    def _reload(self, table, key, columns, now):
+        rows = self._fetch(table, key, columns)
+        self.rows[table] = {row[key]: row for row in rows}
+        self.tables[table] = {"columns": columns, "loaded_at": now, "high_water_mark": self._high_water_mark(rows)}
+        print(f"Snapshot cache: loaded {len(rows)} row(s) of {table}")
+
+    def _fetch(self, table, key, columns, since=None):
+        """Read the rows of a table, or those updated since a timestamp, page by page."""
+        rows = []
+        while True:
+            query = get_backend().table(table).select(columns)
+            if since is not None:
+                query = query.gte("updated_at", since)
+            response = query.order(key).range(len(rows), len(rows) + PAGE_SIZE - 1).execute()
+            rows.extend(response.data)
+            if len(response.data) < PAGE_SIZE:
+                return rows
+
+    @staticmethod
+    def _high_water_mark(rows):
+        timestamps = [row['updated_at'] for row in rows if row.get('updated_at')]
+        return max(timestamps, key=parse_timestamp) if timestamps else None
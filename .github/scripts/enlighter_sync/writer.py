@@ -0,0 +1,480 @@
+"""Batched writes of the sync scripts.
+
+Creates, updates and disables of projects, stages and templates, writes of project bundles and
+deletes of draft projects are collected as JSON-serializable operations by a BatchWriter and flushed as chunked bulk requests.
+Operations can be saved as a plan and applied later, and `sync.py all` collects the operations of
+templates, content and draft cleanup in a single writer, so they are flushed together.
+"""
+import datetime
+import json
+import os
+
+from enlighter_sync.backends import get_backend
+from enlighter_sync.concurrency import AdaptiveLimiter, run_concurrently
+from enlighter_sync.fingerprints import html_fingerprint
+from enlighter_sync.journal import operation_digest
+from enlighter_sync.metrics import metrics
+
+# Updates that change a large text column are upserted in bulk, since their values differ per row
+# anyway; all other updates are sent as patches of the changed columns only
+LARGE_TEXT_COLUMNS = {"projects": ("description", "readme"), "stages": ("description",)}
+
+# NOT NULL columns without a default: an upsert must carry them even if the row exists, so an
+# update operation keeps their remote values. Other unchanged columns are left out of the upsert,
+# so values written concurrently by someone else are not overwritten with those of the snapshot.
+REQUIRED_COLUMNS = {"projects": ("title",), "stages": ("title",)}
+
+# Pending writes are flushed as bulk requests of at most SYNC_BATCH_SIZE rows each
+SYNC_BATCH_SIZE = int(os.environ.get("SYNC_BATCH_SIZE", "500"))
+
+# Project bundles hold all stages of a project, so fewer of them fit in a request
+SYNC_BUNDLE_BATCH_SIZE = int(os.environ.get("SYNC_BUNDLE_BATCH_SIZE", "20"))
+
+# Independent bulk requests run concurrently, with at most SYNC_CONCURRENCY requests in flight.
+# The limiter lowers the cap when Supabase throttles or slows down; SYNC_CONCURRENCY=1 runs sequentially.
+# It is shared by all reads and writes of a process.
+SYNC_CONCURRENCY = int(os.environ.get("SYNC_CONCURRENCY", "4"))
+limiter = AdaptiveLimiter(SYNC_CONCURRENCY)
+
+
+def chunked(items, size):
+    """Split items into consecutive lists of at most `size` elements."""
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def build_project_row(project_info, is_draft):
+    """Build a new project row from project.json data."""
+    project_id = project_info['id']
+    title = project_info['title']
+
+    # Prepare project data
+    project_data = {
+        "id": project_id,
+        "title": title,
+        "enabled": False,  # Default value in schema
+        "visible": False,  # Default value in schema
+        "available_in_web": is_draft,  # Default value in schema
+        "is_draft": is_draft,  # Set is_draft=true for draft projects (negative IDs)
+        # Stages a draft project doesn't override are those of its source project
+        "source_project_id": project_info.get('original_id') if is_draft else None,
+    }
+
+    # Add additional fields from project.json
+    project_data.update({
+        "description": project_info.get('description', title),
+        "short_description": project_info.get('short_description', ''),
+        "categories": project_info.get('categories', ''),
+        "cover_url": project_info.get('cover_url', ''),
+        "readme": project_info.get('readme', ''),
+        "ides": project_info.get('ides', 'cursor'),
+        "content_hash": project_info['content_hash'],
+    })
+    return project_data
+
+
+def create_project_in_supabase(project_info, is_draft):
+    """Create a new project in Supabase using project.json data.
+
+    Creates are upserts, like in bulk, so a retry after a create that was committed doesn't fail.
+    """
+    response = (
+        get_backend().table("projects")
+        .upsert(build_project_row(project_info, is_draft), on_conflict="id", returning="minimal")
+        .execute()
+    )
+    return response
+
+
+def update_project_in_supabase(project_id, update_data):
+    """Update project in Supabase with data from project.json."""
+    response = (
+        get_backend().table("projects")
+        .update(update_data, returning="minimal")
+        .eq("id", project_id)
+        .execute()
+    )
+    return response
+
+
+def disable_stage_in_supabase(stage_id):
+    """Disable a stage in Supabase by setting enabled=false if the column exists."""
+    # We optimistically set enabled=false. If the column doesn't exist in schema, Supabase will raise an error.
+    # In that unlikely case, the CI logs will show it; but per project schema, stages support enabled.
+    return (
+        get_backend().table("stages")
+        .update({"enabled": False}, returning="minimal")
+        .eq("id", stage_id)
+        .execute()
+    )
+
+
+def update_stage_in_supabase(stage_id, update_data):
+    """Update the changed fields of a stage in Supabase."""
+    response = (
+        get_backend().table("stages")
+        .update(update_data, returning="minimal")
+        .eq("id", stage_id)
+        .execute()
+    )
+    return response
+
+
+def build_stage_row(stage_id, title, description, github_file_url, project_id, order_num, next_button_title=None, source_stage_id=None, enabled=True):
+    """Build a stage row; stages present in code are enabled.
+
+    A draft stage overrides the stage `source_stage_id` of its project's source project. A disabled
+    draft stage is a tombstone, hiding a stage deleted in the pull request.
+    """
+    return {
+        "id": stage_id,
+        "title": title,
+        "description": description,
+        "content_hash": html_fingerprint(description),
+        "github_file_url": github_file_url,
+        "project_id": project_id,
+        "order_num": order_num,
+        "next_button_title": next_button_title,
+        "source_stage_id": source_stage_id,
+        "enabled": enabled,
+    }
+
+
+def create_stage_in_supabase(stage_id, title, description, github_file_url, project_id, order_num, next_button_title=None, source_stage_id=None, enabled=True):
+    """Create a new stage in Supabase, enabled unless told otherwise, as an upsert like create_project_in_supabase()."""
+    response = (
+        get_backend().table("stages")
+        .upsert(build_stage_row(stage_id, title, description, github_file_url, project_id, order_num, next_button_title, source_stage_id, enabled), on_conflict="id", returning="minimal")
+        .execute()
+    )
+    return response
+
+
+def build_template_row(template_name, template_content):
+    """Build a template row, as upserted by name; created_at is set by the database."""
+    return {"name": template_name, **build_template_patch(template_content)}
+
+
+def build_template_patch(template_content):
+    """Build the columns that an update of a template's content changes."""
+    return {
+        "template": template_content,
+        "content_hash": html_fingerprint(template_content),
+        "updated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+
+
+def create_template_in_supabase(template_name, template_content):
+    """Create a new template in Supabase, as an upsert on its name like create_project_in_supabase()."""
+    response = (
+        get_backend().table("content_templates")
+        .upsert(build_template_row(template_name, template_content), on_conflict="name", returning="minimal")
+        .execute()
+    )
+    return response
+
+
+def update_template_in_supabase(template_name, template_content):
+    """Update template content in Supabase."""
+    response = (
+        get_backend().table("content_templates")
+        .update(build_template_patch(template_content), returning="minimal")
+        .eq("name", template_name)
+        .execute()
+    )
+    return response
+
+
+def upsert_bundle_in_supabase(bundle):
+    """Write the bundle of a project, replacing its previous one."""
+    response = (
+        get_backend().table("project_bundles")
+        .upsert(bundle, on_conflict="project_id", returning="minimal")
+        .execute()
+    )
+    return response
+
+
+def delete_projects_in_supabase(project_ids):
+    """Delete projects with their stages and bundles from Supabase, and return (deleted projects, deleted stages)."""
+    (
+        get_backend().table("project_bundles")
+        .delete(returning="minimal")
+        .in_("project_id", project_ids)
+        .execute()
+    )
+    stages = (
+        get_backend().table("stages")
+        .delete(count="exact", returning="minimal")
+        .in_("project_id", project_ids)
+        .execute()
+    )
+    projects = (
+        get_backend().table("projects")
+        .delete(count="exact", returning="minimal")
+        .in_("id", project_ids)
+        .execute()
+    )
+    return projects.count or 0, stages.count or 0
+
+
+def operation_row(operation):
+    """Build the complete row that a create or update operation upserts."""
+    action = operation['action']
+    if action == "create_project":
+        return build_project_row(operation['project_info'], operation['is_draft'])
+    if action in ("create_template", "update_template"):
+        return build_template_row(operation['name'], operation['template'])
+    if action == "upsert_bundle":
+        return operation['bundle']
+    if action in ("update_project", "update_stage"):
+        # Only the changed columns, and those an upsert requires, are written
+        return {"id": operation['id'], **operation['required'], **operation['update_data']}
+    return build_stage_row(**operation['stage'])
+
+
+def operation_patch(operation):
+    """Get the columns that an update or disable operation changes, or None if it upserts a complete row."""
+    if operation['action'] == "disable_stage":
+        return {"enabled": False}
+    if operation['action'] not in ("update_project", "update_stage"):
+        return None
+    table = "projects" if operation['action'] == "update_project" else "stages"
+    if any(column in operation['update_data'] for column in LARGE_TEXT_COLUMNS[table]):
+        return None
+    return operation['update_data']
+
+
+def replay_operation(operation):
+    """Apply a single operation with the single-row functions above."""
+    action = operation['action']
+    if action == "create_project":
+        return create_project_in_supabase(operation['project_info'], operation['is_draft'])
+    if action == "update_project":
+        return update_project_in_supabase(operation['id'], operation['update_data'])
+    if action == "create_stage":
+        return create_stage_in_supabase(**operation['stage'])
+    if action == "update_stage":
+        return update_stage_in_supabase(operation['id'], operation['update_data'])
+    if action == "create_template":
+        return create_template_in_supabase(operation['name'], operation['template'])
+    if action == "update_template":
+        return update_template_in_supabase(operation['name'], operation['template'])
+    if action == "upsert_bundle":
+        return upsert_bundle_in_supabase(operation['bundle'])
+    if action == "delete_project":
+        return delete_projects_in_supabase([operation['id']])
+    return disable_stage_in_supabase(operation['id'])
+
+
+class BatchWriter:
+    """Collect pending template, project and stage writes and flush them as chunked bulk requests.
+
+    Pending writes are kept as JSON-serializable operations, so they can also be saved as a plan.
+    Creates and updates of large text columns are sent as bulk upserts, templates as bulk upserts
+    on their name and bundles as bulk upserts on their project. Other updates and disables
+    are sent as patches of the changed columns: identical patches are grouped into one update
+    filtered by ID. Draft projects are deleted with their stages, in chunks filtered by ID.
+    When a bulk request fails, its operations are replayed one by one with the single-row
+    functions above, so failures are reported per row. Writes ask for no representation
+    (return=minimal): the written rows, with their HTML and bundle bodies, are not echoed back.
+
+    With a journal, operations it already records are skipped, and every batch of written
+    operations is recorded in it.
+    """
+
+    def __init__(self, operations=(), chunk_size=SYNC_BATCH_SIZE, limiter=limiter, journal=None):
+        self.chunk_size = chunk_size
+        self.limiter = limiter
+        self.operations = list(operations)
+        self.journal = journal
+        self.failures = []
+        self.deleted_projects = 0
+        self.deleted_stages = 0
+
+    def create_template(self, template_name, template_content):
+        self.operations.append({
+            "action": "create_template",
+            "id": None,
+            "name": template_name,
+            "template": template_content,
+        })
+
+    def update_template(self, template, template_content):
+        self.operations.append({
+            "action": "update_template",
+            "id": template['id'],
+            "name": template['name'],
+            "template": template_content,
+        })
+
+    def create_project(self, project_info, is_draft):
+        self.operations.append({
+            "action": "create_project",
+            "id": project_info['id'],
+            "project_info": project_info,
+            "is_draft": is_draft,
+        })
+
+    def update_project(self, project, update_data):
+        self.operations.append({
+            "action": "update_project",
+            "id": project['id'],
+            "changes": list(update_data),
+            "update_data": update_data,
+            "required": {column: project[column] for column in REQUIRED_COLUMNS["projects"]},
+        })
+
+    def create_stage(self, stage_id, title, description, github_file_url, project_id, order_num, next_button_title=None, source_stage_id=None, enabled=True):
+        self.operations.append({
+            "action": "create_stage",
+            "id": stage_id,
+            "stage": {
+                "stage_id": stage_id,
+                "title": title,
+                "description": description,
+                "github_file_url": github_file_url,
+                "project_id": project_id,
+                "order_num": order_num,
+                "next_button_title": next_button_title,
+                "source_stage_id": source_stage_id,
+                "enabled": enabled,
+            },
+        })
+
+    def update_stage(self, stage, update_data, changes=()):
+        self.operations.append({
+            "action": "update_stage",
+            "id": stage['id'],
+            "changes": list(changes),
+            "update_data": update_data,
+            "required": {column: stage[column] for column in REQUIRED_COLUMNS["stages"]},
+        })
+
+    def upsert_bundle(self, bundle):
+        self.operations.append({"action": "upsert_bundle", "id": bundle['project_id'], "bundle": bundle})
+
+    def disable_stage(self, stage_id):
+        self.operations.append({"action": "disable_stage", "id": stage_id})
+
+    def delete_project(self, project_id):
+        self.operations.append({"action": "delete_project", "id": project_id})
+
+    def pending_count(self):
+        return len(self.operations)
+
+    def flush(self):
+        """Flush all pending writes and return the list of rows that failed.
+
+        Projects are written before stages, since stages reference their project, and bundles
+        after the stages they contain. Deletes of draft projects come last. Chunks of the same kind are written concurrently, and their results are reported in order.
+        """
+        if self.journal is not None and self.operations:
+            try:
+                applied = self.journal.applied()
+            except Exception as e:
+                print(f"WARNING: Could not read the sync journal ({e}), writing without it")
+                self.journal = None
+                applied = set()
+            remaining = [operation for operation in self.operations if operation_digest(operation) not in applied]
+            if len(remaining) < len(self.operations):
+                print(f"Skipping {len(self.operations) - len(remaining)} change(s) already applied by an earlier attempt of this run")
+            self.operations = remaining
+
+        def pending(*actions):
+            return [operation for operation in self.operations if operation['action'] in actions]
+
+        def pending_upserts(*actions):
+            return [operation for operation in pending(*actions) if operation_patch(operation) is None]
+
+        def pending_patches(*actions):
+            return [operation for operation in pending(*actions) if operation_patch(operation) is not None]
+
+        previous_phase = metrics.switch_phase("write")
+        self._flush_chunks("upsert templates", self._upsert_chunks("content_templates", pending("create_template", "update_template"), on_conflict="name"))
+        self._flush_chunks("upsert projects", self._upsert_chunks("projects", pending_upserts("create_project", "update_project")))
+        self._flush_chunks("update projects", self._patch_chunks("projects", pending_patches("update_project")))
+        self._flush_chunks("upsert stages", self._upsert_chunks("stages", pending_upserts("create_stage", "update_stage")))
+        self._flush_chunks("update stages", self._patch_chunks("stages", pending_patches("update_stage")))
+        self._flush_chunks("upsert bundles", self._upsert_chunks("project_bundles", pending("upsert_bundle"), on_conflict="project_id", chunk_size=min(self.chunk_size, SYNC_BUNDLE_BATCH_SIZE)))
+        metrics.switch_phase("disable")
+        self._flush_chunks("disable stages", self._patch_chunks("stages", pending("disable_stage")))
+        metrics.switch_phase("delete")
+        for deleted_projects, deleted_stages in self._flush_chunks("delete projects", self._delete_chunks(pending("delete_project"))):
+            self.deleted_projects += deleted_projects
+            self.deleted_stages += deleted_stages
+        metrics.switch_phase(previous_phase)
+        self.operations = []
+        return self.failures
+
+    def _upsert_chunks(self, table, operations, on_conflict="", chunk_size=None):
+        # A bulk request requires every row to have the same columns
+        groups = {}
+        for operation in operations:
+            row = operation_row(operation)
+            groups.setdefault(tuple(sorted(row)), []).append((operation, row))
+        return [
+            ([operation for operation, _ in chunk], lambda rows=[row for _, row in chunk]: (
+                get_backend().table(table)
+                .upsert(rows, on_conflict=on_conflict, returning="minimal")
+                .execute()
+            ))
+            for group in groups.values()
+            for chunk in chunked(group, chunk_size or self.chunk_size)
+        ]
+
+    def _delete_chunks(self, operations):
+        return [
+            (chunk, lambda ids=[operation['id'] for operation in chunk]: delete_projects_in_supabase(ids))
+            for chunk in chunked(operations, self.chunk_size)
+        ]
+
+    def _patch_chunks(self, table, operations):
+        # Operations with the same patch are sent as one update filtered by their IDs
+        groups = {}
+        for operation in operations:
+            patch = operation_patch(operation)
+            groups.setdefault(json.dumps(patch, sort_keys=True), (patch, []))[1].append(operation)
+        return [
+            (chunk, lambda patch=patch, ids=[operation['id'] for operation in chunk]: (
+                get_backend().table(table)
+                .update(patch, returning="minimal")
+                .in_("id", ids)
+                .execute()
+            ))
+            for patch, group in groups.values()
+            for chunk in chunked(group, self.chunk_size)
+        ]
+
+    def _flush_chunks(self, label, chunks):
+        """Run the bulk writes of the chunks and return the results of the successful writes."""
+        results = run_concurrently([bulk_write for _, bulk_write in chunks], self.limiter)
+        written = []
+        succeeded = []
+        for (chunk, _), (result, error) in zip(chunks, results):
+            if error is None:
+                written.extend(chunk)
+                succeeded.append(result)
+                continue
+            print(f"WARNING: Bulk {label} of {len(chunk)} row(s) failed ({error}), retrying row by row")
+            replay_results = run_concurrently(
+                [lambda operation=operation: replay_operation(operation) for operation in chunk],
+                self.limiter,
+            )
+            for operation, (row_result, row_error) in zip(chunk, replay_results):
+                # Templates are created before they have an ID, so they are reported by name
+                target = operation.get('name', operation['id'])
+                if row_error is not None:
+                    print(f"ERROR: Failed to {label} row {target}: {row_error}")
+                    self.failures.append((label, target, str(row_error)))
+                else:
+                    written.append(operation)
+                    succeeded.append(row_result)
+
+        if self.journal is not None and written:
+            try:
+                self.journal.record(written)
+            except Exception as e:
+                print(f"WARNING: Could not record {len(written)} written change(s) in the sync journal: {e}")
+        return succeeded
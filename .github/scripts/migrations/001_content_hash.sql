@@ -0,0 +1,8 @@
+-- Content fingerprints used by the sync scripts to detect changes
+-- without downloading full HTML bodies (see enlighter_sync/fingerprints.py).
+-- Apply before deploying the sync scripts that read content_hash.
+-- Rows with a NULL hash are treated as changed and get their hash on the next sync.
+
+alter table public.projects add column if not exists content_hash text;
+alter table public.stages add column if not exists content_hash text;
+alter table public.content_templates add column if not exists content_hash text;
@@ -0,0 +1,8 @@
+-- Key/value state of the sync scripts, e.g. the last successfully synced commit
+-- that incremental push syncs diff from (see sync_content.py).
+
+create table if not exists public.sync_state (
+    key text primary key,
+    value text not null,
+    updated_at timestamptz not null default now()
+);
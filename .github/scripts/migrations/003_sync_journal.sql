@@ -0,0 +1,14 @@
+-- Append-only checkpoint journal of the write operations applied by a sync run,
+-- so a restarted run for the same commit skips them (see enlighter_sync/journal.py).
+
+create table if not exists public.sync_journal (
+    id bigint generated by default as identity primary key,
+    run text not null,
+    commit_sha text not null,
+    action text not null,
+    target_id bigint,
+    digest text not null,
+    created_at timestamptz not null default now()
+);
+
+create index if not exists sync_journal_run_commit_idx on public.sync_journal (run, commit_sha);
@@ -0,0 +1,4 @@
+-- Templates are upserted in bulk on their name (see sync_templates.py), which PostgREST
+-- resolves with ON CONFLICT (name): that needs a unique index on the column.
+
+create unique index if not exists content_templates_name_key on public.content_templates (name);
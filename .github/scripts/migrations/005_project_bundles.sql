@@ -0,0 +1,19 @@
+-- Precompressed per-project content bundles written by sync_content.py (see enlighter_sync/bundles.py):
+-- the enabled stages of a project in order, as one JSON document compressed with gzip and brotli.
+-- The app loads a project with one request, e.g. /rest/v1/project_bundles?project_id=eq.42&select=hash,brotli,
+-- and can cache the decoded bundle by its hash. Compressed bodies are base64-encoded.
+
+create table if not exists public.project_bundles (
+    project_id bigint primary key,
+    hash text not null,
+    version integer not null,
+    stage_count integer not null,
+    size integer not null,
+    gzip_size integer not null,
+    brotli_size integer,
+    gzip text not null,
+    brotli text,
+    updated_at timestamptz not null default now()
+);
+
+create index if not exists project_bundles_hash_idx on public.project_bundles (hash);
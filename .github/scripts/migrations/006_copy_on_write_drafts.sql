@@ -0,0 +1,10 @@
+-- Copy-on-write draft projects (see sync_content.py): a draft project only has rows for the stages
+-- a pull request added, changed or deleted; its other stages are those of its source project.
+-- The stages of a draft project are the enabled stages of projects.source_project_id that no stage
+-- of the draft overrides (stages.source_stage_id), plus the enabled stages of the draft itself.
+-- A disabled draft stage hides the stage it overrides. project_bundles holds the resolved stages.
+
+alter table public.projects add column if not exists source_project_id bigint;
+alter table public.stages add column if not exists source_stage_id bigint;
+
+create index if not exists stages_source_stage_id_idx on public.stages (source_stage_id) where source_stage_id is not null;
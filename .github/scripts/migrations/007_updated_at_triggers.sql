@@ -0,0 +1,37 @@
+-- Last-modified timestamps of the rows mirrored by the snapshot cache (see enlighter_sync/snapshot_cache.py),
+-- which only fetches rows whose updated_at is newer than the last refresh, and of the draft projects
+-- swept by `delete_drafts.py sweep --max-age-days`. Every insert, update and upsert must set it, so a
+-- trigger maintains it instead of the writers. Apply before enabling SYNC_SNAPSHOT_CACHE.
+
+alter table public.projects add column if not exists updated_at timestamptz not null default now();
+alter table public.stages add column if not exists updated_at timestamptz not null default now();
+alter table public.content_templates add column if not exists updated_at timestamptz not null default now();
+alter table public.project_bundles add column if not exists updated_at timestamptz not null default now();
+
+create or replace function public.set_updated_at() returns trigger
+language plpgsql as $$
+begin
+    new.updated_at = now();
+    return new;
+end;
+$$;
+
+-- Upserts that hit an existing row fire the update trigger too
+drop trigger if exists projects_set_updated_at on public.projects;
+create trigger projects_set_updated_at before update on public.projects
+    for each row execute function public.set_updated_at();
+drop trigger if exists stages_set_updated_at on public.stages;
+create trigger stages_set_updated_at before update on public.stages
+    for each row execute function public.set_updated_at();
+drop trigger if exists content_templates_set_updated_at on public.content_templates;
+create trigger content_templates_set_updated_at before update on public.content_templates
+    for each row execute function public.set_updated_at();
+drop trigger if exists project_bundles_set_updated_at on public.project_bundles;
+create trigger project_bundles_set_updated_at before update on public.project_bundles
+    for each row execute function public.set_updated_at();
+
+-- The incremental refresh reads `updated_at >= <high-water mark>`
+create index if not exists projects_updated_at_idx on public.projects (updated_at);
+create index if not exists stages_updated_at_idx on public.stages (updated_at);
+create index if not exists content_templates_updated_at_idx on public.content_templates (updated_at);
+create index if not exists project_bundles_updated_at_idx on public.project_bundles (updated_at);
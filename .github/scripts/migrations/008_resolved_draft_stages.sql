@@ -0,0 +1,30 @@
+-- Resolved stages of the copy-on-write draft projects (see 006_copy_on_write_drafts.sql), for readers
+-- of draft projects such as the draft previews linked from pull requests. A draft project only has
+-- rows for the stages its pull request added, changed or deleted, so reading its stages from the
+-- stages table misses the inherited ones; read them from this view instead, by project_id.
+--
+-- The stages of a draft project are its enabled stages plus the enabled stages of its source project
+-- that no stage of the same pull request overrides. A disabled draft stage (a tombstone) hides the
+-- stage it overrides; a stage moved to another project is overridden by its draft in that project.
+-- Draft IDs are -<original ID><pull request number, 5 digits>, so the pull request of a draft row
+-- is its negated ID modulo 100000. Inherited stages keep their live ID and source_stage_id is null.
+
+create or replace view public.resolved_draft_stages
+with (security_invoker = true) as
+select s.id, s.title, s.description, s.github_file_url, s.next_button_title, s.enabled,
+       s.project_id, s.order_num, s.source_stage_id, s.content_hash, s.created_at, s.updated_at
+from public.stages s
+join public.projects draft on draft.id = s.project_id
+where draft.is_draft and s.enabled
+union all
+select s.id, s.title, s.description, s.github_file_url, s.next_button_title, s.enabled,
+       draft.id as project_id, s.order_num, null as source_stage_id, s.content_hash, s.created_at, s.updated_at
+from public.projects draft
+join public.stages s on s.project_id = draft.source_project_id
+where draft.is_draft and s.enabled
+  and not exists (
+      select 1 from public.stages override
+      where override.source_stage_id = s.id
+        and override.id < 0
+        and (-override.id) % 100000 = (-draft.id) % 100000
+  );
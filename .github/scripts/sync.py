@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Single entry point of the sync scripts.
+
+    python .github/scripts/sync.py templates                                # same as sync_templates.py
+    python .github/scripts/sync.py content [sync|plan|apply|promote|merge]  # same as sync_content.py
+    python .github/scripts/sync.py drafts [pr|sweep]                        # same as delete_drafts.py
+    python .github/scripts/sync.py assets                                   # same as check_assets.py
+    python .github/scripts/sync.py all [--open-prs-file open_prs.json --max-age-days 30]
+
+`all` syncs templates and content, and sweeps the drafts of closed pull requests when the open
+pull requests are given, in one process: it discovers the local files once, loads a single
+remote snapshot of content_templates, projects and stages, diffs everything against it and
+flushes all writes through one BatchWriter. A full sync so costs one startup and one read pass.
+"""
+import argparse
+import importlib
+import sys
+
+from enlighter_sync.content_index import ContentIndex
+from enlighter_sync.metrics import metrics
+from enlighter_sync.writer import BatchWriter
+
+# Subcommands that run one of the scripts, with the remaining arguments. The scripts read their
+# environment (and check PR_NUMBER) when imported, so only the script that runs is imported.
+SCRIPTS = {
+    "templates": "sync_templates",
+    "content": "sync_content",
+    "drafts": "delete_drafts",
+    "assets": "check_assets",
+}
+
+
+def sync_all(open_pull_requests=None, max_age_days=None):
+    """Sync templates and content, and sweep drafts if the open pull requests are given, against one snapshot."""
+    import delete_drafts
+    import sync_content
+    import sync_templates
+
+    metrics.start("sync")
+    metrics.switch_phase("discovery")
+
+    # Templates are only synced from the main branch, not from pull requests
+    content_index = ContentIndex()
+    if sync_content.IS_PULL_REQUEST:
+        print("Skipping templates in a pull request")
+        local_templates, skipped_templates = [], 0
+    else:
+        local_templates, skipped_templates = sync_templates.discover_templates(content_index)
+    head_commit, local_projects = sync_content.discover_content(content_index)
+
+    metrics.switch_phase("remote_read")
+    remote_templates = {} if sync_content.IS_PULL_REQUEST else sync_templates.load_template_snapshot()
+    snapshot = sync_content.load_content_snapshot(local_projects)
+    all_draft_projects = delete_drafts.get_all_draft_projects() if open_pull_requests is not None else []
+
+    # All writes are collected in one writer and flushed together by apply_changeset()
+    writer = BatchWriter()
+
+    metrics.switch_phase("diff")
+    created_templates, updated_templates, missing_templates = sync_templates.diff_templates(local_templates, remote_templates, writer)
+    summary, draft_projects = sync_content.diff_content(local_projects, snapshot, content_index, writer)
+    if open_pull_requests is not None:
+        for project_id in delete_drafts.select_drafts_to_sweep(all_draft_projects, open_pull_requests, max_age_days, apply=True):
+            writer.delete_project(project_id)
+    metrics.switch_phase(None)
+    sync_content.save_content_index(content_index)
+
+    changeset = {
+        "version": sync_content.PLAN_VERSION,
+        "commit": head_commit,
+        "pull_request": sync_content.PR_NUMBER if sync_content.IS_PULL_REQUEST else None,
+        "operations": writer.operations,
+        "summary": summary,
+        "draft_projects": draft_projects,
+    }
+    applied = sync_content.apply_changeset(changeset)
+
+    templates_counters = {
+        "created": created_templates,
+        "updated": updated_templates,
+        "skipped": skipped_templates,
+        "missing": missing_templates,
+        "total_processed": len(local_templates) + skipped_templates,
+    }
+    print("\nTemplates:")
+    sync_templates.print_summary(templates_counters)
+    print("\nContent:")
+    sync_content.print_summary(changeset)
+    if open_pull_requests is not None:
+        delete_drafts.print_deletion_summary(applied.deleted_projects, applied.deleted_stages)
+
+    metrics.set_counters({
+        **{f"templates_{name}": value for name, value in templates_counters.items()},
+        **summary,
+        "deleted_projects": applied.deleted_projects,
+        "deleted_stages": applied.deleted_stages,
+    })
+
+    if sync_content.error_occurred:
+        print("\nERROR: One or more errors occurred during synchronization. Failing CI.")
+        exit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sync templates, content and drafts to Supabase.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("templates", help="Sync the templates (see sync_templates.py --help)")
+    subparsers.add_parser("content", help="Sync project and stage content (see sync_content.py --help)")
+    subparsers.add_parser("drafts", help="Delete draft projects (see delete_drafts.py --help)")
+    subparsers.add_parser("assets", help="Check the external URLs of the content (see check_assets.py --help)")
+    all_parser = subparsers.add_parser("all", help="Sync templates and content, and sweep drafts, against one remote snapshot with one writer")
+    all_parser.add_argument("--open-prs", help="Comma-separated numbers of the open pull requests; sweeps the drafts of closed pull requests")
+    all_parser.add_argument("--open-prs-file", help="File with the numbers of the open pull requests, or the JSON output of `gh pr list --json number,updatedAt`")
+    all_parser.add_argument("--max-age-days", type=int, help="Also delete drafts of open pull requests without activity for this many days (needs updatedAt in --open-prs-file)")
+
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in SCRIPTS:
+        return importlib.import_module(SCRIPTS[argv[0]]).main(argv[1:])
+
+    args = parser.parse_args(argv)
+    open_pull_requests = None
+    if args.open_prs is not None or args.open_prs_file is not None:
+        from delete_drafts import read_open_pull_requests
+        open_pull_requests = read_open_pull_requests(args.open_prs, args.open_prs_file)
+    elif args.max_age_days is not None:
+        parser.error("--max-age-days needs the open pull requests: pass --open-prs and/or --open-prs-file")
+    sync_all(open_pull_requests, args.max_age_days)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,17 +3,47 @@ import os
 import re
 import glob
 import json
+import argparse
 import subprocess
-from supabase import create_client
+import datetime
+
+from enlighter_sync.backends import get_backend
+from enlighter_sync.bundles import BUNDLE_SNAPSHOT_COLUMNS, build_bundle_row, bundle_is_outdated, bundle_manifest
+from enlighter_sync.concurrency import run_concurrently
+from enlighter_sync.content_index import ContentIndex, parse_stage_filename
+from enlighter_sync.fingerprints import PROJECT_FINGERPRINT_FIELDS, project_fingerprint, sha256_hex
+from enlighter_sync.journal import SYNC_RUN_ID, SyncJournal
+from enlighter_sync.metrics import metrics
+from enlighter_sync.minify import minify_html
+from enlighter_sync.snapshot_cache import get_snapshot_cache
+from enlighter_sync.writer import BatchWriter, chunked, limiter
 
-# Initialize Supabase client
 # Global flag to indicate if any non-fatal errors occurred; used to fail CI at the end
 error_occurred = False
 
-# Initialize Supabase client
-url = os.environ.get("SUPABASE_URL")
-key = os.environ.get("SUPABASE_KEY")
-supabase = create_client(url, key)
+# Remote rows are read in bulk: PostgREST caps a single response (1000 rows by default),
+# so reads are paged, and `in` filters are split into chunks to keep request URLs short.
+SNAPSHOT_PAGE_SIZE = int(os.environ.get("SYNC_PAGE_SIZE", "1000"))
+SNAPSHOT_FILTER_CHUNK = int(os.environ.get("SYNC_FILTER_CHUNK", "200"))
+
+# Change detection compares content hashes, so large text columns (project description and readme,
+# stage description) are only downloaded for projects whose hash differs and never for stages
+PROJECT_COLUMNS = "id, title, description, short_description, categories, cover_url, readme, ides, content_hash"
+PROJECT_FINGERPRINT_COLUMNS = "id, title, short_description, categories, cover_url, ides, content_hash"
+STAGE_COLUMNS = "id, title, github_file_url, next_button_title, enabled, project_id, order_num, content_hash"
+
+# Columns of the draft rows read by `sync_content.py promote`, whose stage HTML is copied to the live rows
+DRAFT_PROJECT_COLUMNS = "id, content_hash, source_project_id"
+DRAFT_STAGE_COLUMNS = STAGE_COLUMNS + ", description, source_stage_id"
+
+# Version of the JSON plan format written by `sync_content.py plan`
+PLAN_VERSION = 3
+
+# Version of the partial summaries written with --summary-output and combined by `sync_content.py merge`
+SHARD_SUMMARY_VERSION = 1
+
+# Writes are collected and flushed in bulk by the BatchWriter of enlighter_sync.writer, see there
+# for SYNC_BATCH_SIZE and SYNC_CONCURRENCY
 
 # GitHub repository information
 # Default to 'enlighter-content' repository if not specified
@@ -42,6 +72,17 @@ if IS_PULL_REQUEST:
         print("PR_NUMBER must be set when in a pull request context.")
         exit(1)
 
+# Push runs are incremental: they only sync files changed since the last successfully synced commit
+# (the watermark). Manual runs (workflow_dispatch) and SYNC_FULL=1 always sync everything.
+IS_INCREMENTAL = os.environ.get("GITHUB_EVENT_NAME") == "push" and os.environ.get("SYNC_FULL", "") not in ("1", "true")
+
+# The watermark is stored in the sync_state table, or in a local file when SYNC_WATERMARK_FILE is set
+SYNC_WATERMARK_KEY = "content_sync_commit"
+SYNC_WATERMARK_FILE = os.environ.get("SYNC_WATERMARK_FILE", "")
+
+# Changes to these paths may change how every file is synced, so they force a full sync
+FULL_SYNC_PATH_PREFIXES = (".github/scripts/", ".github/workflows/")
+
 # Draft project and stage IDs use the format: -<id_project><PR_NUMBER:5 digits with leading zeros>
 # For example, if a project has ID 42 and PR_NUMBER is 123, its draft ID would be -42000123
 # This ensures that draft projects and stages have unique IDs in the database
@@ -53,66 +94,167 @@ if IS_PULL_REQUEST:
 # This ensures that we only create draft projects for projects that are actually being changed,
 # which reduces database clutter and makes it easier to track changes.
 
-def get_modified_projects():
+# Within a modified project, only the stage files changed in the pull request are compared in full
+# (all of them if project.json changed); the other stages are only checked against their content hash.
+
+# Draft projects are copy-on-write: only the stages added, changed or deleted in the pull request get
+# draft rows, pointing at the live stage they override with source_stage_id. The other stages are
+# inherited from the live project (source_project_id), whose rows are not copied. A stage deleted in
+# the pull request gets a disabled draft row, which hides the live stage. A project whose project.json
+# changed is copied in full, since its ID, and so its live project, may have changed.
+# Readers of draft projects get the resolved stages from the resolved_draft_stages view, see
+# migrations/008_resolved_draft_stages.sql.
+
+def get_pull_request_changes():
     """
-    Get the list of project directories that have been modified in the pull request.
-    Returns a set of project directory names (e.g., 'project_10_rag_based_support_agent').
+    Get the files changed in the pull request, at file level.
+    Returns the set of added, modified and deleted paths; a renamed file is listed as its deleted
+    old path and its added new path. Stage IDs are part of the filenames, so a renamed stage file
+    keeps its stage row without tracking the rename.
     """
     if not IS_PULL_REQUEST:
-        # If not in a pull request, return an empty set
+        # If not in a pull request, nothing is changed
         return set()
 
     try:
         # Get the base branch (usually 'main')
         base_branch = os.environ.get("GITHUB_BASE_REF", "main")
 
-        # Get the list of modified files between the base branch and the current branch
-        # Using git diff to get the list of modified files
-        cmd = ["git", "diff", "--name-only", f"origin/{base_branch}...HEAD"]
+        # Get the changed files between the base branch and the current branch
+        cmd = ["git", "diff", "--name-status", "--no-renames", f"origin/{base_branch}...HEAD"]
         result = subprocess.run(cmd, capture_output=True, text=True)
         if result.returncode != 0:
             print(f"Error: Git command failed with exit status {result.returncode}")
             print(f"Error output: {result.stderr}")
             # Exit with error code 1
             exit(1)
-        modified_files = result.stdout.strip().split('\n')
-
-        # Extract project directories from modified files
-        # Project directories follow the pattern 'project_*'
-        modified_projects = set()
-        for file_path in modified_files:
-            # Skip empty lines
-            if not file_path:
-                continue
 
-            # Extract project directory from file path
-            # Example: 'project_10_rag_based_support_agent/file.html' -> 'project_10_rag_based_support_agent'
-            match = re.match(r'(project_[^/]+)/', file_path)
-            if match:
-                modified_projects.add(match.group(1))
-
-        print(f"Modified projects in this PR: {', '.join(modified_projects) if modified_projects else 'None'}")
-        return modified_projects
+        changed_files = set()
+        for line in result.stdout.splitlines():
+            # Format: <status>\t<path>
+            changed_files.update(line.split('\t')[1:])
+        return changed_files
     except Exception as e:
-        print(f"Error getting modified projects: {e}")
+        print(f"Error getting the files changed in the pull request: {e}")
         # Exit with error code 1
         exit(1)
 
-def read_project_json(project_dir):
-    """Read project information from project.json file."""
+def get_modified_projects(changed_files):
+    """
+    Get the project directories with changed files.
+    Returns a set of project directory names (e.g., 'project_10_rag_based_support_agent').
+    """
+    modified_projects = set()
+    for file_path in changed_files:
+        # Extract project directory from file path
+        # Example: 'project_10_rag_based_support_agent/file.html' -> 'project_10_rag_based_support_agent'
+        match = re.match(r'(project_[^/]+)/', file_path)
+        if match:
+            modified_projects.add(match.group(1))
+    return modified_projects
+
+def run_git(*args):
+    """Run a git command and return its result without raising on failure."""
+    return subprocess.run(["git", *args], capture_output=True, text=True)
+
+def get_head_commit():
+    """Get the SHA of the checked out commit, or None if it can't be determined."""
+    result = run_git("rev-parse", "HEAD")
+    return result.stdout.strip() if result.returncode == 0 else None
+
+def get_sync_watermark():
+    """Get the SHA of the last successfully synced commit, or None if there is none."""
+    if SYNC_WATERMARK_FILE:
+        if os.path.exists(SYNC_WATERMARK_FILE):
+            with open(SYNC_WATERMARK_FILE, 'r', encoding='utf-8') as f:
+                return f.read().strip() or None
+        return None
+
+    response = (
+        get_backend().table("sync_state")
+        .select("value")
+        .eq("key", SYNC_WATERMARK_KEY)
+        .execute()
+    )
+    if response.data:
+        return response.data[0]['value']
+    return None
+
+def set_sync_watermark(commit_sha):
+    """Record the SHA of the last successfully synced commit."""
+    if SYNC_WATERMARK_FILE:
+        with open(SYNC_WATERMARK_FILE, 'w', encoding='utf-8') as f:
+            f.write(commit_sha + "\n")
+        return None
+
+    return (
+        get_backend().table("sync_state")
+        .upsert({
+            "key": SYNC_WATERMARK_KEY,
+            "value": commit_sha,
+            "updated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        })
+        .execute()
+    )
+
+def get_files_changed_since_watermark(head_commit):
+    """
+    Get the set of files changed between the sync watermark and HEAD.
+    For renames, both the old and the new path are included.
+    Returns None when a full sync is needed: the watermark is missing or unreachable,
+    or the sync scripts themselves changed.
+    """
+    try:
+        watermark = get_sync_watermark()
+    except Exception as e:
+        print(f"Could not read the sync watermark ({e}), falling back to a full sync")
+        return None
+
+    if not watermark or not head_commit:
+        print("No sync watermark found, falling back to a full sync")
+        return None
+
+    # The watermark must be a known commit that is an ancestor of HEAD (e.g. not lost in a force-push)
+    if run_git("merge-base", "--is-ancestor", watermark, head_commit).returncode != 0:
+        print(f"Sync watermark {watermark} is not reachable from HEAD, falling back to a full sync")
+        return None
+
+    result = run_git("diff", "--name-status", "-M", watermark, head_commit)
+    if result.returncode != 0:
+        print(f"Error: Git diff from watermark failed ({result.stderr.strip()}), falling back to a full sync")
+        return None
+
+    changed_files = set()
+    for line in result.stdout.splitlines():
+        # Format: <status>\t<path>, or <status>\t<old path>\t<new path> for renames and copies
+        changed_files.update(line.split('\t')[1:])
+
+    forcing_files = sorted(path for path in changed_files if path.startswith(FULL_SYNC_PATH_PREFIXES))
+    if forcing_files:
+        print(f"Sync scripts changed since {watermark} ({', '.join(forcing_files)}), falling back to a full sync")
+        return None
+
+    print(f"Incremental sync from watermark {watermark}: {len(changed_files)} changed file(s)")
+    return changed_files
+
+def read_project_json(project_dir, content_index):
+    """Read project information from project.json file, through the content index."""
     project_json_path = os.path.join(project_dir, "project.json")
     if os.path.exists(project_json_path):
         try:
-            with open(project_json_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            record = content_index.json(project_json_path)
         except Exception as e:
             print(f"Error reading project.json for {project_dir}: {e}")
+            return None
+        if record.error is not None:
+            print(f"Error reading project.json for {project_dir}: {record.error}")
+        return record.data
     return None
 
-def extract_project_info_from_dirname(dirname, is_draft):
+def extract_project_info_from_dirname(dirname, is_draft, content_index):
     """Extract project ID and title from project.json."""
     # Read from project.json - it's mandatory
-    project_json = read_project_json(dirname)
+    project_json = read_project_json(dirname, content_index)
 
     # Exit with error if project.json is not found
     if project_json is None:
@@ -149,6 +291,7 @@ def extract_project_info_from_dirname(dirname, is_draft):
         'readme': project_json.get('readme', ''),
         'ides': project_json.get('ides', 'cursor')
     }
+    result['content_hash'] = project_fingerprint(result)
 
     # Store the original ID in the project_info dictionary if this is a draft project
     if is_draft:
@@ -156,75 +299,17 @@ def extract_project_info_from_dirname(dirname, is_draft):
 
     return result
 
-def get_project_from_supabase(project_id):
-    """Get project from Supabase by ID."""
-    response = (
-        supabase.table("projects")
-        .select("id, title, description, short_description, categories, cover_url, readme, ides")
-        .eq("id", project_id)
-        .execute()
-    )
-
-    if response.data and len(response.data) > 0:
-        return response.data[0]
-    return None
-
-def create_project_in_supabase(project_info, is_draft):
-    """Create a new project in Supabase using project.json data."""
-    project_id = project_info['id']
-    title = project_info['title']
-
-    # Prepare project data
-    project_data = {
-        "id": project_id,
-        "title": title,
-        "enabled": False,  # Default value in schema
-        "visible": False,  # Default value in schema
-        "available_in_web": is_draft,  # Default value in schema
-        "is_draft": is_draft,  # Set is_draft=true for draft projects (negative IDs)
-    }
-
-    # Add additional fields from project.json
-    project_data.update({
-        "description": project_info.get('description', title),
-        "short_description": project_info.get('short_description', ''),
-        "categories": project_info.get('categories', ''),
-        "cover_url": project_info.get('cover_url', ''),
-        "readme": project_info.get('readme', ''),
-        "ides": project_info.get('ides', 'cursor')
-    })
-
-    response = (
-        supabase.table("projects")
-        .insert(project_data)
-        .execute()
-    )
-    return response
-
-def update_project_in_supabase(project_id, update_data):
-    """Update project in Supabase with data from project.json."""
-    response = (
-        supabase.table("projects")
-        .update(update_data)
-        .eq("id", project_id)
-        .execute()
-    )
-    return response
-
-def extract_info_from_filename(filename, is_draft=False):
-    """Extract stage ID, order number, and title from filename."""
+def extract_info_from_filename(filename, content_index, is_draft=False):
+    """Extract stage ID, order number, and title from filename, as parsed by the content index."""
     # Pattern: <order_num>_<id>_<title>.html
-    pattern = r'(\d+)_(\d+)_(.+)\.html$'
-    match = re.match(pattern, os.path.basename(filename))
+    record = content_index.html(filename)
 
-    if not match:
+    if record.stage_id is None:
         return None
 
-    order_num, stage_id, title = match.groups()
-
-    # Convert to integers
-    order_num_int = int(order_num)
-    stage_id_int = int(stage_id)
+    order_num_int = record.order_num
+    stage_id = record.stage_id
+    stage_id_int = stage_id
 
     if is_draft:
         # Use the new format: -<id_stage><PR_NUMBER:5 digits with leading zeros>
@@ -235,107 +320,221 @@ def extract_info_from_filename(filename, is_draft=False):
     return {
         'order_num': order_num_int,
         'id': stage_id_int,
-        'title': title.replace('_', ' ')
+        'title': record.title
     }
 
-def get_stage_from_supabase(stage_id):
-    """Get stage from Supabase by ID, including enabled flag and project_id."""
-    response = (
-        supabase.table("stages")
-        .select("id, title, description, github_file_url, next_button_title, enabled, project_id")
-        .eq("id", stage_id)
-        .execute()
-    )
-
-    if response.data and len(response.data) > 0:
-        return response.data[0]
-    return None
 
+def fetch_rows_from_supabase(table, columns, column, values, order="id"):
+    """Fetch all rows of a table whose `column` is one of `values`.
 
-def get_project_stages_from_supabase(project_id):
-    """Get all stages for a project from Supabase by project_id."""
-    response = (
-        supabase.table("stages")
-        .select("id, title")
-        .eq("project_id", project_id)
-        .execute()
+    Values are sent in chunks of SNAPSHOT_FILTER_CHUNK per `in` filter (to keep request URLs short),
+    and every chunk is read in pages of SNAPSHOT_PAGE_SIZE rows, so the number of round-trips
+    depends on the number of pages rather than on the number of rows.
+    Chunks are read concurrently; rows are returned in chunk order. Pages are ordered by the unique `order` column.
+    """
+    def fetch_chunk(values_chunk):
+        rows = []
+        offset = 0
+        while True:
+            response = (
+                get_backend().table(table)
+                .select(columns)
+                .in_(column, values_chunk)
+                .order(order)
+                .range(offset, offset + SNAPSHOT_PAGE_SIZE - 1)
+                .execute()
+            )
+            page = response.data or []
+            rows.extend(page)
+            if len(page) < SNAPSHOT_PAGE_SIZE:
+                return rows
+            offset += SNAPSHOT_PAGE_SIZE
+
+    results = run_concurrently(
+        [lambda values_chunk=values_chunk: fetch_chunk(values_chunk)
+         for values_chunk in chunked(sorted(set(values)), SNAPSHOT_FILTER_CHUNK)],
+        limiter,
     )
-    return response.data or []
-
+    rows = []
+    for chunk_rows, error in results:
+        if error is not None:
+            raise error
+        rows.extend(chunk_rows)
+    return rows
+
+
+def load_remote_snapshot(project_hashes, stage_ids):
+    """Load the remote state of the given projects and stages in a few bulk queries.
+
+    `project_hashes` maps project IDs to their local content hash. Full project rows are
+    only fetched for projects whose remote hash differs.
+    Stages are fetched both by project (to find stages missing from code) and by ID
+    (to find stages that currently belong to another project).
+    Returns a dict with 'projects' and 'stages' keyed by ID, and 'bundles' keyed by project ID.
+    With a snapshot cache, the same rows are read from it instead.
+    """
+    cache = get_snapshot_cache()
+    if cache is not None:
+        return load_cached_snapshot(cache, project_hashes, stage_ids)
+
+    project_ids = list(project_hashes)
+    projects = {
+        row['id']: row
+        for row in fetch_rows_from_supabase("projects", PROJECT_FINGERPRINT_COLUMNS, "id", project_ids)
+    }
+    changed_project_ids = [
+        project_id for project_id, row in projects.items()
+        if row.get('content_hash') != project_hashes[project_id]
+    ]
+    if changed_project_ids:
+        for row in fetch_rows_from_supabase("projects", PROJECT_COLUMNS, "id", changed_project_ids):
+            projects[row['id']] = row
+
+    stages = {
+        row['id']: row
+        for row in fetch_rows_from_supabase("stages", STAGE_COLUMNS, "project_id", project_ids)
+    }
+    other_stage_ids = set(stage_ids) - set(stages)
+    if other_stage_ids:
+        for row in fetch_rows_from_supabase("stages", STAGE_COLUMNS, "id", other_stage_ids):
+            stages[row['id']] = row
+
+    bundles = {
+        row['project_id']: row
+        for row in fetch_rows_from_supabase("project_bundles", BUNDLE_SNAPSHOT_COLUMNS, "project_id", project_ids, order="project_id")
+    }
 
-def disable_stage_in_supabase(stage_id):
-    """Disable a stage in Supabase by setting enabled=false if the column exists."""
-    # We optimistically set enabled=false. If the column doesn't exist in schema, Supabase will raise an error.
-    # In that unlikely case, the CI logs will show it; but per project schema, stages support enabled.
-    return (
-        supabase.table("stages")
-        .update({"enabled": False})
-        .eq("id", stage_id)
-        .execute()
-    )
+    print(f"Loaded remote snapshot: {len(projects)} project(s), {len(stages)} stage(s), {len(bundles)} bundle(s)")
+    return {'projects': projects, 'stages': stages, 'bundles': bundles}
+
+def load_cached_snapshot(cache, project_hashes, stage_ids):
+    """Select the rows of load_remote_snapshot() from the snapshot cache, which has full project rows."""
+    project_ids = set(project_hashes)
+    stage_ids = set(stage_ids)
+    projects = {
+        row['id']: row
+        for row in cache.select("projects", PROJECT_COLUMNS)
+        if row['id'] in project_ids
+    }
+    stages = {
+        row['id']: row
+        for row in cache.select("stages", STAGE_COLUMNS)
+        if row['project_id'] in project_ids or row['id'] in stage_ids
+    }
+    bundles = {
+        row['project_id']: row
+        for row in cache.select("project_bundles", BUNDLE_SNAPSHOT_COLUMNS)
+        if row['project_id'] in project_ids
+    }
+    print(f"Loaded cached snapshot: {len(projects)} project(s), {len(stages)} stage(s), {len(bundles)} bundle(s)")
+    return {'projects': projects, 'stages': stages, 'bundles': bundles}
 
 def get_github_file_url(file_path):
     """Construct GitHub URL for a file."""
     return f"https://github.com/{GITHUB_REPO_OWNER}/{GITHUB_REPO_NAME}/blob/main/{file_path}"
 
-def update_stage_in_supabase(stage_id, description, github_file_url, title, next_button_title, project_id):
-    """Update stage fields in Supabase and ensure it's enabled when present in code, including project_id."""
-    response = (
-        supabase.table("stages")
-        .update({
-            "description": description,
-            "github_file_url": github_file_url,
-            "title": title,
-            "next_button_title": next_button_title,
-            "enabled": True,
-            "project_id": project_id,
-        })
-        .eq("id", stage_id)
-        .execute()
-    )
-    return response
+def read_stage_content(html_file):
+    """Read the HTML content of a stage file, minified as it is written to Supabase."""
+    with open(html_file, 'r', encoding='utf-8') as f:
+        return minify_html(f.read())
 
+def parse_shard(value):
+    """Parse a shard given as `i/N`, with 1 <= i <= N, into (i, N)."""
+    match = re.fullmatch(r"(\d+)/(\d+)", value.strip())
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise argparse.ArgumentTypeError(f"invalid shard {value!r}, expected i/N with 1 <= i <= N")
+    return int(match.group(1)), int(match.group(2))
 
+def get_project_shard(project_id, shard_count):
+    """Get the shard (1 to shard_count) of a project, from a stable hash of its ID."""
+    return int(sha256_hex(str(project_id))[:8], 16) % shard_count + 1
 
-def extract_metadata_from_html(file_content):
-    """Extract metadata from HTML file content."""
-    metadata_pattern = r'<!-- Enlighter Metainfo\s*(\{.*?\})\s*-->'
-    match = re.search(metadata_pattern, file_content, re.DOTALL)
+def discover_content(content_index, shard=None):
+    """
+    Find the projects and stage files to sync, without reading anything from Supabase.
+    With a shard (i, N), only the projects of that shard are returned; a draft project is in the shard of its live project.
+    Returns the checked out commit and the list of local projects, as
+    (project directory, project info, [(stage file, file info)], stage files to diff or None for all).
+    """
+    # Find all project directories
+    project_dirs = sorted(glob.glob("project_*"))
+    print(f"Found {len(project_dirs)} project directories")
 
-    if match:
-        try:
-            metadata_json = match.group(1)
-            metadata = json.loads(metadata_json)
-            return metadata
-        except Exception as e:
-            print(f"Error parsing metadata: {e}")
+    # Get the files and projects changed in the pull request once
+    pull_request_files = get_pull_request_changes()
+    modified_projects = get_modified_projects(pull_request_files)
+    if IS_PULL_REQUEST:
+        print(f"Modified projects in this PR: {', '.join(modified_projects) if modified_projects else 'None'}")
 
-    return None
+    # On push, get the files changed since the last successfully synced commit (None means full sync)
+    head_commit = get_head_commit()
+    incremental_files = get_files_changed_since_watermark(head_commit) if IS_INCREMENTAL else None
+    # Files whose stages are compared in full; stages of other files are only checked against their hash
+    changed_files = pull_request_files if IS_PULL_REQUEST else incremental_files
+    if incremental_files is not None:
+        incremental_projects = {path.split('/')[0] for path in incremental_files if path.startswith("project_")}
+        print(f"Projects affected since the last sync: {', '.join(sorted(incremental_projects)) if incremental_projects else 'None'}")
+
+    # Discover projects and stage files first, so the remote state of everything
+    # we are going to compare can be loaded in a few bulk queries
+    local_projects = []
+    for project_dir in project_dirs:
+        # Skip projects not in modified_projects for pull requests
+        if IS_PULL_REQUEST and project_dir not in modified_projects:
+            print(f"Skipping project {project_dir} as it's not in modified_projects")
+            continue
+        if incremental_files is not None and project_dir not in incremental_projects:
+            continue
 
-def create_stage_in_supabase(stage_id, title, description, github_file_url, project_id, order_num, next_button_title=None):
-    """Create a new stage in Supabase and ensure it's enabled."""
-    response = (
-        supabase.table("stages")
-        .insert({
-            "id": stage_id,
-            "title": title,
-            "description": description,
-            "github_file_url": github_file_url,
-            "project_id": project_id,
-            "order_num": order_num,
-            "next_button_title": next_button_title,
-            "enabled": True,
-        })
-        .execute()
+        # Extract project information from directory name
+        project_info = extract_project_info_from_dirname(project_dir, IS_PULL_REQUEST, content_index)
+        if shard is not None and get_project_shard(project_info.get('original_id', project_info['id']), shard[1]) != shard[0]:
+            continue
+
+        # Find all HTML files in this project directory and extract information from filenames
+        with metrics.phase("metadata_parse"):
+            stage_files = [
+                (html_file, extract_info_from_filename(html_file, content_index, is_draft=IS_PULL_REQUEST))
+                for html_file in glob.glob(f"{project_dir}/*.html")
+            ]
+        # In a pull request or an incremental sync, only changed stage files are diffed, unless project.json changed
+        files_to_diff = None
+        if changed_files is not None and f"{project_dir}/project.json" not in changed_files:
+            # Includes deleted stage files, whose stages are hidden in a draft project
+            files_to_diff = {path for path in changed_files if path.startswith(f"{project_dir}/") and path.endswith(".html")}
+
+        local_projects.append((project_dir, project_info, stage_files, files_to_diff))
+
+    if shard is not None:
+        print(f"Shard {shard[0]}/{shard[1]}: {len(local_projects)} project(s) to sync")
+    return head_commit, local_projects
+
+
+def get_stage_ids_in_repository():
+    """Get the IDs of the stages of all project_*/*.html files, as synced (draft IDs in a pull request)."""
+    stage_ids = set()
+    for html_file in glob.glob("project_*/*.html"):
+        filename_info = parse_stage_filename(html_file)
+        if filename_info is None:
+            continue
+        stage_id = filename_info[1]
+        stage_ids.add(-int(f"{stage_id}{PR_NUMBER:05d}") if IS_PULL_REQUEST else stage_id)
+    return stage_ids
+
+
+def load_content_snapshot(local_projects):
+    """Load the remote state of the discovered projects and their stages."""
+    return load_remote_snapshot(
+        {project_info['id']: project_info['content_hash'] for _, project_info, _, _ in local_projects},
+        [file_info['id'] for _, _, stage_files, _ in local_projects for _, file_info in stage_files if file_info],
     )
-    return response
 
-def main():
-    global error_occurred
-    # Find all project directories
-    project_dirs = glob.glob("project_*")
-    print(f"Found {len(project_dirs)} project directories")
 
+def diff_content(local_projects, snapshot, content_index, writer):
+    """
+    Diff the discovered projects against the remote snapshot, adding all creates, updates
+    and disables to the writer. Returns the summary counters and the draft projects.
+    """
     # Counters for non-draft entities
     updated_count = 0
     created_count = 0
@@ -352,26 +551,28 @@ def main():
     skipped_count = 0
     not_found_count = 0
     total_html_files = 0
+    html_bytes = 0
+    html_bytes_minified = 0
+    inherited_count_draft = 0
+    bundles_count = 0
+    bundle_bytes = 0
+    bundle_bytes_gzip = 0
+    bundle_bytes_brotli = 0
 
     # Track all draft projects for PR comments
     all_draft_projects = []
 
-    # Get the list of modified projects in the pull request once
-    modified_projects = get_modified_projects()
-
-    for project_dir in project_dirs:
-        # Skip projects not in modified_projects for pull requests
-        if IS_PULL_REQUEST and project_dir not in modified_projects:
-            print(f"Skipping project {project_dir} as it's not in modified_projects")
-            continue
-
-        # Extract project information from directory name
-        project_info = extract_project_info_from_dirname(project_dir, is_draft=IS_PULL_REQUEST)
+    # Track stage IDs present in code across the repository, not only in the synced projects:
+    # a stage moved to a project of another shard must not be disabled by this one
+    stage_ids_in_code = get_stage_ids_in_repository()
+    # Stage files deleted in the pull request, hidden once all stage IDs in code are known
+    deleted_stage_files = []
 
+    for project_dir, project_info, stage_files, files_to_diff in local_projects:
         if project_info:
             # Check if project exists in Supabase
             project_id = project_info['id']
-            project = get_project_from_supabase(project_id)
+            project = snapshot['projects'].get(project_id)
             if IS_PULL_REQUEST:
                 # Use the original_id from project_info if available, otherwise calculate it
                 if 'original_id' in project_info:
@@ -393,16 +594,17 @@ def main():
                 # Create new project if it doesn't exist
                 is_draft = project_id < 0
                 print(f"Creating new project with ID {project_id} ({project_info['title']}), is_draft={is_draft}")
-                create_project_in_supabase(project_info, is_draft=IS_PULL_REQUEST)
+                writer.create_project(project_info, is_draft=IS_PULL_REQUEST)
 
                 # Increment the appropriate counter based on whether the project is a draft
                 if is_draft:
                     created_projects_count_draft += 1
                 else:
                     created_projects_count += 1
-            else:
-                # Check if project data in Supabase differs from project.json
-                update_data = {}
+            elif project.get('content_hash') != project_info['content_hash']:
+                # The content hash differs, so the snapshot holds the full project row:
+                # check which project data in Supabase differs from project.json
+                update_data = {"content_hash": project_info['content_hash']}
 
                 # Only include fields that are in project_info
                 if 'title' in project_info and project_info['title'] != project.get('title', ''):
@@ -422,9 +624,9 @@ def main():
 
                 if update_data:
                     # Create a list of changed fields for detailed logging
-                    changed_fields = list(update_data.keys())
+                    changed_fields = [field for field in update_data if field != "content_hash"] or ["content_hash"]
                     print(f"Updating project with ID {project_id} ({project_info['title']}) - Changed fields: {', '.join(changed_fields)}")
-                    update_project_in_supabase(project_id, update_data)
+                    writer.update_project(project, update_data)
 
                     # Increment the appropriate counter based on whether the project is a draft
                     if project_id < 0:
@@ -432,37 +634,50 @@ def main():
                     else:
                         updated_projects_count += 1
 
-        # Find all HTML files in this project directory
-        html_files = glob.glob(f"{project_dir}/*.html")
-        total_html_files += len(html_files)
-        print(f"Found {len(html_files)} HTML files in {project_dir}")
+        total_html_files += len(stage_files)
+        print(f"Found {len(stage_files)} HTML files in {project_dir}")
 
-        # Track stage IDs present in code for this project
-        stage_ids_in_code = set()
+        # Report how much minification saves on the stages of this project
+        records = [content_index.html(html_file) for html_file, file_info in stage_files if file_info]
+        project_bytes = sum(record.size for record in records)
+        project_bytes_minified = sum(record.minified_size for record in records)
+        html_bytes += project_bytes
+        html_bytes_minified += project_bytes_minified
+        if project_bytes:
+            print(f"Minified HTML of {project_dir}: {project_bytes} -> {project_bytes_minified} bytes "
+                  f"({100 * (project_bytes - project_bytes_minified) / project_bytes:.1f}% saved)")
 
-        # Process each HTML file in this project directory
-        for html_file in html_files:
-            # Extract information from filename
-            file_info = extract_info_from_filename(html_file, is_draft=IS_PULL_REQUEST)
+        # Stage files of a draft project that are inherited from the live project
+        inherited_files = set()
 
+        # Process each HTML file in this project directory
+        for html_file, file_info in stage_files:
             if not file_info:
                 print(f"Skipping {html_file}: Filename doesn't match expected pattern")
                 skipped_count += 1
                 continue
 
-            # Get stage from Supabase
+            # Get stage from the remote snapshot
             stage_id = file_info['id']
-            stage = get_stage_from_supabase(stage_id)
+            stage = snapshot['stages'].get(stage_id)
             # Track this stage as present in code
             stage_ids_in_code.add(stage_id)
 
+            # Get metadata and content hash from the content index (the file was indexed during discovery)
+            record = content_index.html(html_file)
 
-            # Read HTML content from file
-            with open(html_file, 'r', encoding='utf-8') as f:
-                file_content = f.read()
+            # Unchanged in the pull request or since the last synced commit, nothing to compare unless the
+            # remote content differs (e.g. a change that was reverted or dropped by a force-push)
+            if stage and files_to_diff is not None and html_file not in files_to_diff and record.content_hash == stage.get('content_hash'):
+                continue
 
-            # Extract metadata from HTML content
-            metadata = extract_metadata_from_html(file_content)
+            # A draft project inherits the stages the pull request didn't change, see above
+            if not stage and IS_PULL_REQUEST and files_to_diff is not None and html_file not in files_to_diff:
+                inherited_files.add(html_file)
+                inherited_count_draft += 1
+                continue
+
+            metadata = record.metadata
 
             # Metadata is mandatory, exit with error if missing
             if metadata is None:
@@ -481,7 +696,10 @@ def main():
                 # Create new stage if it doesn't exist
                 if project_info:
                     print(f"Creating new stage with ID {stage_id} ({title})")
-                    create_stage_in_supabase(stage_id, title, file_content, github_file_url, project_info['id'], file_info['order_num'], next_button_title)
+                    writer.create_stage(
+                        stage_id, title, read_stage_content(html_file), github_file_url, project_info['id'], file_info['order_num'],
+                        next_button_title, source_stage_id=record.stage_id if IS_PULL_REQUEST else None,
+                    )
 
                     # Increment the appropriate counter based on whether the stage is a draft
                     if stage_id < 0:
@@ -493,8 +711,8 @@ def main():
                     skipped_count += 1
                 continue
 
-            # Compare content or metadata
-            content_changed = file_content != stage['description']
+            # Compare content hash or metadata
+            content_changed = record.content_hash != stage.get('content_hash')
             title_changed = metadata and title != stage.get('title', '')
             # Always check if next_button_title has changed, even if metadata is None
             # This ensures we can update next_button_title to null if needed
@@ -505,26 +723,39 @@ def main():
             need_enabled = (stage.get('enabled') is False)
             # Check if project_id differs
             project_id_changed = project_info and (stage.get('project_id') != project_info['id'])
+            # A renamed file keeps its stage ID, but its order number may have changed
+            order_changed = file_info['order_num'] != stage.get('order_num')
 
-            if content_changed or title_changed or next_button_changed or github_url_changed or need_enabled or project_id_changed:
-                # Create a list of changed fields for detailed logging
+            if content_changed or title_changed or next_button_changed or github_url_changed or need_enabled or project_id_changed or order_changed:
+                # Create a list of changed fields for detailed logging, and send only the changed columns
                 changes = []
+                update_data = {}
                 if content_changed:
                     changes.append("content")
+                    update_data["description"] = read_stage_content(html_file)
+                    update_data["content_hash"] = record.content_hash
                 if title_changed:
                     changes.append("title")
+                    update_data["title"] = title
                 if next_button_changed:
                     changes.append("next_button_title")
+                    update_data["next_button_title"] = next_button_title
                 if github_url_changed:
                     changes.append("github_file_url")
+                    update_data["github_file_url"] = github_file_url
                 if need_enabled:
                     changes.append("enabled")
+                    update_data["enabled"] = True
                 if project_id_changed:
                     changes.append("project_id")
+                    update_data["project_id"] = project_info['id']
+                if order_changed:
+                    changes.append("order_num")
+                    update_data["order_num"] = file_info['order_num']
 
                 print(f"Updating stage {stage_id} ({title}) - Changed fields: {', '.join(changes)}")
 
-                update_stage_in_supabase(stage_id, file_content, github_file_url, title, next_button_title, project_info['id'] if project_info else None)
+                writer.update_stage(stage, update_data, changes)
 
                 # Increment the appropriate counter based on whether the stage is a draft
                 if stage_id < 0:
@@ -534,53 +765,482 @@ def main():
             else:
                 print(f"No changes for stage {stage_id} ({stage.get('title', '')})")
 
-        # After processing all files in this project, disable stages missing from code
+        if IS_PULL_REQUEST and files_to_diff is not None and project_info:
+            for deleted_file in sorted(files_to_diff - {html_file for html_file, _ in stage_files}):
+                deleted_stage_files.append((project_info['id'], deleted_file))
+
+        # Rebuild the project's bundle if any of its stages changed; the hash doesn't need the HTML
+        if project_info:
+            stages_in_bundle = []
+            for html_file, file_info in stage_files:
+                if not file_info:
+                    continue
+                record = content_index.html(html_file)
+                metadata = record.metadata or {}
+                stages_in_bundle.append({
+                    "id": record.stage_id if html_file in inherited_files else file_info['id'],
+                    "order_num": file_info['order_num'],
+                    "title": metadata.get('title', file_info['title']),
+                    "next_button_title": metadata.get('next_button_title'),
+                    "content_hash": record.content_hash,
+                    "file": html_file,
+                })
+            manifest = bundle_manifest(project_info['id'], stages_in_bundle)
+            if bundle_is_outdated(manifest, snapshot['bundles'].get(project_info['id'])):
+                bundle = build_bundle_row(manifest, {stage['id']: read_stage_content(stage['file']) for stage in stages_in_bundle})
+                print(f"Bundling {bundle['stage_count']} stage(s) of {project_dir}: {bundle['size']} bytes, "
+                      f"{bundle['gzip_size']} gzip, {bundle['brotli_size'] if bundle['brotli_size'] is not None else '-'} brotli")
+                writer.upsert_bundle(bundle)
+                bundles_count += 1
+                bundle_bytes += bundle['size']
+                bundle_bytes_gzip += bundle['gzip_size']
+                bundle_bytes_brotli += bundle['brotli_size'] or 0
+
+    # Hide the live stages of the stage files deleted in the pull request. This runs once all
+    # stage IDs in code are known, so a stage moved to another project gets no tombstone.
+    for project_id, deleted_file in deleted_stage_files:
+        filename_info = parse_stage_filename(deleted_file)
+        if filename_info is None:
+            continue
+        order_num, original_id, deleted_title = filename_info
+        stage_id = -int(f"{original_id}{PR_NUMBER:05d}")
+        # Kept under another filename, or already hidden or overridden by a draft stage
+        if stage_id in stage_ids_in_code or stage_id in snapshot['stages']:
+            continue
+        print(f"Hiding stage {original_id} ({deleted_title}), deleted in this pull request")
+        writer.create_stage(stage_id, deleted_title, "", get_github_file_url(deleted_file), project_id, order_num,
+                            source_stage_id=original_id, enabled=False)
+
+    # After processing all projects, disable stages missing from code.
+    # This runs once all stage IDs in code are known, so a stage moved to another project is not disabled.
+    remote_stage_ids_by_project = {}
+    for stage in snapshot['stages'].values():
+        remote_stage_ids_by_project.setdefault(stage.get('project_id'), set()).add(stage['id'])
+
+    for _, project_info, _, _ in local_projects:
+        project_id = project_info['id']
+        # Stages that are already disabled are left alone
+        missing_stage_ids = {
+            stage_id for stage_id in remote_stage_ids_by_project.get(project_id, set()) - stage_ids_in_code
+            if snapshot['stages'][stage_id].get('enabled') is not False
+        }
+        if missing_stage_ids:
+            print(f"Disabling {len(missing_stage_ids)} stage(s) in Supabase that are missing from code for project {project_id}")
+            for missing_id in sorted(missing_stage_ids):
+                print(f"Disabling stage {missing_id} (absent in repository)")
+                writer.disable_stage(missing_id)
+
+    summary = {
+        "updated": updated_count,
+        "created": created_count,
+        "created_projects": created_projects_count,
+        "updated_projects": updated_projects_count,
+        "updated_draft": updated_count_draft,
+        "created_draft": created_count_draft,
+        "created_projects_draft": created_projects_count_draft,
+        "updated_projects_draft": updated_projects_count_draft,
+        "skipped": skipped_count,
+        "not_found": not_found_count,
+        "total_html_files": total_html_files,
+        "html_bytes": html_bytes,
+        "html_bytes_minified": html_bytes_minified,
+        "inherited_draft": inherited_count_draft,
+        "bundles": bundles_count,
+        "bundle_bytes": bundle_bytes,
+        "bundle_bytes_gzip": bundle_bytes_gzip,
+        "bundle_bytes_brotli": bundle_bytes_brotli,
+    }
+    return summary, all_draft_projects
+
+
+def save_content_index(content_index):
+    try:
+        content_index.save()
+    except Exception as e:
+        print(f"WARNING: Could not save the content index: {e}")
+    print(f"\nContent index: {content_index.hits} file(s) reused, {content_index.misses} file(s) read")
+
+
+def compute_changeset(shard=None):
+    """
+    Diff the repository (or the projects of one shard) against one remote snapshot without writing anything.
+    Returns the changeset: the pending write operations, the summary counters and the draft projects.
+    """
+    metrics.switch_phase("discovery")
+
+    # Parsed filenames, metadata and content hashes of files unchanged since the last run are reused
+    content_index = ContentIndex()
+    head_commit, local_projects = discover_content(content_index, shard)
+
+    metrics.switch_phase("remote_read")
+    snapshot = load_content_snapshot(local_projects)
+
+    # All creates, updates and disables are collected here and written in bulk by apply_changeset()
+    writer = BatchWriter()
+
+    metrics.switch_phase("diff")
+    summary, draft_projects = diff_content(local_projects, snapshot, content_index, writer)
+    metrics.switch_phase(None)
+    save_content_index(content_index)
+
+    return {
+        "version": PLAN_VERSION,
+        "commit": head_commit,
+        "pull_request": PR_NUMBER if IS_PULL_REQUEST else None,
+        "shard": shard,
+        "operations": writer.operations,
+        "summary": summary,
+        "draft_projects": draft_projects,
+    }
+
+def apply_changeset(changeset):
+    """Write all operations of a changeset in bulk, then move the sync watermark. Returns the writer.
+
+    Bulk requests run concurrently per chunk, not per project; see enlighter_sync/concurrency.py.
+
+    Written operations are recorded in the sync journal, so a restarted run for the same commit
+    doesn't write them again; the journal entries are cleared once all writes succeeded.
+    """
+    global error_occurred
+    shard = changeset.get('shard')
+    journal = None
+    if changeset['commit']:
+        # Shards of a workflow run share its run ID, but each clears only its own entries
+        journal = SyncJournal(changeset['commit'], run=f"{SYNC_RUN_ID}/shard-{shard[0]}-of-{shard[1]}") if shard else SyncJournal(changeset['commit'])
+    writer = BatchWriter(changeset['operations'], journal=journal)
+    if writer.pending_count():
+        print(f"\nWriting {writer.pending_count()} change(s) to Supabase in batches of up to {writer.chunk_size} row(s)")
+    if writer.flush():
+        error_occurred = True
+    elif journal is not None:
         try:
-            existing_stages = get_project_stages_from_supabase(project_id)
-            existing_stage_ids = {s['id'] for s in existing_stages}
-            missing_stage_ids = existing_stage_ids - stage_ids_in_code
-            if missing_stage_ids:
-                print(f"Disabling {len(missing_stage_ids)} stage(s) in Supabase that are missing from code for project {project_id}")
-                for missing_id in sorted(missing_stage_ids):
-                    print(f"Disabling stage {missing_id} (absent in repository)")
-                    try:
-                        disable_stage_in_supabase(missing_id)
-                    except Exception as e:
-                        print(f"ERROR: Failed to disable stage {missing_id}: {e}")
-                        error_occurred = True
+            journal.clear()
         except Exception as e:
-            print(f"ERROR: Could not fetch/compare project stages for disabling: {e}")
-            error_occurred = True
+            print(f"WARNING: Could not clear the sync journal: {e}")
+
+    # Move the watermark only after a fully successful sync outside pull requests;
+    # a shard only synced some projects, so the merge step moves it once all shards succeeded
+    head_commit = changeset['commit']
+    if shard:
+        print(f"\nShard {shard[0]}/{shard[1]} done; the sync watermark is moved by `sync_content.py merge`")
+    elif changeset['pull_request'] is None and not error_occurred and head_commit:
+        try:
+            set_sync_watermark(head_commit)
+            print(f"\nSync watermark set to {head_commit}")
+        except Exception as e:
+            print(f"WARNING: Could not update the sync watermark: {e}")
+
+    return writer
+
+def compute_promotion(pr_number):
+    """
+    Map the draft projects and stages of a merged pull request onto their live IDs.
+    Returns the changeset that writes the drafts' content to the live rows and deletes the drafts,
+    or None if the pull request has no drafts.
 
+    Drafts are checked against the checkout through the content index, without reading stage files:
+    a draft whose content hash differs from the merged file (e.g. the last sync of the pull request
+    failed) is stale and not promoted, and left to the regular sync.
+    """
+    from delete_drafts import decode_draft_id, get_draft_id
+
+    metrics.switch_phase("discovery")
+    content_index = ContentIndex()
+    head_commit = get_head_commit()
+    # Merged projects and the stage files of each, keyed by live ID; stage files are found by their filename
+    local_projects = {}
+    for project_dir in sorted(glob.glob("project_*")):
+        project_info = extract_project_info_from_dirname(project_dir, False, content_index)
+        stage_files = {}
+        for html_file in glob.glob(f"{project_dir}/*.html"):
+            filename_info = parse_stage_filename(html_file)
+            if filename_info is not None:
+                stage_files[filename_info[1]] = html_file
+        local_projects[project_info['id']] = (project_info, stage_files)
+    candidates = {get_draft_id(project_id, pr_number): project_id for project_id in local_projects}
+
+    metrics.switch_phase("remote_read")
+    drafts = fetch_rows_from_supabase("projects", DRAFT_PROJECT_COLUMNS, "id", candidates)
+    if not drafts:
+        metrics.switch_phase(None)
+        save_content_index(content_index)
+        return None
+    live_project_ids = {draft['id']: draft['source_project_id'] or candidates[draft['id']] for draft in drafts}
+    draft_stages = fetch_rows_from_supabase("stages", DRAFT_STAGE_COLUMNS, "project_id", live_project_ids)
+    live_stage_ids = {stage['id']: stage['source_stage_id'] or decode_draft_id(stage['id'])[0] for stage in draft_stages}
+    live_projects = {row['id']: row for row in fetch_rows_from_supabase("projects", PROJECT_COLUMNS, "id", live_project_ids.values())}
+    live_stages = {row['id']: row for row in fetch_rows_from_supabase("stages", STAGE_COLUMNS, "id", live_stage_ids.values())}
+    print(f"Loaded {len(drafts)} draft project(s) of PR #{pr_number} with {len(draft_stages)} stage(s)")
+
+    metrics.switch_phase("diff")
+    writer = BatchWriter()
+    promoted_projects = promoted_stages = hidden_stages = stale = 0
+    for draft in drafts:
+        live_id = live_project_ids[draft['id']]
+        project_info, _ = local_projects[live_id]
+        live = live_projects.get(live_id)
+        if draft['content_hash'] != project_info['content_hash']:
+            print(f"Not promoting draft project {draft['id']}: it differs from project.json of project {live_id}")
+            stale += 1
+        elif live is None:
+            print(f"Promoting draft project {draft['id']} to new project {live_id} ({project_info['title']})")
+            writer.create_project(project_info, is_draft=False)
+            promoted_projects += 1
+        elif live.get('content_hash') != project_info['content_hash']:
+            update_data = {field: project_info[field] for field in PROJECT_FINGERPRINT_FIELDS if project_info[field] != live.get(field)}
+            update_data["content_hash"] = project_info['content_hash']
+            print(f"Promoting draft project {draft['id']} to project {live_id} ({project_info['title']})")
+            writer.update_project(live, update_data)
+            promoted_projects += 1
+
+    for stage in draft_stages:
+        live_stage_id = live_stage_ids[stage['id']]
+        live_project_id = live_project_ids[stage['project_id']]
+        live_stage = live_stages.get(live_stage_id)
+        html_file = local_projects[live_project_id][1].get(live_stage_id)
+
+        if stage.get('enabled') is False:
+            # The stage was deleted in the pull request, unless the merge brought it back
+            if html_file is None and live_stage is not None and live_stage.get('enabled') is not False:
+                print(f"Disabling stage {live_stage_id} ({live_stage.get('title', '')}), deleted in PR #{pr_number}")
+                writer.disable_stage(live_stage_id)
+                hidden_stages += 1
+            continue
+        if html_file is None or content_index.html(html_file).content_hash != stage.get('content_hash'):
+            print(f"Not promoting draft stage {stage['id']}: it differs from the merged file of stage {live_stage_id}")
+            stale += 1
+            continue
+
+        promoted = {
+            "title": stage['title'],
+            "github_file_url": get_github_file_url(html_file),
+            "next_button_title": stage.get('next_button_title'),
+            "project_id": live_project_id,
+            "order_num": stage['order_num'],
+        }
+        if live_stage is None:
+            print(f"Promoting draft stage {stage['id']} to new stage {live_stage_id} ({stage['title']})")
+            writer.create_stage(live_stage_id, stage['title'], stage['description'], promoted['github_file_url'],
+                                live_project_id, stage['order_num'], stage.get('next_button_title'))
+            promoted_stages += 1
+            continue
+        update_data = {column: value for column, value in promoted.items() if value != live_stage.get(column)}
+        if stage['content_hash'] != live_stage.get('content_hash'):
+            update_data["description"] = stage['description']
+            update_data["content_hash"] = stage['content_hash']
+        if live_stage.get('enabled') is False:
+            update_data["enabled"] = True
+        if update_data:
+            print(f"Promoting draft stage {stage['id']} to stage {live_stage_id} ({stage['title']}) - Changed fields: {', '.join(update_data)}")
+            writer.update_stage(live_stage, update_data, list(update_data))
+            promoted_stages += 1
+
+    for draft in drafts:
+        writer.delete_project(draft['id'])
+    metrics.switch_phase(None)
+    save_content_index(content_index)
+
+    return {
+        "version": PLAN_VERSION,
+        "commit": head_commit,
+        # Set, so the sync watermark doesn't move: content without drafts is left to the regular sync
+        "pull_request": pr_number,
+        "operations": writer.operations,
+        "summary": {
+            "promoted_projects": promoted_projects,
+            "promoted_stages": promoted_stages,
+            "hidden_stages": hidden_stages,
+            "stale_drafts": stale,
+        },
+        "draft_projects": [],
+    }
+
+def write_shard_summary(path, changeset, writer):
+    """Write the partial summary of a run, which `sync_content.py merge` combines with those of the other shards."""
+    partial = {
+        "version": SHARD_SUMMARY_VERSION,
+        "commit": changeset['commit'],
+        "pull_request": changeset['pull_request'],
+        "shard": changeset.get('shard'),
+        "summary": changeset['summary'],
+        "draft_projects": changeset['draft_projects'],
+        "errors": [{"operation": label, "target": target, "error": error} for label, target, error in writer.failures],
+        "error_occurred": error_occurred,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(partial, f, indent=2, ensure_ascii=False)
+    print(f"\nPartial summary written to {path}")
+
+def merge_shard_summaries(partials):
+    """
+    Combine the partial summaries of the shards of one sync into a changeset without operations.
+    Returns (changeset, errors); the errors include shards that are missing or disagree on the synced commit.
+    """
+    errors = []
+    for partial in partials:
+        if partial.get('version') != SHARD_SUMMARY_VERSION:
+            errors.append(f"unsupported partial summary version {partial.get('version')}, expected {SHARD_SUMMARY_VERSION}")
+    commits = {partial['commit'] for partial in partials}
+    pull_requests = {partial['pull_request'] for partial in partials}
+    if len(commits) > 1 or len(pull_requests) > 1:
+        errors.append(f"shards synced different commits or pull requests: {sorted(map(str, commits | pull_requests))}")
+
+    shards = [tuple(partial['shard']) for partial in partials if partial.get('shard')]
+    shard_counts = {shard_count for _, shard_count in shards}
+    if len(shards) != len(partials) and partials and shards:
+        errors.append("unsharded and sharded summaries can't be merged")
+    elif len(shard_counts) > 1:
+        errors.append(f"shards of different partitions: {', '.join(f'{i}/{n}' for i, n in sorted(shards))}")
+    elif shard_counts:
+        shard_count = shard_counts.pop()
+        missing = sorted(set(range(1, shard_count + 1)) - {i for i, _ in shards})
+        if missing:
+            errors.append(f"missing shard(s) {', '.join(f'{i}/{shard_count}' for i in missing)}")
+        if len(set(shards)) != len(shards):
+            errors.append("duplicate shards")
+
+    summary = {}
+    for partial in partials:
+        for key, value in partial['summary'].items():
+            summary[key] = summary.get(key, 0) + (value or 0)
+    for partial in partials:
+        for error in partial['errors']:
+            errors.append(f"failed to {error['operation']} row {error['target']}: {error['error']}")
+        if partial['error_occurred'] and not partial['errors']:
+            shard = partial.get('shard')
+            errors.append(f"shard {shard[0]}/{shard[1]} failed" if shard else "a partial sync failed")
+
+    changeset = {
+        "version": PLAN_VERSION,
+        "commit": partials[0]['commit'] if len(commits) == 1 else None,
+        "pull_request": partials[0]['pull_request'] if len(pull_requests) == 1 else None,
+        "operations": [],
+        "summary": summary,
+        "draft_projects": sorted(
+            (project for partial in partials for project in partial['draft_projects']),
+            key=lambda project: project['original_id'],
+        ),
+    }
+    return changeset, errors
+
+def print_summary(changeset):
+    summary = changeset['summary']
     print("\nSummary:")
 
     # Regular entities
     print("\nRegular entities:")
-    print(f"- Updated content: {updated_count}")
-    print(f"- Created new stages: {created_count}")
-    print(f"- Created new projects: {created_projects_count}")
-    print(f"- Updated existing projects: {updated_projects_count}")
+    print(f"- Updated content: {summary['updated']}")
+    print(f"- Created new stages: {summary['created']}")
+    print(f"- Created new projects: {summary['created_projects']}")
+    print(f"- Updated existing projects: {summary['updated_projects']}")
 
     # Draft entities
     print("\nDraft entities:")
-    print(f"- Updated content: {updated_count_draft}")
-    print(f"- Created new stages: {created_count_draft}")
-    print(f"- Created new projects: {created_projects_count_draft}")
-    print(f"- Updated existing projects: {updated_projects_count_draft}")
+    print(f"- Updated content: {summary['updated_draft']}")
+    print(f"- Created new stages: {summary['created_draft']}")
+    print(f"- Created new projects: {summary['created_projects_draft']}")
+    print(f"- Updated existing projects: {summary['updated_projects_draft']}")
+    print(f"- Stages inherited from live projects: {summary['inherited_draft']}")
 
     # Common statistics
     print("\nCommon statistics:")
-    print(f"- Skipped (invalid filename): {skipped_count}")
-    print(f"- Not found in Supabase: {not_found_count}")
-    print(f"- Total processed: {total_html_files}")
+    print(f"- Skipped (invalid filename): {summary['skipped']}")
+    print(f"- Not found in Supabase: {summary['not_found']}")
+    print(f"- Total processed: {summary['total_html_files']}")
+    if summary['html_bytes']:
+        saved = summary['html_bytes'] - summary['html_bytes_minified']
+        print(f"- Stage HTML: {summary['html_bytes']} bytes, {summary['html_bytes_minified']} bytes minified ({100 * saved / summary['html_bytes']:.1f}% saved)")
+    if summary['bundles']:
+        print(f"- Project bundles written: {summary['bundles']} ({summary['bundle_bytes']} bytes, "
+              f"{summary['bundle_bytes_gzip']} gzip, {summary['bundle_bytes_brotli'] or '-'} brotli)")
 
     # Output all draft projects for GitHub Actions
-    if all_draft_projects:
+    if changeset['draft_projects']:
         print("\nDraft projects:")
-        for project in all_draft_projects:
+        for project in changeset['draft_projects']:
             # Format: DRAFT_PROJECT:<draft_id>:<original_id>:<title>:<pr_number>
             print(f"DRAFT_PROJECT:{project['draft_id']}:{project['original_id']}:{project['title']}:{project['pr_number']}")
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sync project and stage content to Supabase.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("sync", help="Diff the repository against Supabase and write all changes (default)")
+    plan_parser = subparsers.add_parser("plan", help="Diff the repository against Supabase and save the changes as a JSON plan, without writing")
+    plan_parser.add_argument("--output", default="sync_plan.json", help="Path of the plan file (default: sync_plan.json)")
+    apply_parser = subparsers.add_parser("apply", help="Write the changes of a saved plan, without diffing again")
+    apply_parser.add_argument("plan", help="Path of the plan file")
+    promote_parser = subparsers.add_parser("promote", help="Write the drafts of a merged pull request to the live projects and stages, and delete the drafts")
+    promote_parser.add_argument("--pr", type=int, required=True, help="Number of the merged pull request")
+    merge_parser = subparsers.add_parser("merge", help="Combine the partial summaries of the shards of a sync into its final report, and move the sync watermark")
+    merge_parser.add_argument("summaries", nargs="+", help="Paths of the partial summaries")
+    parser.add_argument("--shard", type=parse_shard, help="Only sync the projects of shard i of N (`i/N`), for N workers that sync disjoint subsets")
+    parser.add_argument("--summary-output", help="Write the counters, errors and draft projects of the run as a JSON partial summary")
+    args = parser.parse_args(argv)
+    metrics.start("sync_content")
+
+    if args.command == "merge":
+        partials = []
+        for path in args.summaries:
+            with open(path, 'r', encoding='utf-8') as f:
+                partials.append(json.load(f))
+        changeset, errors = merge_shard_summaries(partials)
+        print(f"Merged {len(partials)} partial summar{'y' if len(partials) == 1 else 'ies'}")
+        print_summary(changeset)
+        metrics.set_counters(changeset['summary'])
+        if errors:
+            print("\nERROR: One or more errors occurred during synchronization. Failing CI.")
+            for error in errors:
+                print(f"- {error}")
+            exit(1)
+        if changeset['pull_request'] is None and changeset['commit']:
+            set_sync_watermark(changeset['commit'])
+            print(f"\nSync watermark set to {changeset['commit']}")
+        return
+
+    if args.command == "promote":
+        changeset = compute_promotion(args.pr)
+        if changeset is None:
+            print(f"No draft projects of PR #{args.pr} found, nothing to promote")
+            return
+        writer = apply_changeset(changeset)
+        summary = changeset['summary']
+        print("\nPromotion summary:")
+        print(f"- Promoted projects: {summary['promoted_projects']}")
+        print(f"- Promoted stages: {summary['promoted_stages']}")
+        print(f"- Disabled stages: {summary['hidden_stages']}")
+        print(f"- Stale drafts left to the regular sync: {summary['stale_drafts']}")
+        print(f"- Deleted draft projects: {writer.deleted_projects}, draft stages: {writer.deleted_stages}")
+        metrics.set_counters({**summary, "deleted_projects": writer.deleted_projects, "deleted_stages": writer.deleted_stages})
+        if error_occurred:
+            print("\nERROR: One or more errors occurred during the promotion. Failing CI.")
+            exit(1)
+        return
+
+    if args.command == "apply":
+        with open(args.plan, 'r', encoding='utf-8') as f:
+            changeset = json.load(f)
+        if changeset.get('version') != PLAN_VERSION:
+            print(f"ERROR: Unsupported plan version {changeset.get('version')} in {args.plan}, expected {PLAN_VERSION}")
+            exit(1)
+        head_commit = get_head_commit()
+        if changeset['commit'] and head_commit and changeset['commit'] != head_commit:
+            print(f"WARNING: Plan was computed at commit {changeset['commit']}, but HEAD is {head_commit}")
+        print(f"Applying plan {args.plan} with {len(changeset['operations'])} operation(s)")
+        writer = apply_changeset(changeset)
+    elif args.command == "plan":
+        changeset = compute_changeset(args.shard)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(changeset, f, indent=2, ensure_ascii=False)
+        print(f"\nPlan with {len(changeset['operations'])} operation(s) written to {args.output}; nothing was written to Supabase")
+    else:
+        changeset = compute_changeset(args.shard)
+        writer = apply_changeset(changeset)
+
+    print_summary(changeset)
+    metrics.set_counters(changeset['summary'])
+    if args.summary_output and args.command != "plan":
+        write_shard_summary(args.summary_output, changeset, writer)
+
     # If any non-fatal errors were recorded, fail the CI with non-zero exit
     if error_occurred:
         print("\nERROR: One or more errors occurred during synchronization. Failing CI.")
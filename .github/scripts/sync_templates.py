@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 import os
 import glob
-from supabase import create_client
-import datetime
+import argparse
 
-# Initialize Supabase client
-url = os.environ.get("SUPABASE_URL")
-key = os.environ.get("SUPABASE_KEY")
-supabase = create_client(url, key)
+from enlighter_sync.backends import get_backend
+from enlighter_sync.content_index import ContentIndex
+from enlighter_sync.metrics import metrics
+from enlighter_sync.snapshot_cache import get_snapshot_cache
+from enlighter_sync.writer import BatchWriter
+
+# All templates are read in pages, as PostgREST caps a single response (1000 rows by default)
+TEMPLATE_PAGE_SIZE = int(os.environ.get("SYNC_PAGE_SIZE", "1000"))
 
 def extract_name_from_filename(filename):
     """Extract template name from filename."""
@@ -17,95 +20,137 @@ def extract_name_from_filename(filename):
         return base_name[:-5] # Remove .html extension
     return None
 
-def get_template_from_supabase(template_name):
-    """Get template from Supabase by name."""
-    response = (
-        supabase.table("content_templates")
-        .select("id, name, template")
-        .eq("name", template_name)
-        .execute()
-    )
-    
-    if response.data and len(response.data) > 0:
-        return response.data[0]
-    return None
+def read_template_content(template_file):
+    """Read the HTML content of a template file, to be written to Supabase."""
+    with open(template_file, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def get_all_templates_from_supabase():
+    """Get the fingerprints of all templates in Supabase, keyed by name (the template bodies are not downloaded)."""
+    templates = []
+    while True:
+        response = (
+            get_backend().table("content_templates")
+            .select("id, name, content_hash")
+            .order("id")
+            .range(len(templates), len(templates) + TEMPLATE_PAGE_SIZE - 1)
+            .execute()
+        )
+        templates.extend(response.data)
+        if len(response.data) < TEMPLATE_PAGE_SIZE:
+            return {template['name']: template for template in templates}
 
-def update_template_in_supabase(template_name, template_content):
-    """Update template content in Supabase."""
-    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
-    response = (
-        supabase.table("content_templates")
-        .update({"template": template_content, "updated_at": now})
-        .eq("name", template_name)
-        .execute()
-    )
-    return response
-
-def create_template_in_supabase(template_name, template_content):
-    """Create a new template in Supabase."""
-    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
-    response = (
-        supabase.table("content_templates")
-        .insert({
-            "name": template_name, 
-            "template": template_content,
-            # created_at and updated_at might be auto-set by db trigger
-            # "created_at": now, 
-            # "updated_at": now 
-        })
-        .execute()
-    )
-    return response
-
-def main():
+def discover_templates(content_index):
+    """
+    Find the template files and get their content hash from the content index, which reads a file only if it changed.
+    Returns the list of (template name, template file, content hash) and the number of skipped files.
+    """
     # Find all HTML files in the templates directory
     template_files = glob.glob("templates/*.html")
     print(f"Found {len(template_files)} template files in templates/")
-    
-    created_count = 0
-    updated_count = 0
+
+    local_templates = []
     skipped_count = 0
-    
     for template_file in template_files:
         # Extract name from filename
         template_name = extract_name_from_filename(template_file)
-        
+
         if not template_name:
             print(f"Skipping {template_file}: Invalid filename format")
             skipped_count += 1
             continue
-        
-        # Read HTML content from file
+
         try:
-            with open(template_file, 'r', encoding='utf-8') as f:
-                file_content = f.read()
+            content_hash = content_index.html(template_file).content_hash
         except Exception as e:
             print(f"Error reading {template_file}: {e}")
             skipped_count += 1
             continue
+        local_templates.append((template_name, template_file, content_hash))
+    return local_templates, skipped_count
 
-        # Get existing template from Supabase
-        existing_template = get_template_from_supabase(template_name)
-        
+def load_template_snapshot():
+    """Load the fingerprints of all templates from Supabase in one paged read, or from the snapshot cache."""
+    cache = get_snapshot_cache()
+    if cache is not None:
+        return {template['name']: template for template in cache.select("content_templates", "id, name, content_hash")}
+    return get_all_templates_from_supabase()
+
+def diff_templates(local_templates, remote_templates, writer):
+    """
+    Compare the templates with the remote snapshot, adding creates and updates to the writer,
+    and report the remote templates that are missing from templates/. Returns (created, updated, missing).
+    """
+    created_count = 0
+    updated_count = 0
+    for template_name, template_file, content_hash in local_templates:
+        existing_template = remote_templates.get(template_name)
         if existing_template:
-            # Compare content and update if different
-            if file_content != existing_template['template']:
+            # Compare content hash and update if different
+            if content_hash != existing_template['content_hash']:
                 print(f"Updating template '{template_name}'")
-                update_template_in_supabase(template_name, file_content)
+                writer.update_template(existing_template, read_template_content(template_file))
                 updated_count += 1
             else:
                 print(f"No changes for template '{template_name}'")
         else:
             # Create new template
             print(f"Creating new template '{template_name}'")
-            create_template_in_supabase(template_name, file_content)
+            writer.create_template(template_name, read_template_content(template_file))
             created_count += 1
-            
+
+    # Templates are referenced by name from the app, so missing ones are reported rather than deleted
+    local_names = {template_name for template_name, _, _ in local_templates}
+    missing_names = sorted(set(remote_templates) - local_names)
+    for template_name in missing_names:
+        print(f"WARNING: Template '{template_name}' exists in Supabase but not in templates/")
+    return created_count, updated_count, len(missing_names)
+
+def print_summary(counters):
     print("\nSummary:")
-    print(f"- Created: {created_count}")
-    print(f"- Updated: {updated_count}")
-    print(f"- Skipped: {skipped_count}")
-    print(f"- Total processed: {len(template_files)}")
+    print(f"- Created: {counters['created']}")
+    print(f"- Updated: {counters['updated']}")
+    print(f"- Skipped: {counters['skipped']}")
+    print(f"- Missing from templates/: {counters['missing']}")
+    print(f"- Total processed: {counters['total_processed']}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sync the templates in templates/ to Supabase.")
+    parser.parse_args(argv)
+    metrics.start("sync_templates")
+    metrics.switch_phase("discovery")
+
+    # Content hashes of templates unchanged since the last run are reused
+    content_index = ContentIndex()
+    local_templates, skipped_count = discover_templates(content_index)
+
+    metrics.switch_phase("remote_read")
+    remote_templates = load_template_snapshot()
+
+    metrics.switch_phase("diff")
+    writer = BatchWriter()
+    created_count, updated_count, missing_count = diff_templates(local_templates, remote_templates, writer)
+    metrics.switch_phase(None)
+
+    try:
+        content_index.save()
+    except Exception as e:
+        print(f"WARNING: Could not save the content index: {e}")
+
+    failures = writer.flush()
+
+    counters = {
+        "created": created_count,
+        "updated": updated_count,
+        "skipped": skipped_count,
+        "missing": missing_count,
+        "total_processed": len(local_templates) + skipped_count,
+    }
+    metrics.set_counters(counters)
+    print_summary(counters)
+    if failures:
+        print("\nERROR: One or more templates could not be written. Failing CI.")
+        exit(1)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
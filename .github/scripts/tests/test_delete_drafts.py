@@ -0,0 +1,50 @@
+"""Selection of the draft projects swept by `delete_drafts.py sweep`.
+
+Run from the repository root with:
+    python -m unittest discover -s .github/scripts/tests
+"""
+import contextlib
+import datetime
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from delete_drafts import get_draft_id, select_drafts_to_sweep  # noqa: E402
+
+
+def days_ago(days):
+    return (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)).isoformat()
+
+
+def sweep(draft_projects, open_pull_requests, max_age_days=None):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return select_drafts_to_sweep(draft_projects, open_pull_requests, max_age_days)
+
+
+class SelectDraftsToSweepTest(unittest.TestCase):
+    def drafts(self, *ids):
+        return [{"id": draft_id, "title": f"Draft {draft_id}"} for draft_id in ids]
+
+    def test_drafts_of_closed_pull_requests_are_deleted(self):
+        drafts = self.drafts(get_draft_id(5, 8), get_draft_id(6, 8), get_draft_id(5, 9))
+        self.assertEqual(sweep(drafts, {9: None}), [get_draft_id(5, 8), get_draft_id(6, 8)])
+
+    def test_drafts_of_open_pull_requests_are_kept_without_max_age(self):
+        self.assertEqual(sweep(self.drafts(get_draft_id(5, 8)), {8: days_ago(365)}), [])
+
+    def test_drafts_are_aged_by_pull_request_activity(self):
+        drafts = self.drafts(get_draft_id(5, 8), get_draft_id(5, 9))
+        self.assertEqual(sweep(drafts, {8: days_ago(30), 9: days_ago(1)}, max_age_days=14), [get_draft_id(5, 8)])
+
+    def test_drafts_of_pull_requests_without_known_activity_are_kept(self):
+        self.assertEqual(sweep(self.drafts(get_draft_id(5, 8)), {8: None}, max_age_days=14), [])
+
+    def test_ids_that_are_not_draft_ids_are_skipped(self):
+        self.assertEqual(sweep(self.drafts(-42), {}), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+"""Minification of stage HTML.
+
+Run from the repository root with:
+    python -m unittest discover -s .github/scripts/tests
+"""
+import glob
+import os
+import sys
+import unittest
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(SCRIPTS_DIR))
+sys.path.insert(0, SCRIPTS_DIR)
+
+from enlighter_sync.minify import minify_html  # noqa: E402
+
+SAMPLES = [
+    "",
+    "<p>Hello</p>",
+    '<!-- Enlighter Metainfo\n{"title": "Stage"}\n-->\n\n  <p>  Hello,\n\n   world  </p>\r\n',
+    "<div>\n  <!-- a comment -->\n  <p>text</p>  <!-- another -->  more\t\ttext\n</div>",
+    "<pre>\n  keep   this\n</pre>\n<code>a  b</code> <script>if (a  <  b) {}</script>",
+    "a <!-- x -->  <!-- y --> b",
+    "text\u00a0\u00a0with non-breaking spaces\f\f",
+]
+
+
+class MinifyHtmlTest(unittest.TestCase):
+    def test_minify_is_idempotent(self):
+        for sample in SAMPLES:
+            with self.subTest(sample=sample):
+                minified = minify_html(sample)
+                self.assertEqual(minify_html(minified), minified)
+
+    def test_minify_is_idempotent_on_stage_files(self):
+        stage_files = sorted(glob.glob(os.path.join(REPOSITORY_ROOT, "project_*", "*.html")))
+        for stage_file in stage_files:
+            with open(stage_file, "r", encoding="utf-8") as f:
+                minified = minify_html(f.read())
+            with self.subTest(stage_file=os.path.relpath(stage_file, REPOSITORY_ROOT)):
+                self.assertEqual(minify_html(minified), minified)
+
+    def test_comments_and_whitespace_are_removed(self):
+        self.assertEqual(minify_html("<div>\n  <!-- note -->\n  <p>a   b</p>\n</div>\n"), "<div>\n<p>a b</p>\n</div>\n")
+
+    def test_metadata_and_raw_elements_are_kept(self):
+        html = '<!-- Enlighter Metainfo\n{"title": "Stage"}\n-->\n<pre>  a\n\n  b</pre>\n'
+        self.assertEqual(minify_html(html), html)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+"""Pull request sync, promotion and incremental push sync against a local SQLite backend.
+
+Run from the repository root with:
+    python -m unittest discover -s .github/scripts/tests
+"""
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from test_sharding import SCRIPTS_DIR, write_project
+
+from delete_drafts import get_draft_id  # noqa: E402
+
+PR_NUMBER = 8
+
+
+def draft_id(original_id):
+    return get_draft_id(original_id, PR_NUMBER)
+
+
+class PullRequestSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="enlighter-pr-test-")
+        self.database = os.path.join(self.root, "sync.db")
+        self.env = {
+            key: value for key, value in os.environ.items()
+            if key not in ("GITHUB_EVENT_NAME", "PR_NUMBER", "SYNC_FULL", "SYNC_SNAPSHOT_CACHE", "SYNC_WATERMARK_FILE")
+        }
+        self.env["SYNC_BACKEND"] = f"sqlite:{self.database}"
+        self.git("init", "-q", "-b", "main")
+        self.git("config", "user.name", "Test")
+        self.git("config", "user.email", "test@example.com")
+        with open(os.path.join(self.root, ".gitignore"), "w", encoding="utf-8") as f:
+            f.write("sync.db\n.enlighter_index.json\n")
+        self.project_dir = write_project(self.root, 5, [1001, 1002, 1003])
+        self.commit("Add project 5")
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def git(self, *args):
+        result = subprocess.run(["git", *args], cwd=self.root, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout
+
+    def commit(self, message):
+        self.git("add", "-A")
+        self.git("commit", "-q", "-m", message)
+
+    def sync_content(self, *args, **env):
+        result = subprocess.run(
+            [sys.executable, os.path.join(SCRIPTS_DIR, "sync_content.py"), *args],
+            cwd=self.root, env={**self.env, **env}, capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        return result.stdout
+
+    def write_stage(self, filename, text):
+        stage_id = filename.split("_")[1]
+        with open(os.path.join(self.project_dir, filename), "w", encoding="utf-8") as f:
+            f.write(f'<!-- Enlighter Metainfo\n{{"title": "Stage {stage_id}"}}\n-->\n<p>{text}</p>\n')
+
+    def stages(self):
+        with sqlite3.connect(self.database) as connection:
+            rows = connection.execute("SELECT id, project_id, enabled, source_stage_id, description FROM stages").fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+    def test_pull_request_is_promoted_then_synced_incrementally(self):
+        self.sync_content()
+        self.git("update-ref", "refs/remotes/origin/main", "HEAD")
+        live = self.stages()
+        self.assertEqual(sorted(live), [1001, 1002, 1003])
+
+        # The pull request changes stage 1002, deletes stage 1003 and adds stage 1004
+        self.git("checkout", "-q", "-b", "pr")
+        self.write_stage("2_1002_stage.html", "Changed in the pull request")
+        os.remove(os.path.join(self.project_dir, "3_1003_stage.html"))
+        self.write_stage("3_1004_stage.html", "Added in the pull request")
+        self.commit("Change project 5")
+        self.sync_content(GITHUB_EVENT_NAME="pull_request_target", PR_NUMBER=str(PR_NUMBER))
+
+        stages = self.stages()
+        # Copy-on-write: the unchanged stage 1001 is inherited, so it has no draft row
+        self.assertNotIn(draft_id(1001), stages)
+        self.assertEqual(stages[draft_id(1002)][:3], (draft_id(5), 1, 1002))
+        self.assertIn("Changed in the pull request", stages[draft_id(1002)][3])
+        self.assertEqual(stages[draft_id(1003)][:3], (draft_id(5), 0, 1003))
+        self.assertEqual(stages[draft_id(1004)][:3], (draft_id(5), 1, 1004))
+        # Live rows are left alone until the pull request is merged
+        self.assertEqual({stage_id: stages[stage_id] for stage_id in live}, live)
+
+        self.git("checkout", "-q", "main")
+        self.git("merge", "-q", "--ff-only", "pr")
+        self.sync_content("promote", "--pr", str(PR_NUMBER))
+
+        stages = self.stages()
+        self.assertEqual(sorted(stages), [1001, 1002, 1003, 1004])
+        self.assertIn("Changed in the pull request", stages[1002][3])
+        self.assertEqual(stages[1003][1], 0)
+        self.assertEqual(stages[1004][:2], (5, 1))
+        with sqlite3.connect(self.database) as connection:
+            self.assertEqual(connection.execute("SELECT id FROM projects").fetchall(), [(5,)])
+
+        # The push sync of the merge finds everything already promoted
+        output = self.sync_content(GITHUB_EVENT_NAME="push")
+        self.assertIn("Incremental sync from watermark", output)
+        self.assertEqual(self.stages(), stages)
+
+        self.write_stage("1_1001_stage.html", "Changed after the merge")
+        self.commit("Change stage 1001")
+        output = self.sync_content(GITHUB_EVENT_NAME="push")
+        self.assertIn("Incremental sync from watermark", output)
+        self.assertIn("Changed after the merge", self.stages()[1001][3])
+        self.assertEqual({stage_id: row for stage_id, row in self.stages().items() if stage_id != 1001},
+                         {stage_id: row for stage_id, row in stages.items() if stage_id != 1001})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+"""Sharded content sync against a local SQLite backend.
+
+Run from the repository root with:
+    python -m unittest discover -s .github/scripts/tests
+"""
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPTS_DIR)
+
+from sync_content import get_project_shard  # noqa: E402
+
+
+def write_project(root, project_id, stage_ids):
+    project_dir = os.path.join(root, f"project_{project_id}_test")
+    os.makedirs(project_dir)
+    with open(os.path.join(project_dir, "project.json"), "w", encoding="utf-8") as f:
+        json.dump({"id": project_id, "title": f"Project {project_id}"}, f)
+    for order_num, stage_id in enumerate(stage_ids, start=1):
+        with open(os.path.join(project_dir, f"{order_num}_{stage_id}_stage.html"), "w", encoding="utf-8") as f:
+            f.write(f'<!-- Enlighter Metainfo\n{{"title": "Stage {stage_id}"}}\n-->\n<p>Stage {stage_id}</p>\n')
+    return project_dir
+
+
+class ShardedSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="enlighter-shard-test-")
+        self.database = os.path.join(self.root, "sync.db")
+        self.env = {
+            key: value for key, value in os.environ.items()
+            if key not in ("GITHUB_EVENT_NAME", "PR_NUMBER", "SYNC_SNAPSHOT_CACHE", "SYNC_WATERMARK_FILE")
+        }
+        self.env["SYNC_BACKEND"] = f"sqlite:{self.database}"
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def sync_content(self, *args):
+        result = subprocess.run(
+            [sys.executable, os.path.join(SCRIPTS_DIR, "sync_content.py"), *args],
+            cwd=self.root, env=self.env, capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        return result.stdout
+
+    def stage_row(self, stage_id):
+        with sqlite3.connect(self.database) as connection:
+            return connection.execute("SELECT project_id, enabled FROM stages WHERE id = ?", (stage_id,)).fetchone()
+
+    def test_stage_moved_to_a_project_of_another_shard_stays_enabled(self):
+        source_id = next(project_id for project_id in range(1, 100) if get_project_shard(project_id, 2) == 1)
+        target_id = next(project_id for project_id in range(1, 100) if get_project_shard(project_id, 2) == 2)
+        source_dir = write_project(self.root, source_id, [1001, 1002])
+        target_dir = write_project(self.root, target_id, [2001])
+        self.sync_content()
+        self.assertEqual(self.stage_row(1002), (source_id, 1))
+
+        shutil.move(os.path.join(source_dir, "2_1002_stage.html"), os.path.join(target_dir, "2_1002_stage.html"))
+        # Concurrent workers: both shards diff against the same remote state before either writes
+        self.sync_content("--shard", "1/2", "plan", "--output", "plan1.json")
+        self.sync_content("--shard", "2/2", "plan", "--output", "plan2.json")
+        self.sync_content("--summary-output", "part1.json", "apply", "plan1.json")
+        self.sync_content("--summary-output", "part2.json", "apply", "plan2.json")
+        self.sync_content("merge", "part1.json", "part2.json")
+
+        self.assertEqual(self.stage_row(1002), (target_id, 1))
+        self.assertEqual(self.stage_row(1001), (source_id, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,6 @@
 import { DOMParser } from '@xmldom/xmldom';
-import { readFileSync, readdirSync, existsSync } from 'fs';
+import { readFileSync, readdirSync, existsSync, statSync } from 'fs';
+import { execFileSync } from 'child_process';
 import { glob } from 'glob';
 import path from 'path';
 
@@ -103,6 +104,65 @@ function validateHtmlFileFormat() {
     return { invalidFiles };
 }
 
+// Load the content index written by the sync scripts (see enlighter_sync/content_index.py).
+// Returns a function that gives the cached metadata of an unchanged HTML file, or undefined.
+function loadContentIndex() {
+    const indexPath = process.env.SYNC_CONTENT_INDEX ?? '.enlighter_index.json';
+    if (!indexPath || !existsSync(indexPath)) {
+        return () => undefined;
+    }
+
+    let index;
+    try {
+        index = JSON.parse(readFileSync(indexPath, 'utf8'));
+    } catch (error) {
+        return () => undefined;
+    }
+    if (index.version !== 2) {
+        return () => undefined;
+    }
+
+    // Blob SHAs of tracked files that are unmodified in the work tree
+    let gitBlobs = null;
+    const getGitBlobs = () => {
+        if (gitBlobs === null) {
+            gitBlobs = new Map();
+            try {
+                for (const entry of execFileSync('git', ['ls-files', '-s', '-z'], { encoding: 'utf8' }).split('\0')) {
+                    const tab = entry.indexOf('\t');
+                    if (tab !== -1) {
+                        gitBlobs.set(entry.slice(tab + 1), entry.slice(0, tab).split(' ')[1]);
+                    }
+                }
+                for (const file of execFileSync('git', ['ls-files', '-m', '-z'], { encoding: 'utf8' }).split('\0')) {
+                    gitBlobs.delete(file);
+                }
+            } catch (error) {
+                gitBlobs = new Map();
+            }
+        }
+        return gitBlobs;
+    };
+
+    return (file) => {
+        const filePath = path.normalize(file);
+        // Record fields: mtime_ns, size, blob_sha, order_num, stage_id, title, metadata, content_hash, minified_size
+        const record = index.html?.[filePath];
+        if (!record) {
+            return undefined;
+        }
+        const [mtimeNs, size, blobSha, , , , metadata] = record;
+        const stat = statSync(filePath, { bigint: true });
+        if (Number(stat.mtimeNs) === mtimeNs && Number(stat.size) === size && mtimeNs < index.saved_ns) {
+            return metadata;
+        }
+        if (blobSha && getGitBlobs().get(filePath) === blobSha) {
+            return metadata;
+        }
+        return undefined;
+    };
+}
+
 // Extract metadata from HTML content
 function extractMetadataFromHtml(content) {
     const metadataPattern = /<!-- Enlighter Metainfo\s*(\{.*?\})\s*-->/s;
@@ -125,10 +185,14 @@ function validateHtmlMetadata() {
     const missingMetadata = [];
     const invalidMetadata = [];
     const missingFieldsMap = new Map(); // Map to store missing fields for each file
+    const getIndexedMetadata = loadContentIndex();
 
     for (const file of htmlFiles) {
-        const content = readFileSync(file, 'utf8');
-        const metadata = extractMetadataFromHtml(content);
+        // Files unchanged since the content index was written are not parsed again
+        let metadata = getIndexedMetadata(file);
+        if (metadata === undefined) {
+            metadata = extractMetadataFromHtml(readFileSync(file, 'utf8'));
+        }
 
         // Check if metadata exists
         if (!metadata) {